@@ -9,10 +9,10 @@ from werkzeug.security import generate_password_hash
 # 确保你的项目结构是正确的，能够找到这些模块
 from routes.auth import auth_bp
 from routes.detection import bp as detection_bp
-from routes.admin import admin_bp
+from routes.admin import admin_bp, admin_required
 from routes.test import test_bp  
 from routes.user_manage import user_admin_bp 
-from db import get_db_connection, close_db
+from db import get_db_connection, close_db, pool_stats
 
 # =============================
 # --- 1. App 初始化与核心配置 ---
@@ -51,6 +51,12 @@ app.register_blueprint(test_bp, url_prefix='/api/test')
 def index():
     return jsonify({"message": "Backend running successfully!"}), 200
 
+@app.route('/api/metrics/db')
+@admin_required  # 仅管理员可见 (jwt + role=admin)
+def db_pool_metrics():
+    """数据库连接池指标：活跃/空闲连接数、等待者数量、取连接耗时"""
+    return jsonify(pool_stats()), 200
+
 def init_admin():
     """初始化默认管理员账户"""
     # 使用 with app.app_context() 确保 g 对象可用
@@ -1,3 +1,9 @@
+import os
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 import mysql.connector
 from flask import g
 
@@ -12,46 +18,253 @@ DB_CONFIG = {
     'port': 3407
 }
 
+# --- 连接池配置 ---
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))                # 最多同时打开的连接数
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))         # 等待空闲连接的最长秒数
+POOL_IDLE_TIMEOUT = int(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))    # 空闲超过此秒数的连接直接丢弃重建
+POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', 3600))  # 连接最长存活秒数
+POOL_PING_AFTER = int(os.environ.get('DB_POOL_PING_AFTER', 30))       # 空闲超过此秒数，取出时先 ping 一次
+
+
+class PoolTimeout(Exception):
+    """在 POOL_TIMEOUT 内没有等到可用连接"""
+
+
+class PooledConnection:
+    """
+    连接代理：除 close() 外所有属性都转发给真实连接。
+    close() 把连接还回连接池 (可重复调用)，路由里原有的 conn.close() 因此不会真的断开连接。
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._autocommit_changed = False
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_') or name == 'closed':
+            object.__setattr__(self, name, value)
+        else:
+            if name == 'autocommit':
+                self._autocommit_changed = True
+            setattr(self._raw, name, value)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._pool.release(self._raw, self._created_at, self._autocommit_changed)
+
+
+class ConnectionPool:
+    """固定上限的 MySQL 连接池：取出时做健康检查，空闲/寿命超时的连接自动重建"""
+
+    def __init__(self, config, size=POOL_SIZE, timeout=POOL_TIMEOUT, idle_timeout=POOL_IDLE_TIMEOUT,
+                 max_lifetime=POOL_MAX_LIFETIME, ping_after=POOL_PING_AFTER):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._idle = deque()  # (raw, created_at, last_used)，后进先出，热连接优先复用
+        self._open = 0
+        self._waiters = 0
+        self._stats = {'checkouts': 0, 'timeouts': 0, 'created': 0, 'recycled': 0, 'broken': 0,
+                       'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self.config)
+        self._stats['created'] += 1
+        return raw, time.time()
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _healthy(self, raw, created_at, last_used):
+        now = time.time()
+        if now - last_used > self.idle_timeout or now - created_at > self.max_lifetime:
+            self._stats['recycled'] += 1
+            return False
+        if now - last_used > self.ping_after:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                self._stats['broken'] += 1
+                return False
+        return True
+
+    def checkout(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available within {self.timeout}s")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+            item = self._idle.pop() if self._idle else None
+            if item is None:
+                self._open += 1  # 先占位，建连放到锁外
+        try:
+            if item is not None:
+                raw, created_at, last_used = item
+                if not self._healthy(raw, created_at, last_used):
+                    self._discard(raw)
+                    raw, created_at = self._connect()
+            else:
+                raw, created_at = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        wait_ms = (time.perf_counter() - start) * 1000
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['wait_ms_total'] += wait_ms
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], wait_ms)
+        return PooledConnection(self, raw, created_at)
+
+    def release(self, raw, created_at, reset_autocommit=False):
+        """归还连接：未提交的事务一律回滚，被改过的 autocommit 恢复默认，连接异常则直接丢弃"""
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+            if reset_autocommit:
+                raw.autocommit = False
+            reusable = True
+        except Exception:
+            self._stats['broken'] += 1
+            reusable = False
+        with self._cond:
+            if reusable:
+                self._idle.append((raw, created_at, time.time()))
+            else:
+                self._open -= 1
+            self._cond.notify()
+        if not reusable:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._stats['checkouts']
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'active': self._open - len(self._idle),
+                'waiters': self._waiters,
+                'checkouts': checkouts,
+                'timeouts': self._stats['timeouts'],
+                'created': self._stats['created'],
+                'recycled': self._stats['recycled'],
+                'broken': self._stats['broken'],
+                'checkout_ms_avg': round(self._stats['wait_ms_total'] / checkouts, 2) if checkouts else 0,
+                'checkout_ms_max': round(self._stats['wait_ms_max'], 2)
+            }
+
+
+pool = ConnectionPool(DB_CONFIG)
+
 def get_db_connection():
     """
     获取当前请求的数据库连接。
-    如果连接不存在，则创建一个并存储在Flask的g对象中（一个请求内的全局变量）。
+    如果连接不存在 (或已被路由提前 close 还回连接池)，则从连接池取一个并存储在Flask的g对象中。
     """
-    if 'db' not in g:
-        g.db = mysql.connector.connect(**DB_CONFIG)
+    if 'db' not in g or g.db.closed:
+        g.db = pool.checkout()
     return g.db
 
 def close_db(e=None):
     """
-    关闭当前请求的数据库连接。
+    把当前请求的数据库连接还回连接池。
     这个函数会被Flask自动调用（需要在app.py中注册）。
     """
     db = g.pop('db', None)
     
-    # 修正：这里是语法错误的地方，正确的写法是 'is not None'
     if db is not None:
         db.close()
 
+@contextmanager
+def pooled_connection():
+    """请求上下文之外 (后台线程、脚本) 使用连接池：with pooled_connection() as conn: ..."""
+    conn = pool.checkout()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def pool_stats():
+    return pool.stats()
+
+# --- 检测记录变更计数 (my-detections 的 ETag 依据) ---
+# 用户提交新记录、或其记录被删除时递增该用户的计数；管理员改动记录状态时递增全局代数。
+# 计数保存在进程内存中，PROCESS_EPOCH 保证重启后旧 ETag 不会被误判为命中。
+# 注意：因此后端必须以单进程运行 (app.run / gunicorn -w 1)；多 worker 部署时各进程的计数互不可见，
+# 会对已变化的数据返回 304。
+PROCESS_EPOCH = format(int(time.time() * 1000), 'x')
+_version_lock = threading.Lock()
+_user_versions = {}
+_generation = 0
+
+def bump_user_version(user_id):
+    with _version_lock:
+        key = int(user_id)
+        _user_versions[key] = _user_versions.get(key, 0) + 1
+
+def bump_detection_generation():
+    global _generation
+    with _version_lock:
+        _generation += 1
+
+def detections_etag(user_id, *parts):
+    """
+    生成某用户检测记录某一页的弱 ETag；parts 为分页参数。
+    ETag 含 user_id：同一浏览器切换账号后，不会因计数值相同而命中上一个用户的缓存。
+    """
+    with _version_lock:
+        version = _user_versions.get(int(user_id), 0)
+        generation = _generation
+    suffix = '-'.join(str(p) for p in parts)
+    return f'W/"{PROCESS_EPOCH}-u{int(user_id)}-{generation}-{version}-{suffix}"'
+
 # -----------------------------------------------------------------
 #  下面的函数都已修改，不再手动管理连接，代码更简洁、更安全。
 # -----------------------------------------------------------------
 
 # backend/db.py (修改后的最终版本)
-def save_detection(user_id, image_path, label, confidence=None):
-    """保存用户检测记录，并设置状态为 'pending'"""
+def save_detection(user_id, image_path, label, confidence=None, topk=None, logits_b64=None):
+    """保存用户检测记录，并设置状态为 'pending'；topk / logits_b64 来自同一次预测，供后续分析免重推理"""
     conn = get_db_connection()
     cursor = conn.cursor()
     # 注意 SQL 语句的变化：移除了 is_processed, admin_uploaded，增加了 upload_status
     # 注意 VALUES 的变化：移除了 0, 0，增加了一个新的 %s
     cursor.execute(
         """
-        INSERT INTO detections (user_id, image_path, label, confidence, upload_status)
-        VALUES (%s, %s, %s, %s, %s)
+        INSERT INTO detections (user_id, image_path, label, confidence, upload_status, topk_json, logits_b64)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
         """,
         # 在参数元组的最后，添加 'pending'
-        (user_id, image_path, label, confidence, 'pending')
+        (user_id, image_path, label, confidence, 'pending',
+         json.dumps(topk, ensure_ascii=False) if topk else None, logits_b64)
     )
     conn.commit()
+    bump_user_version(user_id)
     return True
 
 
@@ -85,5 +298,6 @@ def mark_detection_uploaded(detection_id):
         (detection_id,)
     )
     conn.commit()
+    bump_detection_generation()
     # 注意：不再需要 cursor.close() 和 conn.close()
     return True
\ No newline at end of file
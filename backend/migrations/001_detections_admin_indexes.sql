@@ -0,0 +1,17 @@
+-- 001_detections_admin_indexes.sql
+-- 管理员检测记录列表 (GET /api/admin/detections) 的键集分页索引。
+-- 每个过滤条件都配上 id，使「等值过滤 + ORDER BY d.id DESC + d.id < cursor」
+-- 可以直接在索引上倒序扫描 LIMIT 行，不随表大小变慢。
+-- 置信度区间是范围条件，无法与 id 排序共用索引，依赖其他等值条件先缩小范围。
+-- 执行: mysql -uroot -p agri < backend/migrations/001_detections_admin_indexes.sql
+
+ALTER TABLE detections
+    ADD INDEX idx_detections_processed_id (is_processed, id),
+    ADD INDEX idx_detections_label_id (label, id),
+    ADD INDEX idx_detections_status_id (upload_status, id),
+    ADD INDEX idx_detections_user_id_id (user_id, id),
+    ADD INDEX idx_detections_created_id (created_at, id);
+
+-- 按用户名过滤时按 username 查 users 表
+ALTER TABLE users
+    ADD INDEX idx_users_username (username);
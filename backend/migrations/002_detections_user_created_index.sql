@@ -0,0 +1,8 @@
+-- 002_detections_user_created_index.sql
+-- 「我的提交」(GET /api/detection/my-detections) 的键集分页索引：
+-- WHERE user_id = ? AND (created_at, id) < (cursor) ORDER BY created_at DESC, id DESC LIMIT n
+-- 可以直接在该索引上倒序扫描，不随用户记录数变慢。
+-- 执行: mysql -uroot -p agri < backend/migrations/002_detections_user_created_index.sql
+
+ALTER TABLE detections
+    ADD INDEX idx_detections_user_created (user_id, created_at, id);
@@ -0,0 +1,8 @@
+-- 003_detections_topk_logits.sql
+-- 保存预测时的 top-k 类别/概率与原始 logits (base64 编码的 float16，42 类约 112 个字符)，
+-- 之后的分析、重排序都直接读取，不需要重新推理。旧记录两列为 NULL。
+-- 执行: mysql -uroot -p agri < backend/migrations/003_detections_topk_logits.sql
+
+ALTER TABLE detections
+    ADD COLUMN topk_json JSON NULL AFTER confidence,
+    ADD COLUMN logits_b64 VARCHAR(256) NULL AFTER topk_json;
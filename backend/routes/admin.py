@@ -1,9 +1,10 @@
 # backend/routes/admin.py (完整代码)
 import os
+from datetime import datetime
 from flask import Blueprint, request, jsonify,current_app 
 from flask_jwt_extended import jwt_required, get_jwt
 from functools import wraps
-from db import get_db_connection
+from db import get_db_connection, bump_detection_generation, bump_user_version
 import requests
 
 # 创建 admin 蓝图
@@ -26,36 +27,145 @@ def admin_required(fn):
     return wrapper
 
 
-# --- 2. 获取所有检测记录 (支持过滤) ---
+# --- 2. 获取检测记录 (游标分页 + 服务端过滤) ---
 # GET /api/admin/detections?filter=all|processed|unprocessed
+#     &label=&user=&upload_status=&min_confidence=&max_confidence=&date_from=&date_to=
+#     &cursor=<上一页 next_cursor>&limit=50&fields=id,label,...
+# 返回 {items, next_cursor, approx_total}；next_cursor 为 null 表示没有更多数据
+DETECTION_FIELDS = {
+    'id': 'd.id',
+    'user_id': 'd.user_id',
+    'image_path': 'd.image_path',
+    'label': 'd.label',
+    'confidence': 'd.confidence',
+    'is_processed': 'd.is_processed',
+    'admin_uploaded': 'd.admin_uploaded',
+    'upload_status': 'd.upload_status',
+    'created_at': 'd.created_at',
+    'username': 'u.username',
+    'topk_json': 'd.topk_json',
+    'logits_b64': 'd.logits_b64',
+}
+# 不指定 fields 时返回的字段 (topk_json / logits_b64 较大，需显式请求)
+DEFAULT_DETECTION_FIELDS = [f for f in DETECTION_FIELDS if f not in ('topk_json', 'logits_b64')]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# date_from / date_to 接受的格式
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M')
+
+
+def parse_date_param(name, value):
+    """解析日期过滤参数，格式不合法时抛出 ValueError (接口返回 400)"""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"{name} 格式不合法，应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS")
+
+
+def build_detection_filters(args):
+    """
+    把查询参数转换成 WHERE 条件 (全部参数化)；返回 (条件列表, 参数列表, 是否需要关联 users)。
+    日期参数不合法时抛出 ValueError。
+    """
+    conditions, params, needs_user = [], [], False
+
+    filter_status = args.get("filter", "all", type=str).lower()
+    if filter_status == "processed":
+        conditions.append("d.is_processed = 1")
+    elif filter_status == "unprocessed":
+        conditions.append("d.is_processed = 0")
+
+    if args.get("label"):
+        conditions.append("d.label = %s")
+        params.append(args["label"])
+    if args.get("upload_status"):
+        conditions.append("d.upload_status = %s")
+        params.append(args["upload_status"])
+    if args.get("user_id", type=int) is not None:
+        conditions.append("d.user_id = %s")
+        params.append(args.get("user_id", type=int))
+    if args.get("user"):
+        conditions.append("u.username = %s")
+        params.append(args["user"])
+        needs_user = True
+    if args.get("min_confidence", type=float) is not None:
+        conditions.append("d.confidence >= %s")
+        params.append(args.get("min_confidence", type=float))
+    if args.get("max_confidence", type=float) is not None:
+        conditions.append("d.confidence <= %s")
+        params.append(args.get("max_confidence", type=float))
+    if args.get("date_from"):
+        conditions.append("d.created_at >= %s")
+        params.append(parse_date_param("date_from", args["date_from"]))
+    if args.get("date_to"):
+        conditions.append("d.created_at < %s")
+        params.append(parse_date_param("date_to", args["date_to"]))
+    return conditions, params, needs_user
+
+
+def approx_row_count(cursor, from_clause, where_clause, params):
+    """
+    用 EXPLAIN 的行数估计代替 COUNT(*)，代价与表大小无关。
+    关联 users 时计划里有多行 (按用户名过滤时 users 可能排在第一行)，只取 detections (别名 d) 那一行，
+    并按 filtered 百分比折算未走索引的过滤条件。
+    """
+    cursor.execute(f"EXPLAIN SELECT d.id {from_clause} {where_clause}", params)
+    plan = cursor.fetchall()
+    row = next((r for r in plan if r.get('table') == 'd'), None)
+    if row is None:
+        return 0
+    filtered = float(row.get('filtered') or 100.0)
+    return int(int(row['rows'] or 0) * filtered / 100.0)
+
+
 @admin_bp.route("/detections", methods=["GET"])
 @admin_required  # <-- 使用我们自定义的装饰器
 def get_detections():
-    filter_status = request.args.get("filter", "all", type=str).lower()
-    
+    limit = max(1, min(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    cursor_id = request.args.get("cursor", type=int)
+
+    # fields= 白名单投影；id 始终返回 (游标依赖它)
+    requested = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    unknown = [f for f in requested if f not in DETECTION_FIELDS]
+    if unknown:
+        return jsonify({"msg": f"未知字段: {', '.join(unknown)}"}), 400
+    fields = ['id'] + [f for f in requested if f != 'id'] if requested else DEFAULT_DETECTION_FIELDS
+
+    try:
+        conditions, params, needs_user = build_detection_filters(request.args)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    needs_user = needs_user or 'username' in fields
+    from_clause = "FROM detections d" + (" LEFT JOIN users u ON d.user_id = u.id" if needs_user else "")
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    
-    # 基础查询语句，包含用户名字段
-    base_query = """
-        SELECT 
-            d.id, d.image_path, d.label, d.confidence, 
-            d.is_processed, d.admin_uploaded, d.upload_status, 
-            d.created_at, u.username 
-        FROM detections d
-        LEFT JOIN users u ON d.user_id = u.id
-    """
 
-    if filter_status == "processed":
-        cursor.execute(f"{base_query} WHERE d.is_processed = 1 ORDER BY d.id DESC")
-    elif filter_status == "unprocessed":
-        cursor.execute(f"{base_query} WHERE d.is_processed = 0 ORDER BY d.id DESC")
-    else:  # 'all'
-        cursor.execute(f"{base_query} ORDER BY d.id DESC")
-        
-    data = cursor.fetchall()
-    # 不需要手动关闭连接
-    return jsonify(data), 200
+    # 总数估计只在第一页计算，翻页时前端沿用
+    approx_total = approx_row_count(cursor, from_clause, where_clause, params) if cursor_id is None else None
+
+    # 键集分页：WHERE d.id < 上一页最后一条的 id，不使用 OFFSET
+    page_conditions = conditions + (["d.id < %s"] if cursor_id is not None else [])
+    page_params = params + ([cursor_id] if cursor_id is not None else [])
+    page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+    select_list = ", ".join(f"{DETECTION_FIELDS[f]} AS {f}" for f in fields)
+    cursor.execute(
+        f"SELECT {select_list} {from_clause} {page_where} ORDER BY d.id DESC LIMIT %s",
+        page_params + [limit + 1]
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+
+    has_more = len(rows) > limit
+    items = rows[:limit]
+    return jsonify({
+        "items": items,
+        "next_cursor": items[-1]['id'] if has_more else None,
+        "approx_total": approx_total
+    }), 200
 
 
 # --- 3. 标记单条检测记录为"已处理" ---
@@ -74,6 +184,7 @@ def mark_processed(detect_id):
         return jsonify({"msg": f"未找到ID为 {detect_id} 的记录"}), 404
         
     conn.commit()
+    bump_detection_generation()  # 用户「我的提交」页面的 ETag 随之失效
     return jsonify({"msg": "已成功标记为已处理"}), 200
 
 
@@ -101,103 +212,230 @@ def upload_choice(detect_id):
         return jsonify({"msg": f"未找到ID为 {detect_id} 的记录"}), 404
         
     conn.commit()
+    bump_detection_generation()
     return jsonify({"msg": "操作成功", "status": upload_status_msg}), 200
 
 
 import requests  # 1. 导入 requests 库
 import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from flask import current_app, jsonify, request
+from db import pooled_connection
 # ... 其他导入
 
 # 2. 定义你的 AI 模型后台的地址
 #    如果它们运行在同一台机器但不同端口，就是类似 'http://localhost:5001/feedback'
 #    请根据你的实际部署情况修改
 AI_SERVICE_URL = 'http://127.0.0.1:8000/feedback' 
+AI_BATCH_URL = AI_SERVICE_URL + '/batch'  # 多文件批量反馈接口，旧版 AI 服务没有时回退到逐个上传
+FEEDBACK_BATCH_SIZE = int(os.environ.get('FEEDBACK_BATCH_SIZE', 32))     # 每个批量请求携带的图片数
+FEEDBACK_CONCURRENCY = int(os.environ.get('FEEDBACK_CONCURRENCY', 4))   # 同时发往 AI 服务的请求数
+FEEDBACK_TIMEOUT = 60
+MAX_FEEDBACK_JOBS = 100  # 内存中保留的最近任务数
 
-@admin_bp.route('/process_detection', methods=['POST'])
-def process_detection():
-    data = request.get_json()
-    if not data or 'ids' not in data:
-        return jsonify({'error': '请求体中缺少 "ids" 字段'}), 400
+FEEDBACK_JOBS = {}
+_jobs_lock = threading.Lock()
+_ai_session = None
 
-    detection_ids = data['ids']
-    if not isinstance(detection_ids, list):
-        return jsonify({'error': '"ids" 必须是一个列表'}), 400
 
-    upload_folder = current_app.config.get('UPLOAD_FOLDER')
-    if not upload_folder:
-        return jsonify({'error': '服务器内部配置错误: UPLOAD_FOLDER 未定义'}), 500
+def get_ai_session():
+    """与 AI 服务共用一个 keep-alive 会话，连接池大小与并发数一致"""
+    global _ai_session
+    if _ai_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FEEDBACK_CONCURRENCY)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _ai_session = session
+    return _ai_session
 
-    success_count = 0
-    failures = []
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+def update_job(job_id, **fields):
+    with _jobs_lock:
+        FEEDBACK_JOBS[job_id].update(fields)
+
 
-    for detection_id in detection_ids:
+def send_feedback_chunk(session, chunk):
+    """
+    把一组 (id, 文件路径, 标签) 发给 AI 服务，返回 (成功 id 列表, 失败列表)。
+    优先调用批量接口；AI 服务返回 404 (没有批量接口) 时逐个调用 /feedback。
+    """
+    # ExitStack：任何一个文件打开失败或请求异常时，已打开的文件都会被关闭
+    with ExitStack() as stack:
+        files = [('file', (os.path.basename(path), stack.enter_context(open(path, 'rb')), 'image/jpeg'))
+                 for _, path, _ in chunk]
+        payload = {'correct_label': [label for _, _, label in chunk], 'id': [str(i) for i, _, _ in chunk]}
+        response = session.post(AI_BATCH_URL, files=files, data=payload, timeout=FEEDBACK_TIMEOUT)
+
+    if response.status_code == 404:
+        return send_feedback_one_by_one(session, chunk)
+    if response.status_code != 200:
+        reason = f"AI 服务返回错误: {response.status_code} - {response.text[:200]}"
+        return [], [{'id': i, 'reason': reason} for i, _, _ in chunk]
+
+    succeeded, failed = [], []
+    for item in response.json().get('results', []):
+        detection_id = int(item['id'])
+        if item.get('status') == 'success':
+            succeeded.append(detection_id)
+        else:
+            failed.append({'id': detection_id, 'reason': item.get('error', 'AI 服务处理失败')})
+    answered = set(succeeded) | {f['id'] for f in failed}
+    failed.extend({'id': i, 'reason': 'AI 服务未返回该记录的结果'} for i, _, _ in chunk if i not in answered)
+    return succeeded, failed
+
+
+def send_feedback_one_by_one(session, chunk):
+    succeeded, failed = [], []
+    for detection_id, path, label in chunk:
         try:
-            # 3. 修改 SQL 查询，同时获取图片路径和正确的标签
-            cursor.execute("SELECT image_path, label FROM detections WHERE id = %s", (detection_id,))
-            record = cursor.fetchone()
+            with open(path, 'rb') as f:
+                files = {'file': (os.path.basename(path), f, 'image/jpeg')}
+                response = session.post(AI_SERVICE_URL, files=files, data={'correct_label': label},
+                                        timeout=FEEDBACK_TIMEOUT)
+            if response.status_code == 200:
+                succeeded.append(detection_id)
+            else:
+                failed.append({'id': detection_id,
+                               'reason': f"AI 服务返回错误: {response.status_code} - {response.text[:200]}"})
+        except Exception as e:
+            failed.append({'id': detection_id, 'reason': str(e)})
+    return succeeded, failed
+
+
+def run_feedback_job(app, job_id, detection_ids, upload_folder):
+    """后台线程：批量查询 → 并发批量上传 → 一次性更新成功的记录"""
+    failures = []
+    try:
+        # 3. 一次查询取出所有记录
+        with pooled_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            placeholders = ', '.join(['%s'] * len(detection_ids))
+            cursor.execute(
+                f"SELECT id, image_path, label FROM detections WHERE id IN ({placeholders})",
+                detection_ids
+            )
+            records = {row['id']: row for row in cursor.fetchall()}
+            cursor.close()
 
+        # 4. 记录/文件不存在的直接记为失败，其余按批分组
+        pending = []
+        for detection_id in detection_ids:
+            record = records.get(detection_id)
             if not record:
                 failures.append({'id': detection_id, 'reason': '记录未找到'})
                 continue
-
-            image_url_path = record['image_path']
-            # 4. 从记录中获取 correct_label
-            correct_label = record['label'] 
-
-            filename = os.path.basename(image_url_path)
+            filename = os.path.basename(record['image_path'])
             physical_file_path = os.path.join(upload_folder, filename)
-
             if not os.path.exists(physical_file_path):
                 failures.append({'id': detection_id, 'reason': f'文件不存在: {filename}'})
                 continue
-            
-            # --- 新增的调用逻辑 ---
-            # 5. 打开图片文件，并准备发送
-            with open(physical_file_path, 'rb') as f:
-                files = {'file': (filename, f, 'image/jpeg')} # 假设是 jpeg，也可以是其他类型
-                payload = {'correct_label': correct_label}
-                
-                # 6. 发送 POST 请求到 AI 模型后台
-                response = requests.post(AI_SERVICE_URL, files=files, data=payload)
-
-                # 7. 检查 AI 模型后台的响应
-                if response.status_code == 200:
-                    # 只有当 AI 后台成功接收后，我们才更新数据库状态
-                    cursor.execute("""
-                        UPDATE detections
-                        SET is_processed = TRUE,
-                            upload_status = %s
-                        WHERE id = %s
-                    """, ('uploaded', detection_id))
-                    conn.commit()
-                    current_app.logger.info(f"成功处理并发送记录 ID {detection_id} 到 AI 服务")
-                    success_count += 1
-                else:
-                    # 如果 AI 后台返回错误，记录失败
-                    conn.rollback() # 回滚事务
-                    reason = f"AI 服务返回错误: {response.status_code} - {response.text}"
-                    failures.append({'id': detection_id, 'reason': reason})
-                    current_app.logger.error(f"发送记录 ID {detection_id} 到 AI 服务失败: {reason}")
-            # --- 新增逻辑结束 ---
+            pending.append((detection_id, physical_file_path, record['label']))
+        update_job(job_id, processed=len(failures), failures=list(failures))
+
+        # 5. 有界并发发送，共用 keep-alive 会话
+        chunks = [pending[i:i + FEEDBACK_BATCH_SIZE] for i in range(0, len(pending), FEEDBACK_BATCH_SIZE)]
+        session = get_ai_session()
+        succeeded = []
+        with ThreadPoolExecutor(max_workers=FEEDBACK_CONCURRENCY) as pool:
+            futures = {pool.submit(send_feedback_chunk, session, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    ok, failed = future.result()
+                except Exception as e:
+                    ok, failed = [], [{'id': i, 'reason': str(e)} for i, _, _ in chunk]
+                succeeded.extend(ok)
+                failures.extend(failed)
+                update_job(job_id, processed=len(succeeded) + len(failures),
+                           success_count=len(succeeded), failures=list(failures))
+
+        # 6. 成功的记录一次性更新
+        if succeeded:
+            with pooled_connection() as conn:
+                cursor = conn.cursor()
+                placeholders = ', '.join(['%s'] * len(succeeded))
+                cursor.execute(f"""
+                    UPDATE detections
+                    SET is_processed = TRUE,
+                        upload_status = 'uploaded'
+                    WHERE id IN ({placeholders})
+                """, succeeded)
+                conn.commit()
+                cursor.close()
+            bump_detection_generation()
+
+        app.logger.info(f"反馈任务 {job_id} 完成: 成功 {len(succeeded)}，失败 {len(failures)}")
+        update_job(job_id, status='completed', success_count=len(succeeded),
+                   failure_count=len(failures), failures=failures, finished_at=time.time())
+    except Exception as e:
+        app.logger.error(f"反馈任务 {job_id} 失败: {e}", exc_info=True)
+        update_job(job_id, status='failed', error=str(e), failure_count=len(failures),
+                   failures=failures, finished_at=time.time())
 
-        except Exception as e:
-            conn.rollback()
-            failures.append({'id': detection_id, 'reason': str(e)})
-            current_app.logger.error(f"处理记录 ID {detection_id} 失败: {e}", exc_info=True)
 
-    cursor.close()
-    conn.close()
+@admin_bp.route('/process_detection', methods=['POST'])
+@admin_required
+def process_detection():
+    """
+    提交批量反馈任务，立即返回 job_id；进度和失败明细通过
+    GET /api/admin/process_detection/<job_id> 查询。
+    """
+    data = request.get_json()
+    if not data or 'ids' not in data:
+        return jsonify({'error': '请求体中缺少 "ids" 字段'}), 400
+
+    detection_ids = data['ids']
+    if not isinstance(detection_ids, list):
+        return jsonify({'error': '"ids" 必须是一个列表'}), 400
+    try:
+        detection_ids = list(dict.fromkeys(int(i) for i in detection_ids))  # 去重并保持顺序
+    except (TypeError, ValueError):
+        return jsonify({'error': '"ids" 中只能包含整数'}), 400
+    if not detection_ids:
+        return jsonify({'error': '"ids" 不能为空'}), 400
+
+    upload_folder = current_app.config.get('UPLOAD_FOLDER')
+    if not upload_folder:
+        return jsonify({'error': '服务器内部配置错误: UPLOAD_FOLDER 未定义'}), 500
+
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        # 只保留最近的任务，最早的先淘汰
+        while len(FEEDBACK_JOBS) >= MAX_FEEDBACK_JOBS:
+            FEEDBACK_JOBS.pop(next(iter(FEEDBACK_JOBS)))
+        FEEDBACK_JOBS[job_id] = {
+            'job_id': job_id, 'status': 'processing', 'total': len(detection_ids),
+            'processed': 0, 'success_count': 0, 'failure_count': 0, 'failures': [],
+            'created_at': time.time()
+        }
+
+    app = current_app._get_current_object()
+    threading.Thread(target=run_feedback_job, args=(app, job_id, detection_ids, upload_folder),
+                     daemon=True).start()
 
     return jsonify({
-        'message': '处理完成',
-        'success_count': success_count,
-        'failure_count': len(failures),
-        'failures': failures
-    }), 200
+        'msg': '已提交处理任务',
+        'job_id': job_id,
+        'total': len(detection_ids),
+        'status_url': f'/api/admin/process_detection/{job_id}'
+    }), 202
+
+
+@admin_bp.route('/process_detection/<job_id>', methods=['GET'])
+@admin_required  # 任务结果含每条记录的失败原因，仅管理员可查
+def process_detection_status(job_id):
+    with _jobs_lock:
+        job = FEEDBACK_JOBS.get(job_id)
+        job = dict(job) if job else None
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job), 200
 
 import functools
 from flask import Blueprint, request, jsonify
@@ -378,6 +616,7 @@ def delete_user(user_id):
 
         # 提交事务
         conn.commit()
+        bump_user_version(user_id)  # 该用户的检测记录已删除，旧 ETag 失效
 
         return jsonify({"message": f"用户 {user_id} 已成功删除"}), 200
 
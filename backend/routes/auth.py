@@ -25,7 +25,7 @@ def register():
     cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed_pw))
     conn.commit()
     cursor.close()
-    conn.close()
+    conn.close()  # 连接池代理：还回连接池，不会断开
 
     return jsonify({'message': '注册成功'}), 200
 
@@ -43,7 +43,7 @@ def login():
     cursor.execute("SELECT * FROM users WHERE username=%s", (username,))
     user = cursor.fetchone()
     cursor.close()
-    conn.close()
+    conn.close()  # 提前还回连接池，校验密码期间不占用连接
 
     if not user or not check_password_hash(user['password'], password):
         return jsonify({'message': '用户名或密码错误'}), 401
@@ -1,11 +1,27 @@
 # backend/routes/detection.py (完整代码)
 
-from flask import Blueprint, request, jsonify
+import base64
+import binascii
+from datetime import datetime
+from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from db import save_detection
+from db import save_detection, get_db_connection, detections_etag
 
 bp = Blueprint('detection', __name__)
 
+LOGITS_B64_MAX_LEN = 256  # detections.logits_b64 为 VARCHAR(256)
+
+
+def is_valid_logits_b64(value):
+    """logits_b64 必须是不超过列宽的合法 base64 字符串"""
+    if not isinstance(value, str) or len(value) > LOGITS_B64_MAX_LEN:
+        return False
+    try:
+        base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return False
+    return True
+
 @bp.route('/save', methods=['POST'])
 @jwt_required()
 def save_user_detection():
@@ -23,35 +39,71 @@ def save_user_detection():
     if not image_path or not label:
         return jsonify({"msg": "缺少 'image_path' 或 'label' 参数"}), 400
 
+    logits_b64 = data.get("logits_b64")
+    if logits_b64 is not None and not is_valid_logits_b64(logits_b64):
+        return jsonify({"msg": f"'logits_b64' 必须是长度不超过 {LOGITS_B64_MAX_LEN} 的 base64 字符串"}), 400
+
     # 调用 db.py 中的函数来保存数据
     save_detection(
         user_id=int(user_id),
         image_path=image_path,
         label=label,
-        confidence=data.get("confidence")
+        confidence=data.get("confidence"),
+        topk=data.get("topk"),
+        logits_b64=logits_b64
     )
 
     return jsonify({"msg": "保存成功"}), 200
 
 # backend/routes/detection.py (新增的代码)
 
+MY_DETECTIONS_PAGE_SIZE = 20
+MY_DETECTIONS_MAX_PAGE_SIZE = 100
+CURSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def parse_cursor(raw):
+    """游标格式为 '<created_at>|<id>'，解析失败返回 None"""
+    try:
+        created_at, detection_id = raw.rsplit('|', 1)
+        datetime.strptime(created_at, CURSOR_TIME_FORMAT)
+        return created_at, int(detection_id)
+    except (ValueError, AttributeError):
+        return None
+
+
 @bp.route('/my-detections', methods=['GET'])
 @jwt_required()
 def get_my_detections():
     """
-    获取当前登录用户提交的所有检测反馈记录。
+    分页获取当前登录用户提交的检测反馈记录。
+    GET /api/detection/my-detections?cursor=<上一页 next_cursor>&limit=20
+    返回 {items, next_cursor}；数据未变化时按 If-None-Match 直接返回 304，不查询数据库。
     """
     # 1. 从 JWT Token 中获取当前用户的 ID
     user_id = get_jwt_identity()
+    limit = max(1, min(request.args.get('limit', MY_DETECTIONS_PAGE_SIZE, type=int), MY_DETECTIONS_MAX_PAGE_SIZE))
+    raw_cursor = request.args.get('cursor')
+    cursor_key = parse_cursor(raw_cursor) if raw_cursor else None
+    if raw_cursor and cursor_key is None:
+        return jsonify({"msg": "无效的 cursor 参数"}), 400
 
-    # 2. 连接数据库
-    from db import get_db_connection
+    # 2. 该用户记录没有变化时直接 304
+    etag = detections_etag(user_id, raw_cursor or '', limit)
+    if etag in request.headers.get('If-None-Match', ''):
+        response = make_response('', 304)
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Authorization'
+        return response
+
+    # 3. 键集分页：按 (created_at, id) 倒序，命中 idx_detections_user_created 索引
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True) # 使用 dictionary=True 可以让返回结果是字典形式
-
-    # 3. 编写 SQL 查询语句，根据 user_id 筛选记录
-    #    我们选取了所有需要的字段，包括了新的 'upload_status'
-    query = """
+    conditions, params = "user_id = %s", [user_id]
+    if cursor_key:
+        conditions += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params += [cursor_key[0], cursor_key[0], cursor_key[1]]
+    cursor.execute(f"""
         SELECT 
             id, 
             image_path, 
@@ -60,18 +112,22 @@ def get_my_detections():
             upload_status, 
             created_at 
         FROM detections 
-        WHERE user_id = %s 
-        ORDER BY created_at DESC
-    """
-    
-    # 4. 执行查询
-    cursor.execute(query, (user_id,))
-    
-    # 5. 获取所有查询结果
-    user_detections = cursor.fetchall()
-    
+        WHERE {conditions}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cursor.fetchall()
     cursor.close()
-    
-    # 6. 将结果以 JSON 格式返回给前端
-    return jsonify(user_detections), 200
 
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = f"{last['created_at'].strftime(CURSOR_TIME_FORMAT)}|{last['id']}"
+
+    # 4. 返回结果，浏览器每次都带 If-None-Match 重新校验
+    response = make_response(jsonify({"items": items, "next_cursor": next_cursor}), 200)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Authorization'  # 响应内容取决于 Token 对应的用户
+    return response
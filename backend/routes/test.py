@@ -1,6 +1,10 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify, send_from_directory, Response, stream_with_context
 from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+import json
 import os
+import uuid
 import requests
 
 test_bp = Blueprint('test', __name__)
@@ -9,6 +13,45 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '../uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 AI_SERVICE_URL = "http://127.0.0.1:8000/predict"
+AI_PREDICT_PARAMS = {'topk': 3, 'logits': 1}  # 同一次前向附带 top-k 与 logits，保存时一起入库
+AI_CONCURRENCY = int(os.environ.get('AI_PREDICT_CONCURRENCY', 8))  # 同时发往 AI 服务的预测请求数
+AI_TIMEOUT = 30
+
+# 预测请求与落盘各用一个线程池；AI 请求共用一个 keep-alive 会话
+_predict_pool = ThreadPoolExecutor(max_workers=AI_CONCURRENCY, thread_name_prefix='ai-predict')
+_disk_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-writer')
+_ai_session = requests.Session()
+_ai_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=AI_CONCURRENCY))
+
+
+def write_upload(filepath, data):
+    with open(filepath, 'wb') as f:
+        f.write(data)
+
+
+def predict_bytes(filename, data):
+    """把内存中的图片直接转发给 AI 服务，不再从磁盘重新读取"""
+    try:
+        res = _ai_session.post(AI_SERVICE_URL, params=AI_PREDICT_PARAMS,
+                               files={'file': (filename, data)}, timeout=AI_TIMEOUT)
+        return res.json()
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def build_result(index, filename, res_json):
+    prediction_data = res_json.get('prediction', {}) # 使用.get()防止prediction不存在时报错
+    result = {
+        'index': index,
+        'image_url': f"/api/test/uploads/{filename}",
+        'class_name': prediction_data.get('class_name', '未知'),  # 直接把 class_name 提出来
+        'confidence': prediction_data.get('confidence', 0.0),     # 直接把 confidence 提出来
+        'topk': prediction_data.get('topk', []),
+        'logits_b64': prediction_data.get('logits_b64')
+    }
+    if 'error' in res_json:
+        result['error'] = res_json['error']
+    return result
 
 @test_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
@@ -16,33 +59,45 @@ def uploaded_file(filename):
 
 @test_bp.route('/upload', methods=['POST'])
 def upload_and_predict():
+    """
+    多张图片并发预测。
+    默认返回 {'results': [...]} (顺序与上传顺序一致)；
+    ?stream=1 时以 NDJSON 逐行返回，每张图片预测完成就立即输出一行 (带 index)。
+    """
     if 'images' not in request.files:
         return jsonify({'message': '没有上传文件'}), 400
 
-    files = request.files.getlist('images')
-    results = []
-
-    for file in files:
+    # 请求体只能在请求线程中读取；读入内存后落盘与预测并行进行
+    # 文件名加随机前缀：同一次 (或并发的) 上传里同名文件不会互相覆盖
+    uploads = []
+    for file in request.files.getlist('images'):
         if file:
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-
-            # 转发到 AI 服务
-            try:
-                with open(filepath, 'rb') as f:
-                    res = requests.post(AI_SERVICE_URL, files={'file': f})
-                res_json = res.json()
-            except Exception as e:
-                res_json = {'error': str(e)}
-
-            prediction_data = res_json.get('prediction', {}) # 使用.get()防止prediction不存在时报错
-            class_name = prediction_data.get('class_name', '未知') # 同样使用.get()
-            confidence = prediction_data.get('confidence', 0.0)
-            results.append({
-                'image_url': f"/api/test/uploads/{filename}",
-                'class_name': class_name,      # 直接把 class_name 提出来
-                'confidence': confidence       # 直接把 confidence 提出来
-            })
+            filename = f"{uuid.uuid4().hex[:12]}_{secure_filename(file.filename)}"
+            uploads.append((filename, file.read()))
+
+    jobs = []
+    for index, (filename, data) in enumerate(uploads):
+        saved = _disk_pool.submit(write_upload, os.path.join(UPLOAD_FOLDER, filename), data)
+        predicted = _predict_pool.submit(predict_bytes, filename, data)
+        jobs.append((index, filename, saved, predicted))
+
+    def finish(job):
+        index, filename, saved, predicted = job
+        try:
+            saved.result()  # 结果里的 image_url 要能访问，返回前确保文件已写完
+        except Exception as e:
+            # 单张图片落盘失败只影响这一条结果，流式输出不会因此中断
+            return {'index': index, 'image_url': None, 'error': f'保存文件失败: {e}'}
+        return build_result(index, filename, predicted.result())
+
+    if request.args.get('stream') == '1':
+        by_future = {job[3]: job for job in jobs}
+
+        def generate():
+            for future in as_completed(by_future):
+                yield json.dumps(finish(by_future[future]), ensure_ascii=False) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
+    results = [finish(job) for job in jobs]
     return jsonify({'results': results}), 200
@@ -2,7 +2,7 @@ import functools
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash
 from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
-from db import get_db_connection
+from db import get_db_connection, bump_user_version
 
 # 创建一个新的蓝图，专门用于管理员的用户管理
 # 注意：我们将这个蓝图命名为 user_admin_bp 以避免与你现有的 admin_bp 冲突
@@ -177,6 +177,7 @@ def delete_user(user_id):
 
         # 提交事务
         conn.commit()
+        bump_user_version(user_id)  # 该用户的检测记录已删除，旧 ETag 失效
 
         return jsonify({"message": f"用户 {user_id} 已成功删除"}), 200
 
@@ -0,0 +1,6 @@
+# backend 按脚本方式运行 (from db import ...)，测试时把 backend 目录加入 sys.path；
+# 只测试纯函数，不连接数据库
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
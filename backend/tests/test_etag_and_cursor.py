@@ -0,0 +1,78 @@
+# 检测记录列表的 ETag 与分页游标辅助函数测试
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('flask_jwt_extended')
+pytest.importorskip('mysql.connector')
+
+from werkzeug.datastructures import MultiDict  # noqa: E402
+import db  # noqa: E402
+from routes import admin, detection  # noqa: E402
+
+
+def test_etag_is_per_user():
+    assert db.detections_etag(1, '', 20) != db.detections_etag(2, '', 20)
+    assert db.detections_etag(1, '', 20) == db.detections_etag(1, '', 20)
+
+
+def test_etag_changes_when_user_data_or_generation_changes():
+    before = db.detections_etag(1, '', 20)
+    other = db.detections_etag(2, '', 20)
+    db.bump_user_version(1)
+    assert db.detections_etag(1, '', 20) != before
+    assert db.detections_etag(2, '', 20) == other
+    db.bump_detection_generation()
+    assert db.detections_etag(2, '', 20) != other
+
+
+def test_etag_includes_page_parameters():
+    assert db.detections_etag(1, '', 20) != db.detections_etag(1, '', 50)
+    assert db.detections_etag(1, '2024-01-01 00:00:00.000000|5', 20) != db.detections_etag(1, '', 20)
+
+
+def test_parse_cursor_round_trip_and_rejects_garbage():
+    assert detection.parse_cursor('2024-05-01 12:30:00.123456|42') == ('2024-05-01 12:30:00.123456', 42)
+    assert detection.parse_cursor('2024-05-01|42') is None
+    assert detection.parse_cursor('2024-05-01 12:30:00.123456|x') is None
+    assert detection.parse_cursor('no-separator') is None
+
+
+def test_logits_b64_validation():
+    assert detection.is_valid_logits_b64('AAAA')
+    assert not detection.is_valid_logits_b64('not base64!')
+    assert not detection.is_valid_logits_b64('A' * (detection.LOGITS_B64_MAX_LEN + 4))
+    assert not detection.is_valid_logits_b64(None)
+
+
+def test_admin_filters_are_parameterised():
+    conditions, params, needs_user = admin.build_detection_filters(MultiDict({
+        'filter': 'unprocessed', 'label': "x' OR 1=1 --", 'user': 'alice', 'date_from': '2024-01-01'
+    }))
+    assert "d.is_processed = 0" in conditions
+    assert "x' OR 1=1 --" in params
+    assert all('%s' in c for c in conditions if c != "d.is_processed = 0")
+    assert needs_user
+
+
+def test_admin_date_filters_are_validated():
+    with pytest.raises(ValueError):
+        admin.build_detection_filters(MultiDict({'date_to': '01/02/2024'}))
+    _, params, _ = admin.build_detection_filters(MultiDict({'date_to': '2024-02-01 08:00:00'}))
+    assert params[0].hour == 8
+
+
+class FakeCursor:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def execute(self, sql, params):
+        self.sql = sql
+
+    def fetchall(self):
+        return self.plan
+
+
+def test_approx_row_count_uses_detections_row():
+    plan = [{'table': 'u', 'rows': 1, 'filtered': 100.0}, {'table': 'd', 'rows': 5000, 'filtered': 10.0}]
+    assert admin.approx_row_count(FakeCursor(plan), 'FROM detections d', '', []) == 500
+    assert admin.approx_row_count(FakeCursor([]), 'FROM detections d', '', []) == 0
@@ -15,3 +15,8 @@ export function checkImage(file) {
   })
 }
 
+// 热力图是独立的可缓存图片，识别结果里只带 prediction_id；网关需把该路径转发到 AI 服务的 /explain/<id>/heatmap
+export function heatmapUrl(predictionId, size = 224, format = 'webp') {
+  return `${api.defaults.baseURL}/api/ai/explain/${predictionId}/heatmap?size=${size}&format=${format}`
+}
+
@@ -0,0 +1,187 @@
+# batch_jobs.py
+# 批量任务调度器：代替「每个请求起一个线程」
+#   - 固定数量的执行线程，任务按 (优先级, 提交顺序) 排队
+#   - 每个用户同时运行的任务数有上限，队列满时拒绝 (准入控制)
+#   - 排队中的任务可直接取消，运行中的任务设置取消标志，由执行函数在每个 batch 间检查
+#   - 未完成的任务写入磁盘上的任务表，服务重启后重新排队
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class QueueFullError(Exception):
+    """队列已满，调用方应稍后重试 (HTTP 429)"""
+
+
+class JobCancelled(Exception):
+    """执行函数检测到取消标志后抛出"""
+
+
+class JobStore:
+    """未完成任务的持久化表：{task_id: job}，每次变更整体原子写入"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 任务表读取失败，忽略: {e}")
+            return {}
+
+    def save(self, jobs):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(jobs, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+
+class BatchJobScheduler:
+    """
+    run_fn(task_id, job) 在执行线程中被调用；job 为 submit 时传入的 payload
+    加上 user / priority / status 等字段。run_fn 应定期调用 check_cancelled(task_id)。
+    """
+
+    def __init__(self, run_fn, store_path, num_workers=1, max_queue=50, per_user_limit=1, on_requeue=None):
+        self.run_fn = run_fn
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self.per_user_limit = per_user_limit
+        self.on_requeue = on_requeue
+        self.store = JobStore(store_path)
+        self._cond = threading.Condition()
+        self._heap = []  # (-priority, seq, task_id)
+        self._seq = itertools.count()
+        self._jobs = {}  # 排队中 + 运行中的任务
+        self._running_by_user = {}
+        self._cancelled = set()
+        self._threads = []
+        self.completed = 0
+        self.rejected = 0
+
+    # ---------- 提交 / 取消 ----------
+    def submit(self, task_id, payload, user='anonymous', priority=0):
+        """入队并返回排队位置 (0 表示下一个被执行)；队列已满时抛 QueueFullError"""
+        with self._cond:
+            if task_id in self._jobs:
+                raise ValueError(f"Task {task_id} already exists")
+            if len(self._heap) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"Batch queue is full ({self.max_queue})")
+            job = dict(payload, user=user, priority=priority, status='queued', submitted_at=time.time())
+            self._enqueue(task_id, job)
+            self._persist()
+            self._cond.notify()
+            return self._position(task_id)
+
+    def _enqueue(self, task_id, job):
+        self._jobs[task_id] = job
+        heapq.heappush(self._heap, (-job['priority'], next(self._seq), task_id))
+
+    def cancel(self, task_id):
+        """返回 'cancelled' (排队中直接移除)、'cancelling' (运行中，等待执行函数退出) 或 None (不存在)"""
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return None
+            if job['status'] == 'queued':
+                self._heap = [item for item in self._heap if item[2] != task_id]
+                heapq.heapify(self._heap)
+                self._jobs.pop(task_id)
+                self._persist()
+                return 'cancelled'
+            self._cancelled.add(task_id)
+            return 'cancelling'
+
+    def check_cancelled(self, task_id):
+        if task_id in self._cancelled:
+            raise JobCancelled(task_id)
+
+    # ---------- 查询 ----------
+    def _position(self, task_id):
+        for pos, item in enumerate(sorted(self._heap)):
+            if item[2] == task_id:
+                return pos
+        return None
+
+    def position(self, task_id):
+        with self._cond:
+            return self._position(task_id)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.num_workers,
+                'queued': len(self._heap),
+                'running': sum(1 for j in self._jobs.values() if j['status'] == 'running'),
+                'running_by_user': {u: n for u, n in self._running_by_user.items() if n},
+                'max_queue': self.max_queue,
+                'per_user_limit': self.per_user_limit,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
+
+    # ---------- 执行 ----------
+    def start(self):
+        """恢复上次未完成的任务并启动执行线程"""
+        for task_id, job in sorted(self.store.load().items(), key=lambda kv: kv[1].get('submitted_at', 0)):
+            job['status'] = 'queued'
+            with self._cond:
+                self._enqueue(task_id, job)
+            if self.on_requeue:
+                self.on_requeue(task_id, job)
+            print(f"🔁 重新排队未完成的批量任务: {task_id}")
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._loop, name=f"batch-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _next_job(self):
+        """按优先级/FIFO 取第一个所属用户未达并发上限的任务；调用方持有锁"""
+        for item in sorted(self._heap):
+            task_id = item[2]
+            user = self._jobs[task_id]['user']
+            if self._running_by_user.get(user, 0) < self.per_user_limit:
+                self._heap.remove(item)
+                heapq.heapify(self._heap)
+                return task_id
+        return None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                task_id = self._next_job()
+                while task_id is None:
+                    self._cond.wait()
+                    task_id = self._next_job()
+                job = self._jobs[task_id]
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                self._running_by_user[job['user']] = self._running_by_user.get(job['user'], 0) + 1
+                self._persist()
+
+            try:
+                self.run_fn(task_id, job)
+            except Exception as e:
+                print(f"[{task_id}] ❌ 批量任务异常退出: {e}")
+            finally:
+                with self._cond:
+                    self._running_by_user[job['user']] -= 1
+                    self._jobs.pop(task_id, None)
+                    self._cancelled.discard(task_id)
+                    self.completed += 1
+                    self._persist()
+                    self._cond.notify_all()  # 用户名额释放后，被跳过的任务可能可以执行了
+
+    def _persist(self):
+        self.store.save(self._jobs)
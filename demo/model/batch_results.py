@@ -0,0 +1,102 @@
+# batch_results.py
+# 批量任务结果落盘：每个任务一个 append-only JSONL 文件 + 一个 meta.json
+# 每 INDEX_EVERY 行记录一次字节偏移，分页读取时直接 seek，不需要从头扫描
+import hashlib
+import json
+import os
+import re
+
+INDEX_EVERY = 1000
+SAFE_TASK_ID = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}')
+
+
+def file_stem(task_id):
+    """task_id → 结果文件名：普通 id 原样使用，含路径分隔符等字符的 id 用其哈希，task_id 本身不受限制"""
+    if SAFE_TASK_ID.fullmatch(task_id):
+        return task_id
+    return 'task-' + hashlib.sha1(task_id.encode('utf-8')).hexdigest()
+
+
+def results_path(results_dir, task_id):
+    return os.path.join(results_dir, f"{file_stem(task_id)}.jsonl")
+
+
+def meta_path(results_dir, task_id):
+    return os.path.join(results_dir, f"{file_stem(task_id)}.meta.json")
+
+
+class BatchResultWriter:
+    """按 batch 追加写入结果行，写完一个 batch 就 flush，读者只会看到完整的行"""
+
+    def __init__(self, path, index_every=INDEX_EVERY):
+        self.path = path
+        self.index_every = index_every
+        self.count = 0
+        self.offsets = [0]  # offsets[k] 为第 k * index_every 行的起始字节
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._f = open(path, 'wb')
+
+    def write_many(self, rows):
+        for row in rows:
+            if self.count and self.count % self.index_every == 0:
+                self.offsets.append(self._f.tell())
+            self._f.write(json.dumps(row, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.count += 1
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def read_range(path, offsets, index_every, start, limit, available):
+    """读取第 [start, start+limit) 行，available 为已落盘的行数"""
+    end = min(start + limit, available)
+    if start >= end:
+        return []
+    block = start // index_every
+    rows = []
+    with open(path, 'rb') as f:
+        f.seek(offsets[block])
+        line_no = block * index_every
+        for line in f:
+            if line_no >= end:
+                break
+            if line_no >= start:
+                rows.append(json.loads(line))
+            line_no += 1
+    return rows
+
+
+def iter_json_array(path, chunk_lines=1000):
+    """把 JSONL 文件流式转换成 JSON 数组输出 (用于 chunked 下载)"""
+    yield '['
+    first = True
+    buf = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            buf.append(line.rstrip('\n'))
+            if len(buf) >= chunk_lines:
+                yield ('' if first else ',') + ','.join(buf)
+                first = False
+                buf = []
+    if buf:
+        yield ('' if first else ',') + ','.join(buf)
+    yield ']'
+
+
+def save_meta(results_dir, task_id, meta):
+    """原子写入任务元数据 (先写临时文件再 rename)"""
+    os.makedirs(results_dir, exist_ok=True)
+    path = meta_path(results_dir, task_id)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_meta(results_dir, task_id):
+    path = meta_path(results_dir, task_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
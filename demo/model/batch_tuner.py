@@ -0,0 +1,237 @@
+# batch_tuner.py
+# 批量任务的 batch_size / DataLoader worker 数自动调优：
+#   - 用任务的前几十张图片实测不同 batch_size 的前向吞吐与峰值 RSS，选吞吐最高且实测内存不超过上限的
+#   - 用同一批图片实测不同 loader worker 数下「解码 + 前向」的端到端吞吐，选能喂饱模型的最少 worker
+#   - 结果按主机持久化，之后的任务直接使用
+import json
+import os
+import socket
+import threading
+import time
+import torch
+from torch.utils.data import DataLoader, Dataset
+from dir_scanner import iter_image_files, iter_valid_images
+from fast_preprocess import load_uint8_tensor
+
+CANDIDATE_BATCH_SIZES = (8, 16, 32, 64)
+EST_MB_PER_IMAGE = 40  # 仅用于没有实测值的旧调优记录
+PROBE_IMAGES = 64
+MIN_PROBE_IMAGES = 8
+WORKER_PROBE_BATCHES = 4  # 每个 worker 数实测的 batch 数 (不含首个 batch，避免把 worker 启动时间算进去)
+RSS_SAMPLE_INTERVAL = 0.005
+DEFAULT_CONFIG = {'batch_size': 32, 'num_workers': 4 if (os.cpu_count() or 1) > 4 else 0}
+_PAGE_MB = os.sysconf('SC_PAGE_SIZE') / (1024 * 1024) if hasattr(os, 'sysconf') else 4 / 1024
+
+
+def rss_mb(pids=None):
+    """当前进程 (以及 pids 中的其他进程，如推理 worker) 的常驻内存之和 (MB)；无 /proc 时返回 None"""
+    total = 0.0
+    for pid in [os.getpid()] + list(pids or []):
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * _PAGE_MB
+        except (OSError, ValueError, IndexError):
+            if pid == os.getpid():
+                return None
+    return total
+
+
+class PeakRssSampler:
+    """with 块内由后台线程定时采样 RSS，退出后 peak_mb 为期间的峰值 (不支持时为 None)"""
+
+    def __init__(self, pids=None, interval=RSS_SAMPLE_INTERVAL):
+        self.pids = pids
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        value = rss_mb(self.pids)
+        if value is not None and (self.peak_mb is None or value > self.peak_mb):
+            self.peak_mb = value
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+
+class _ProbeDataset(Dataset):
+    """把探测图片循环使用到 length 张，用于实测 loader worker 吞吐"""
+
+    def __init__(self, paths, length):
+        self.paths = paths
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        return load_uint8_tensor(self.paths[idx % len(self.paths)])
+
+
+def load_probe_images(folder_path, n=PROBE_IMAGES):
+    """解码前 n 张有效图片，返回 (张量列表, 路径列表, 单张解码秒数)"""
+    tensors, paths, decode_time = [], [], 0.0
+    for path in iter_valid_images(iter_image_files(folder_path)):
+        start = time.perf_counter()
+        try:
+            tensors.append(load_uint8_tensor(path))
+        except Exception:
+            continue
+        decode_time += time.perf_counter() - start
+        paths.append(path)
+        if len(tensors) >= n:
+            break
+    return tensors, paths, (decode_time / len(tensors) if tensors else 0.0)
+
+
+def probe_batch_sizes(forward_fn, samples, memory_limit_mb, rss_pids=None):
+    """
+    从小到大实测各候选 batch_size 的吞吐和前向期间的峰值 RSS 增量。
+    按已测得的单张内存外推下一档，预计超过上限就不再尝试；实测超过上限的档位不参与选择。
+    返回 (吞吐字典, 各档峰值 RSS 增量字典, 单张内存 MB 或 None)
+    """
+    throughput, peak_delta, mb_per_image = {}, {}, None
+    for bs in CANDIDATE_BATCH_SIZES:
+        if throughput and mb_per_image is not None and mb_per_image * bs > memory_limit_mb:
+            break
+        batch = torch.stack([samples[i % len(samples)] for i in range(bs)])
+        baseline = rss_mb(rss_pids)
+        with PeakRssSampler(rss_pids) as sampler:
+            forward_fn(batch)  # 预热 (首次分配也计入峰值)
+            start = time.perf_counter()
+            reps = 2
+            for _ in range(reps):
+                forward_fn(batch)
+            elapsed = time.perf_counter() - start
+        if baseline is not None and sampler.peak_mb is not None:
+            delta = max(0.0, sampler.peak_mb - baseline)
+            peak_delta[bs] = delta
+            mb_per_image = max(mb_per_image or 0.0, delta / bs)
+            if delta > memory_limit_mb and throughput:
+                break
+        elif bs * EST_MB_PER_IMAGE > memory_limit_mb and throughput:
+            break  # 无法测量 RSS 的平台退回估计值
+        throughput[bs] = bs * reps / elapsed
+    return throughput, peak_delta, mb_per_image
+
+
+def probe_num_workers(forward_fn, paths, batch_size, max_workers):
+    """实测不同 loader worker 数下「解码 + 前向」的端到端吞吐 (img/s)"""
+    candidates = [0] + [w for w in (1, 2, 4, 8, 16) if w <= max_workers]
+    length = batch_size * (WORKER_PROBE_BATCHES + 1)
+    results = {}
+    for workers in candidates:
+        loader = DataLoader(_ProbeDataset(paths, length), batch_size=batch_size, num_workers=workers)
+        start, seen = None, 0
+        with torch.no_grad():
+            for batch in loader:
+                forward_fn(batch)
+                if start is None:
+                    start = time.perf_counter()  # 首个 batch 含 worker 启动时间，不计入
+                else:
+                    seen += len(batch)
+        elapsed = time.perf_counter() - start if start is not None else 0.0
+        prev_best = max(results.values()) if results else 0.0
+        results[workers] = seen / elapsed if elapsed > 0 else 0.0
+        # 比之前最好成绩提升不到 5% 时停止，省去更大 worker 数的启动开销
+        if workers and results[workers] < prev_best * 1.05:
+            break
+    return results
+
+
+def probe(forward_fn, samples, paths, decode_s_per_img, memory_limit_mb, max_workers, rss_pids=None):
+    """实测各候选 batch_size 与 loader worker 数，返回最优配置"""
+    throughput, peak_delta, mb_per_image = probe_batch_sizes(forward_fn, samples, memory_limit_mb, rss_pids)
+
+    # 吞吐差距在 5% 以内时选更小的 batch (占内存少、首批结果更快)
+    best_tput = max(throughput.values())
+    batch_size = min(bs for bs, t in throughput.items() if t >= best_tput * 0.95)
+    fwd_s_per_img = 1.0 / throughput[batch_size]
+
+    # 解码明显快于前向时不需要 loader worker；否则实测端到端吞吐，取最好成绩 5% 以内的最少 worker
+    workers_tput = {}
+    if max_workers and decode_s_per_img >= fwd_s_per_img * 0.1:
+        workers_tput = probe_num_workers(forward_fn, paths, batch_size, max_workers)
+        best = max(workers_tput.values())
+        num_workers = min(w for w, t in workers_tput.items() if t >= best * 0.95)
+    else:
+        num_workers = 0
+
+    return {
+        'batch_size': batch_size,
+        'num_workers': num_workers,
+        'throughput_img_s': {str(k): round(v, 1) for k, v in throughput.items()},
+        'workers_throughput_img_s': {str(k): round(v, 1) for k, v in workers_tput.items()},
+        'peak_rss_delta_mb': {str(k): round(v, 1) for k, v in peak_delta.items()},
+        'mb_per_image': round(mb_per_image, 2) if mb_per_image is not None else None,
+        'decode_ms_per_img': round(decode_s_per_img * 1000, 2),
+        'forward_ms_per_img': round(fwd_s_per_img * 1000, 2)
+    }
+
+
+class BatchTuner:
+    """按 (主机, 推理后端, 推理进程数) 缓存调优结果，并持久化到 JSON 文件"""
+
+    def __init__(self, store_path, memory_limit_mb=4096):
+        self.store_path = store_path
+        self.memory_limit_mb = memory_limit_mb
+        self._lock = threading.Lock()
+        self._store = self._load()
+
+    def _load(self):
+        if os.path.exists(self.store_path):
+            try:
+                with open(self.store_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 调优记录读取失败，将重新调优: {e}")
+        return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.store_path), exist_ok=True)
+        tmp = self.store_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._store, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.store_path)
+
+    def _fits(self, config):
+        """缓存的配置在当前内存上限下是否仍然可用 (优先用实测的单张内存)"""
+        per_image = config.get('mb_per_image') or EST_MB_PER_IMAGE
+        return config['batch_size'] * per_image <= self.memory_limit_mb
+
+    def get_config(self, folder_path, forward_fn, backend_name, inference_workers=0, rss_pids=None):
+        """
+        返回 {'batch_size', 'num_workers', 'source', ...}；source 为 cached / probed / default。
+        rss_pids: 前向实际运行所在的其他进程 (多进程推理 worker)，其内存一并计入峰值 RSS。
+        """
+        key = f"{socket.gethostname()}|{backend_name}|{inference_workers}"
+        max_workers = max(0, (os.cpu_count() or 1) // 2)
+        with self._lock:  # 同一时间只让一个任务做实测，避免互相干扰
+            cached = self._store.get(key)
+            if cached and self._fits(cached):
+                return dict(cached, source='cached')
+
+            start = time.perf_counter()
+            samples, paths, decode_s = load_probe_images(folder_path)
+            if len(samples) < MIN_PROBE_IMAGES:
+                return dict(DEFAULT_CONFIG, source='default')
+            config = probe(forward_fn, samples, paths, decode_s, self.memory_limit_mb, max_workers, rss_pids)
+            config['probe_seconds'] = round(time.perf_counter() - start, 2)
+            config['tuned_at'] = int(time.time())
+            self._store[key] = config
+            self._save()
+            return dict(config, source='probed')
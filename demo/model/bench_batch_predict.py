@@ -0,0 +1,73 @@
+# bench_batch_predict.py
+# 对比 N 次单张 /predict (顺序 / 并发) 与一次 /predict/batch 的吞吐
+# 用法: python bench_batch_predict.py [图片文件夹] [N] [服务地址]
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+DEFAULT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../backend/uploads')
+DEFAULT_URL = 'http://127.0.0.1:5003'
+CONCURRENCY = 8
+
+
+def load_images(folder, n):
+    exts = ('.jpg', '.jpeg', '.png', '.bmp')
+    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(exts))
+    if not paths:
+        return []
+    # 图片不足 N 张时循环使用 (压测都带 cache=0，重复图片也会真正前向)
+    return [(os.path.basename(paths[i % len(paths)]), open(paths[i % len(paths)], 'rb').read()) for i in range(n)]
+
+
+def single(session, url, item):
+    resp = session.post(f"{url}/predict?cache=0", files={'file': item})
+    resp.raise_for_status()
+    return resp.json()['prediction']['class_name']
+
+
+def run_sequential(session, url, items):
+    return [single(session, url, item) for item in items]
+
+
+def run_concurrent(session, url, items):
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        return list(pool.map(lambda item: single(session, url, item), items))
+
+
+def run_batch(session, url, items):
+    resp = session.post(f"{url}/predict/batch?cache=0", files=[('files', item) for item in items])
+    resp.raise_for_status()
+    return [r['prediction']['class_name'] if r['status'] == 'success' else None for r in resp.json()['results']]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FOLDER
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    url = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_URL
+
+    items = load_images(folder, n)
+    if not items:
+        print(f"❌ 文件夹中没有图片: {folder}")
+        sys.exit(1)
+
+    session = requests.Session()
+    run_batch(session, url, items[:2])  # 预热
+
+    seq, seq_s = timed(run_sequential, session, url, items)
+    conc, conc_s = timed(run_concurrent, session, url, items)
+    batch, batch_s = timed(run_batch, session, url, items)
+
+    print(f"N = {n}, 服务: {url}")
+    print(f"{'方式':<24}{'总耗时(s)':>12}{'图片/秒':>12}")
+    for name, secs in [('单张 x N (顺序)', seq_s), (f'单张 x N (并发 {CONCURRENCY})', conc_s), ('/predict/batch', batch_s)]:
+        print(f"{name:<24}{secs:>12.3f}{n / secs:>12.1f}")
+    print(f"batch 相对顺序单张加速: {seq_s / batch_s:.2f}x，相对并发单张: {conc_s / batch_s:.2f}x")
+    print(f"结果一致: {seq == batch}")
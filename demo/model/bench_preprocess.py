@@ -0,0 +1,54 @@
+# bench_preprocess.py
+# 对比 旧预处理 (PIL 全尺寸解码 + T.Compose 逐张) 与 fast_preprocess (draft 解码 + batch 归一化)
+# 用法: python bench_preprocess.py [图片文件夹] [重复次数]
+import os
+import sys
+import time
+import torch
+import torchvision.transforms as T
+from PIL import Image
+from fast_preprocess import load_uint8_tensor, normalize_batch
+
+DEFAULT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../backend/uploads')
+
+inference_transform = T.Compose([
+    T.Resize(256),
+    T.CenterCrop(224),
+    T.ToTensor(),
+    T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+def list_images(folder):
+    exts = ('.jpg', '.jpeg', '.png', '.bmp')
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(exts))
+
+def run_old(paths):
+    return torch.stack([inference_transform(Image.open(p).convert('RGB')) for p in paths])
+
+def run_new(paths):
+    return normalize_batch(torch.stack([load_uint8_tensor(p) for p in paths]))
+
+def bench(fn, paths, repeat):
+    fn(paths)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn(paths)
+    elapsed = time.perf_counter() - start
+    return out, elapsed * 1000 / (repeat * len(paths))
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FOLDER
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    paths = list_images(folder)
+    if not paths:
+        print(f"❌ 文件夹中没有图片: {folder}")
+        sys.exit(1)
+
+    print(f"--- {len(paths)} 张图片, 重复 {repeat} 次 ---")
+    old_out, old_ms = bench(run_old, paths, repeat)
+    new_out, new_ms = bench(run_new, paths, repeat)
+    diff = (old_out - new_out).abs()
+
+    print(f"旧路径 (PIL + T.Compose)      : {old_ms:.2f} ms/image")
+    print(f"快速路径 (draft + batch 归一化): {new_ms:.2f} ms/image  (x{old_ms / new_ms:.2f})")
+    print(f"与 inference_transform 的差异: max={diff.max().item():.4f}, mean={diff.mean().item():.5f}")
@@ -0,0 +1,195 @@
+# cam_service.py
+# 异步批量 Grad-CAM：
+#   - 主推理时一次前向同时拿到 layer4 特征图和 logits，解释不再重跑整张网络
+#   - 后台线程把多张图片的特征拼成一个 batch，只对尾部 (avgpool + fc) 做一次反向
+#   - 通道加权用一次 einsum 完成，取代逐通道的 Python 循环
+#   - 结果按 prediction_id 存在有界的内存表中，供 /explain/<id> 查询
+#   - method='cam' 时直接用 fc 权重加权 (ResNet 的 GAP 头下与 Grad-CAM 结果一致)，完全不需要反向
+#   - 结果只存 uint8 的 h×w 网格 (ResNet50 layer4 为 7×7)，图片在请求时按需渲染
+import queue
+import threading
+import time
+from collections import OrderedDict
+import torch
+
+
+def forward_with_features(net, x):
+    """ResNet 前向，同时返回 layer4 输出特征图 [B, C, h, w] 与 logits [B, num_classes]"""
+    x = net.maxpool(net.relu(net.bn1(net.conv1(x))))
+    feats = net.layer4(net.layer3(net.layer2(net.layer1(x))))
+    logits = net.fc(torch.flatten(net.avgpool(feats), 1))
+    return feats, logits
+
+
+def normalize_cams(cam):
+    """ReLU 后按每张图各自的最大值归一化到 [0, 1]"""
+    cam = cam.clamp(min=0)
+    peak = cam.flatten(1).max(dim=1).values.clamp(min=1e-8)
+    return cam / peak[:, None, None]
+
+
+def gradcam_from_features(net, feats, class_idx):
+    """
+    在已捕获的 layer4 特征上计算一批 Grad-CAM。
+    feats: [B, C, h, w]；class_idx: [B] 每张图要解释的类别
+    """
+    device = net.fc.weight.device
+    feats = feats.detach().to(device).requires_grad_(True)
+    class_idx = class_idx.to(device)
+    with torch.enable_grad():
+        logits = net.fc(torch.flatten(net.avgpool(feats), 1))
+        score = logits.gather(1, class_idx[:, None]).sum()
+        # 只对特征求导，不在 fc 参数上累积梯度
+        grads, = torch.autograd.grad(score, feats)
+    weights = grads.mean(dim=(2, 3))  # [B, C]
+    cam = torch.einsum('bc,bchw->bhw', weights, feats.detach())
+    return normalize_cams(cam)
+
+
+def cam_from_fc(net, feats, class_idx):
+    """
+    无梯度 CAM：GAP + fc 头下，类别 c 对特征图的梯度处处等于 W[c] / (h*w)，
+    所以 Grad-CAM 权重就是 fc 权重的一行 (归一化后完全一致)，一次矩阵乘即可。
+    """
+    device = net.fc.weight.device
+    weights = net.fc.weight.detach()[class_idx.to(device)]  # [B, C]
+    cam = torch.einsum('bc,bchw->bhw', weights, feats.to(device))
+    return normalize_cams(cam)
+
+
+CAM_METHODS = {'cam': cam_from_fc, 'gradcam': gradcam_from_features}
+
+
+def quantize_cam(cam):
+    """[0, 1] 的 CAM → uint8 网格"""
+    return (cam * 255).round().to(torch.uint8).numpy()
+
+
+class ExplanationStore:
+    """prediction_id → 解释结果，超过 max_entries 时淘汰最早的条目"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def put(self, pred_id, value):
+        with self._lock:
+            self._data[pred_id] = value
+            self._data.move_to_end(pred_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, pred_id):
+        with self._lock:
+            return self._data.get(pred_id)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CamWorker:
+    """
+    后台解释线程。submit() 只入队，不阻塞请求；
+    后台线程每次最多取 max_batch 个 (或等待 max_wait_ms 后取已有的)，批量算 CAM，
+    再调用 render_fn(cam[h, w], context) 生成最终结果存入 store。
+    """
+
+    def __init__(self, net, render_fn, store, max_batch=16, max_wait_ms=20, max_queue=256, method='cam'):
+        if method not in CAM_METHODS:
+            raise ValueError(f"Unknown CAM method '{method}', choose from {list(CAM_METHODS)}")
+        self.net = net
+        self.method = method
+        self._compute = CAM_METHODS[method]
+        self.render_fn = render_fn
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # pred_id → Event，完成时 set
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.batches = 0
+        self.completed = 0
+        self._thread = threading.Thread(target=self._loop, name='cam-worker', daemon=True)
+        self._thread.start()
+
+    def submit(self, pred_id, feats, class_idx, context=None):
+        """feats: 单张图片的 [C, h, w] 特征 (建议已在 CPU 上)；队列满时丢弃并返回 False"""
+        # 先登记再入队：否则后台线程可能在登记之前就算完并清理，Event 永远不会被 set
+        with self._lock:
+            self._pending[pred_id] = threading.Event()
+        try:
+            self._queue.put_nowait((pred_id, feats, class_idx, context))
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(pred_id, None)
+            self.dropped += 1
+            return False
+        return True
+
+    def status(self, pred_id):
+        """'done' / 'pending' / None (未知或已被淘汰)"""
+        if self.store.get(pred_id) is not None:
+            return 'done'
+        with self._lock:
+            return 'pending' if pred_id in self._pending else None
+
+    def wait(self, pred_id, timeout):
+        """等待某个解释完成 (最多 timeout 秒)，返回最终 status"""
+        with self._lock:
+            event = self._pending.get(pred_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.status(pred_id)
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            ids = [it[0] for it in items]
+            try:
+                feats = torch.stack([it[1] for it in items])
+                classes = torch.tensor([it[2] for it in items], dtype=torch.long)
+                with torch.no_grad() if self.method == 'cam' else torch.enable_grad():
+                    cams = self._compute(self.net, feats, classes).cpu()
+                for (pred_id, _, class_idx, context), cam in zip(items, cams):
+                    self.store.put(pred_id, self.render_fn(cam, context))
+                self.batches += 1
+                self.completed += len(items)
+            except Exception as e:
+                print(f"⚠️ CAM 批量计算失败 ({len(items)} 张): {e}")
+                for pred_id in ids:
+                    self.store.put(pred_id, {'error': str(e)})
+            finally:
+                with self._lock:
+                    for pred_id in ids:
+                        event = self._pending.pop(pred_id, None)
+                        if event is not None:
+                            event.set()
+
+    def stats(self):
+        return {
+            'method': self.method,
+            'queued': self._queue.qsize(),
+            'stored': len(self.store),
+            'batches': self.batches,
+            'completed': self.completed,
+            'avg_batch_size': round(self.completed / self.batches, 2) if self.batches else 0,
+            'dropped': self.dropped,
+            'evictions': self.store.evictions
+        }
@@ -0,0 +1,100 @@
+# compare_retrain.py
+# 对比三种重训练方式 (fc / layer4 基于缓存特征，full 全网微调) 的耗时与准确率：
+#   - 测试集 top-1 (与 eval_backends.py 相同的 test 划分)，检查是否损伤原有能力
+#   - 反馈集 top-1，检查是否学到了新的纠错样本
+# 每种方式都从同一份权重开始；fc / layer4 各跑两次，第二次命中特征缓存，即服务端的常态耗时
+# 用法: python compare_retrain.py [权重路径] [反馈目录]
+import os
+import sys
+import time
+import torch
+import torchvision.transforms as T
+from torch.utils.data import DataLoader, ConcatDataset
+from torchvision.datasets import ImageFolder
+from fast_retrain import FAST_MODES, FeatureCache, fast_retrain
+from eval_backends import load_fp32_model, BASE_DIR, MODEL_PATH, ORIGINAL_DATASET_DIR, TEST_DIR
+
+FEEDBACK_DIR = os.path.join(BASE_DIR, 'feedback_data')
+TRAIN_DIR = os.path.join(ORIGINAL_DATASET_DIR, 'train')
+CACHE_DIR = os.path.join(BASE_DIR, 'feature_cache')
+REPORT_SAVE_PATH = os.path.join(BASE_DIR, 'retrain_report.txt')
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+NORMALIZE = T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+EVAL_TRANSFORM = T.Compose([T.Resize(256), T.CenterCrop(224), T.ToTensor(), NORMALIZE])
+TRAIN_TRANSFORM = T.Compose([T.RandomResizedCrop(224), T.RandomHorizontalFlip(), T.ToTensor(), NORMALIZE])
+
+
+def load_feedback(root, classes, transform):
+    """反馈目录只含部分类别，下标映射回全量类别顺序"""
+    ds = ImageFolder(root, transform=transform)
+    ds.samples = [(p, classes.index(ds.classes[t])) for p, t in ds.samples]
+    ds.targets = [t for _, t in ds.samples]
+    return ds
+
+
+def accuracy(net, dataset):
+    loader = DataLoader(dataset, batch_size=64, shuffle=False, num_workers=4)
+    correct = total = 0
+    net.eval()
+    with torch.no_grad():
+        for imgs, labels in loader:
+            correct += (net(imgs.to(DEVICE)).argmax(1).cpu() == labels).sum().item()
+            total += labels.size(0)
+    return correct / total if total else 0.0
+
+
+def full_finetune(net, classes, epochs=3, lr=1e-5):
+    """与 merged_server.full_finetune 相同的全网微调"""
+    train_ds = ConcatDataset([ImageFolder(TRAIN_DIR, transform=TRAIN_TRANSFORM),
+                              load_feedback(FEEDBACK_DIR, classes, TRAIN_TRANSFORM)])
+    loader = DataLoader(train_ds, batch_size=32, shuffle=True, num_workers=4)
+    optimizer = torch.optim.Adam(net.parameters(), lr=lr)
+    criterion = torch.nn.CrossEntropyLoss()
+    net.to(DEVICE).train()
+    for epoch in range(epochs):
+        for inputs, labels in loader:
+            optimizer.zero_grad()
+            loss = criterion(net(inputs.to(DEVICE)), labels.to(DEVICE))
+            loss.backward()
+            optimizer.step()
+        print(f"   Epoch {epoch + 1}/{epochs} done")
+    return net
+
+
+if __name__ == '__main__':
+    weights = sys.argv[1] if len(sys.argv) > 1 else MODEL_PATH
+    if len(sys.argv) > 2:
+        FEEDBACK_DIR = sys.argv[2]
+    original_ds = ImageFolder(TRAIN_DIR, transform=EVAL_TRANSFORM)
+    classes = original_ds.classes
+    test_ds = ImageFolder(TEST_DIR, transform=EVAL_TRANSFORM)
+    feedback_ds = load_feedback(FEEDBACK_DIR, classes, EVAL_TRANSFORM)
+    dataset_id = f"folder:{TRAIN_DIR}:{len(original_ds)}"
+    cache = FeatureCache(CACHE_DIR)
+    print(f"Train: {len(original_ds)} | Feedback: {len(feedback_ds)} | Test: {len(test_ds)} | Device: {DEVICE}\n")
+
+    base = load_fp32_model(weights).to(DEVICE)
+    rows = [('baseline', 0.0, accuracy(base, test_ds), accuracy(base, feedback_ds))]
+
+    runs = [(mode, attempt) for mode in FAST_MODES for attempt in ('cold', 'cached')] + [('full', '')]
+    for mode, attempt in runs:
+        net = load_fp32_model(weights).to(DEVICE)
+        start = time.perf_counter()
+        if mode == 'full':
+            full_finetune(net, classes)
+        else:
+            fast_retrain(net, mode, original_ds, feedback_ds, dataset_id, cache, DEVICE)
+        secs = time.perf_counter() - start
+        name = f"{mode} ({attempt})" if attempt else mode
+        rows.append((name, secs, accuracy(net, test_ds), accuracy(net, feedback_ds)))
+        print(f"{name:<16} {secs:.1f}s  test {rows[-1][2]:.4f}  feedback {rows[-1][3]:.4f}\n")
+
+    lines = ["--- Retrain Mode Report ---",
+             f"{'mode':<16}{'time(s)':>10}{'test top-1':>12}{'feedback top-1':>16}"]
+    for name, secs, test_acc, fb_acc in rows:
+        lines.append(f"{name:<16}{secs:>10.1f}{test_acc:>12.4f}{fb_acc:>16.4f}")
+    report = "\n".join(lines)
+    print(report)
+    with open(REPORT_SAVE_PATH, 'w') as f:
+        f.write(report + "\n")
+    print(f"\nReport saved to: {REPORT_SAVE_PATH}")
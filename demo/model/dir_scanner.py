@@ -0,0 +1,156 @@
+# dir_scanner.py
+# 批量任务的目录扫描：
+#   - os.scandir 递归遍历 (解压出来的嵌套目录不再被跳过)，惰性产出路径，不先列出全部文件
+#   - 多线程读取文件头校验图片魔数，损坏/伪装文件在进入解码前就被丢弃
+#   - StreamingImageDataset 让 DataLoader 在扫描进行的同时就开始推理
+#   - DirectoryScan 在主进程里只遍历一次目录，同时统计总数 (进度条) 并把路径分发给所有 DataLoader worker
+import multiprocessing as mp
+import os
+import threading
+from collections import deque
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import IterableDataset
+from fast_preprocess import load_uint8_tensor
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+IMAGE_MAGICS = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'BM')
+SKIP_DIRS = {'__MACOSX'}  # macOS 压缩包里的资源分叉目录，全是 ._xxx 伪图片
+
+
+def iter_image_files(root, exts=IMAGE_EXTS):
+    """深度优先递归遍历 root，按目录内文件名顺序惰性产出候选图片路径"""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"⚠️ 无法读取目录 {current}: {e}")
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    subdirs.append(entry.path)
+            elif entry.name.lower().endswith(exts) and entry.is_file():
+                yield entry.path
+        stack.extend(reversed(subdirs))
+
+
+def has_image_magic(path):
+    """只读文件头几个字节判断是否真的是图片"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(8)
+    except OSError:
+        return False
+    return any(head.startswith(m) for m in IMAGE_MAGICS)
+
+
+def iter_valid_images(paths, num_threads=8, window=256):
+    """并行校验魔数，按输入顺序产出通过校验的路径；最多 window 个文件同时在校验中"""
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append((path, pool.submit(has_image_magic, path)))
+            if len(pending) >= window:
+                p, fut = pending.popleft()
+                if fut.result():
+                    yield p
+        while pending:
+            p, fut = pending.popleft()
+            if fut.result():
+                yield p
+
+
+class DirectoryScan:
+    """
+    单次目录遍历，供一个批量任务的所有 DataLoader worker 共用：
+    后台线程遍历 root，把候选路径放进进程间队列 (worker 谁空闲谁取)，
+    同时每发现 every 个文件回调 on_progress(count)，遍历结束回调 on_done(total)。
+    必须在 DataLoader 创建 worker 之前 start()；任务结束 (包括取消/失败) 时调用 stop()。
+    """
+
+    def __init__(self, root, num_consumers=1, on_progress=None, on_done=None, every=1000):
+        self.root = root
+        self.num_consumers = max(num_consumers, 1)
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.every = every
+        self.queue = mp.get_context('fork').Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        total = 0
+        try:
+            for path in iter_image_files(self.root):
+                if self._stop.is_set():
+                    return
+                self.queue.put(path)
+                total += 1
+                if self.on_progress and total % self.every == 0:
+                    self.on_progress(total)
+            if self.on_done:
+                self.on_done(total)
+        finally:
+            # 每个消费者一个结束标记
+            for _ in range(self.num_consumers):
+                self.queue.put(None)
+
+    def stop(self):
+        """停止遍历 (已经遍历完时无影响)，并释放队列的后台线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        # 消费端可能已提前退出 (取消/失败)：取走剩余路径，队列的后台线程才能写完缓冲并退出
+        try:
+            while True:
+                self.queue.get(timeout=0.1)
+        except Empty:
+            pass
+        self.queue.close()
+        self.queue.join_thread()
+
+    def paths(self):
+        """消费端：逐个取路径，直到取到结束标记"""
+        while True:
+            path = self.queue.get()
+            if path is None:
+                return
+            yield path
+
+
+class StreamingImageDataset(IterableDataset):
+    """
+    边扫描边产出 (uint8 张量, 路径)。
+    传入 scan (DirectoryScan) 时，所有 DataLoader worker 从同一次遍历中取路径，
+    目录只遍历一次，校验和解码工作分摊到所有 worker 上；否则在当前进程内自行遍历。
+    """
+
+    def __init__(self, root, loader=load_uint8_tensor, num_threads=4, scan=None):
+        self.root = root
+        self.loader = loader
+        self.num_threads = num_threads
+        self.scan = scan
+
+    def _candidates(self):
+        if self.scan is not None:
+            return self.scan.paths()
+        return iter_image_files(self.root)
+
+    def __iter__(self):
+        for path in iter_valid_images(self._candidates(), num_threads=self.num_threads):
+            try:
+                yield self.loader(path), path
+            except Exception as e:
+                print(f"⚠️ Reads error {path}: {e}")
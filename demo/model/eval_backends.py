@@ -0,0 +1,76 @@
+# eval_backends.py
+# 在测试集 (与 modelStaff/test.py 相同的 test 划分) 上对比各推理后端的 top-1 准确率与速度，
+# 输出相对 fp32 的准确率差，并推荐「准确率下降不超过 0.5%」中最快的后端
+# 用法: python eval_backends.py [权重路径]
+import os
+import sys
+import time
+import torch
+from torch.utils.data import DataLoader
+from torchvision.datasets import ImageFolder
+from torchvision.models import resnet50
+from fast_preprocess import load_uint8_tensor, normalize_batch
+from inference_backends import BACKENDS, BACKEND_NOTES, build_backend, calibration_batches
+
+# --- 配置 (与 merged_server.py 保持一致) ---
+BASE_DIR = '/home/hzcu/repo/modelStaff'
+MODEL_PATH = os.path.join(BASE_DIR, 'ResNet50_best.pth')
+ORIGINAL_DATASET_DIR = '/home/hzcu/PlantDiseases_Final_Split'
+TEST_DIR = os.path.join(ORIGINAL_DATASET_DIR, 'test')
+REPORT_SAVE_PATH = os.path.join(BASE_DIR, 'backend_report.txt')
+NUM_CLASSES = 42
+BATCH_SIZE = 32
+MAX_ACC_DROP = 0.005  # 允许的最大 top-1 下降 (0.5%)
+
+
+def load_fp32_model(path):
+    net = resnet50(weights=None)
+    net.fc = torch.nn.Linear(net.fc.in_features, NUM_CLASSES)
+    net.load_state_dict(torch.load(path, map_location='cpu'))
+    return net.eval()
+
+
+def evaluate(backend, loader):
+    correct, total, infer_time = 0, 0, 0.0
+    for imgs, labels in loader:
+        batch = normalize_batch(imgs)
+        start = time.perf_counter()
+        outputs = backend(batch)
+        infer_time += time.perf_counter() - start
+        correct += (outputs.argmax(1) == labels).sum().item()
+        total += labels.size(0)
+    return correct / total, infer_time * 1000 / total
+
+
+if __name__ == '__main__':
+    weights = sys.argv[1] if len(sys.argv) > 1 else MODEL_PATH
+    test_dataset = ImageFolder(TEST_DIR, loader=load_uint8_tensor)
+    test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=False, num_workers=4)
+    print(f"Found {len(test_dataset)} images in test set. Weights: {weights}\n")
+
+    calib = calibration_batches(ORIGINAL_DATASET_DIR)
+    rows = []
+    for name in BACKENDS:
+        try:
+            backend = build_backend(name, load_fp32_model(weights), calib)
+        except Exception as e:
+            print(f"⚠️ 跳过 {name}: {e}")
+            continue
+        acc, ms = evaluate(backend, test_loader)
+        rows.append((name, acc, ms))
+        print(f"{name:<16} top-1: {acc:.4f}  {ms:.2f} ms/image  [{BACKEND_NOTES[name]}]")
+
+    base_acc = next(acc for name, acc, _ in rows if name == 'fp32')
+    eligible = [(name, ms) for name, acc, ms in rows if base_acc - acc <= MAX_ACC_DROP]
+    recommended = min(eligible, key=lambda r: r[1])[0]
+
+    lines = ["--- Inference Backend Report ---",
+             f"{'backend':<16}{'top-1':>10}{'delta':>10}{'ms/image':>12}  precision"]
+    for name, acc, ms in rows:
+        lines.append(f"{name:<16}{acc:>10.4f}{acc - base_acc:>+10.4f}{ms:>12.2f}  {BACKEND_NOTES[name]}")
+    lines.append(f"\nRecommended (max drop {MAX_ACC_DROP:.1%}): INFERENCE_BACKEND={recommended}")
+    report = "\n".join(lines)
+    print("\n" + report)
+    with open(REPORT_SAVE_PATH, 'w') as f:
+        f.write(report + "\n")
+    print(f"\nReport saved to: {REPORT_SAVE_PATH}")
@@ -0,0 +1,86 @@
+# export_model.py
+# 把模型仓库当前版本 (model_registry/versions/vNNNN/model.pth) 及 ResNet50_v1.pth / ResNet50_best.pth 导出为冻结并优化过的 TorchScript 图 (xxx.ts)，
+# 供 merged_server.py 在 MODEL_FORMAT=torchscript 时直接加载，并校验导出图与 eager 模型的 logits 一致
+# 用法: python export_model.py [权重路径 ...]
+import os
+import sys
+import time
+import torch
+from torchvision.models import resnet50
+from fast_preprocess import load_uint8_tensor, normalize_batch
+from model_registry import ModelRegistry
+
+BASE_DIR = '/home/hzcu/repo/modelStaff'
+DEFAULT_WEIGHTS = [os.path.join(BASE_DIR, 'ResNet50_v1.pth'), os.path.join(BASE_DIR, 'ResNet50_best.pth')]
+MODEL_REGISTRY_DIR = os.path.join(BASE_DIR, 'model_registry')
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../backend/uploads')
+NUM_CLASSES = 42
+ATOL = 1e-3  # logits 允许的最大绝对误差
+
+
+def load_eager(weights_path):
+    net = resnet50(weights=None)
+    net.fc = torch.nn.Linear(net.fc.in_features, NUM_CLASSES)
+    net.load_state_dict(torch.load(weights_path, map_location='cpu'), strict=True)
+    return net.eval()
+
+
+def export_torchscript(net, out_path):
+    """trace → freeze → optimize_for_inference，保存为单个文件"""
+    example = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.trace(net, example)
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    frozen.save(out_path)
+    return out_path
+
+
+def parity_batch():
+    """优先用仓库中的样例图片，没有时用随机输入"""
+    exts = ('.jpg', '.jpeg', '.png')
+    if os.path.isdir(SAMPLE_DIR):
+        paths = sorted(os.path.join(SAMPLE_DIR, f) for f in os.listdir(SAMPLE_DIR) if f.lower().endswith(exts))[:16]
+        if paths:
+            return normalize_batch(torch.stack([load_uint8_tensor(p) for p in paths]))
+    return torch.randn(8, 3, 224, 224)
+
+
+def check_parity(eager, scripted, batch):
+    with torch.no_grad():
+        ref = eager(batch)
+        out = scripted(batch)
+    max_diff = (ref - out).abs().max().item()
+    same_top1 = (ref.argmax(1) == out.argmax(1)).float().mean().item()
+    return max_diff, same_top1
+
+
+if __name__ == '__main__':
+    registry = ModelRegistry(MODEL_REGISTRY_DIR)
+    current = registry.current()
+    defaults = ([registry.checkpoint_path(current)] if current else []) + DEFAULT_WEIGHTS
+    weights_list = sys.argv[1:] or [p for p in defaults if os.path.exists(p)]
+    if not weights_list:
+        print("❌ 没有找到可导出的权重文件")
+        sys.exit(1)
+
+    failed = False
+    batch = parity_batch()
+    for weights in weights_list:
+        out_path = os.path.splitext(weights)[0] + '.ts'
+        eager = load_eager(weights)
+        export_torchscript(eager, out_path)
+
+        start = time.perf_counter()
+        scripted = torch.jit.load(out_path, map_location='cpu')
+        load_s = time.perf_counter() - start
+        max_diff, same_top1 = check_parity(eager, scripted, batch)
+
+        ok = max_diff <= ATOL and same_top1 == 1.0
+        failed = failed or not ok
+        print(f"{'✅' if ok else '❌'} {weights} -> {out_path}")
+        print(f"   加载耗时: {load_s:.3f}s | logits 最大误差: {max_diff:.2e} | top-1 一致率: {same_top1:.2%}")
+        if not ok:
+            os.remove(out_path)  # 不一致的导出物不能留给服务加载
+            print(f"   已删除不一致的导出物")
+
+    sys.exit(1 if failed else 0)
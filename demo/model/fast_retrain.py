@@ -0,0 +1,222 @@
+# fast_retrain.py
+# 冻结骨干网络的快速增量重训练：
+#   - mode='fc':     缓存原始数据集经 layer4 + avgpool 后的 2048 维特征，只训练 fc
+#   - mode='layer4': 缓存 layer3 输出特征图 [1024, 14, 14]，训练 layer4 + fc
+# 原始数据集的特征只在首次 (或冻结部分权重变化后) 提取一次，按「冻结部分权重哈希 + 数据集标识」
+# 存为 fp16 的 np.memmap 文件；每次重训练只需对新的反馈图片做一次前向，然后在特征上训练几个 epoch。
+import copy
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+FAST_MODES = ('fc', 'layer4')
+# 各模式下冻结 (参与哈希、缓存其输出) 的模块
+FROZEN_MODULES = {
+    'fc': ('conv1', 'bn1', 'layer1', 'layer2', 'layer3', 'layer4'),
+    'layer4': ('conv1', 'bn1', 'layer1', 'layer2', 'layer3'),
+}
+# 每张图片缓存的 fp16 特征字节数：fc 约 4KB，layer4 约 392KB (数万张图片即几十 GB)
+FEATURE_BYTES = {'fc': 2048 * 2, 'layer4': 1024 * 14 * 14 * 2}
+
+
+def backbone_hash(net, mode):
+    """冻结部分的参数与 BN 统计量的 sha1；这些权重不变时，缓存的特征仍然有效"""
+    h = hashlib.sha1(mode.encode())
+    for name in FROZEN_MODULES[mode]:
+        for key, tensor in getattr(net, name).state_dict().items():
+            h.update(f"{name}.{key}".encode())
+            h.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+def frozen_forward(net, x, mode):
+    """前向到冻结部分的末尾：fc 模式返回 [B, 2048]，layer4 模式返回 [B, 1024, 14, 14]"""
+    x = net.maxpool(net.relu(net.bn1(net.conv1(x))))
+    x = net.layer3(net.layer2(net.layer1(x)))
+    if mode == 'layer4':
+        return x
+    return torch.flatten(net.avgpool(net.layer4(x)), 1)
+
+
+def extract_features(net, dataset, mode, device, batch_size=64, num_workers=4, progress=None):
+    """对 dataset (应使用无随机增强的 transform) 提取冻结部分的输出，返回 (fp16 ndarray, int64 labels)"""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    feats, labels = [], []
+    net.eval()
+    with torch.no_grad():
+        for i, (inputs, targets) in enumerate(loader):
+            feats.append(frozen_forward(net, inputs.to(device), mode).half().cpu().numpy())
+            labels.append(np.asarray(targets, dtype=np.int64))
+            if progress:
+                progress(i + 1, len(loader))
+    if not feats:
+        return None, None
+    return np.concatenate(feats), np.concatenate(labels)
+
+
+class FeatureCache:
+    """特征缓存目录：<key>.f16 (np.memmap) + <key>.labels.npy + <key>.json (最后写入，存在即完整)"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(mode, net_hash, dataset_id):
+        return f"{mode}_{net_hash}_{hashlib.sha1(dataset_id.encode()).hexdigest()[:8]}"
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def load(self, key):
+        meta_path = self._path(key, '.json')
+        if not os.path.exists(meta_path):
+            return None, None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        feats = np.memmap(self._path(key, '.f16'), dtype=np.float16, mode='r', shape=tuple(meta['shape']))
+        return feats, np.load(self._path(key, '.labels.npy'))
+
+    def save(self, key, feats, labels):
+        mm = np.memmap(self._path(key, '.f16'), dtype=np.float16, mode='w+', shape=feats.shape)
+        mm[:] = feats
+        mm.flush()
+        del mm
+        np.save(self._path(key, '.labels.npy'), labels)
+        tmp = self._path(key, '.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'shape': list(feats.shape), 'created_at': time.time()}, f)
+        os.replace(tmp, self._path(key, '.json'))
+
+    def find(self, mode, net_hash):
+        """同一模式、同一骨干权重下最近写入的完整缓存键 (原始数据集不可用时使用)；没有则返回 None"""
+        prefix = f"{mode}_{net_hash}_"
+        metas = [name for name in os.listdir(self.cache_dir) if name.startswith(prefix) and name.endswith('.json')]
+        if not metas:
+            return None
+        latest = max(metas, key=lambda name: os.path.getmtime(os.path.join(self.cache_dir, name)))
+        return latest[:-len('.json')]
+
+    def prune(self, keep_key):
+        """删除同一模式下其它 (已过期的) 缓存，避免特征文件无限累积"""
+        mode_prefix = keep_key.split('_', 1)[0] + '_'
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(mode_prefix) and not name.startswith(keep_key):
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+def build_head(net, mode):
+    """可训练部分：fc 模式只有 fc，layer4 模式为 layer4 → avgpool → fc (均为副本)"""
+    if mode == 'fc':
+        return copy.deepcopy(net.fc)
+    return torch.nn.Sequential(copy.deepcopy(net.layer4), copy.deepcopy(net.avgpool),
+                               torch.nn.Flatten(1), copy.deepcopy(net.fc))
+
+
+def train_head(net, mode, feature_sets, device, epochs=10, lr=1e-3, batch_size=256, log=print, on_epoch=None):
+    """
+    在若干组 (feats, labels) 上训练 head，训练结果写回 net 对应的模块并返回 net。
+    feats 可以是 memmap，按打乱后的批次读取，不会整体载入内存。
+    on_epoch(epoch, epochs, loss, acc) 在每个 epoch 结束时回调。
+    """
+    head = build_head(net, mode).to(device)
+    head.train()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+    criterion = torch.nn.CrossEntropyLoss()
+    sizes = [len(labels) for _, labels in feature_sets]
+    offsets = np.cumsum([0] + sizes)
+    total = int(offsets[-1])
+
+    for epoch in range(epochs):
+        order = np.random.permutation(total)
+        running_loss, correct = 0.0, 0
+        for start in range(0, total, batch_size):
+            idx = order[start:start + batch_size]
+            parts_x, parts_y = [], []
+            for s, (feats, labels) in enumerate(feature_sets):
+                local = np.sort(idx[(idx >= offsets[s]) & (idx < offsets[s + 1])] - offsets[s])
+                if len(local):
+                    parts_x.append(np.asarray(feats[local], dtype=np.float32))
+                    parts_y.append(labels[local])
+            inputs = torch.from_numpy(np.concatenate(parts_x)).to(device)
+            targets = torch.from_numpy(np.concatenate(parts_y)).to(device)
+            optimizer.zero_grad()
+            outputs = head(inputs)
+            loss = criterion(outputs, targets)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * len(targets)
+            correct += (outputs.argmax(1) == targets).sum().item()
+        log(f"   Epoch {epoch + 1}/{epochs} - Loss: {running_loss / total:.4f} - Acc: {correct / total:.4f}")
+        if on_epoch:
+            on_epoch(epoch + 1, epochs, running_loss / total, correct / total)
+
+    head.eval()
+    if mode == 'fc':
+        net.fc.load_state_dict(head.state_dict())
+    else:
+        net.layer4.load_state_dict(head[0].state_dict())
+        net.fc.load_state_dict(head[3].state_dict())
+    return net
+
+
+def check_cache_budget(cache, mode, num_samples, max_cache_bytes=None):
+    """提取前估算特征缓存大小，超过 max_cache_bytes 或磁盘剩余空间时抛出 RuntimeError，返回估算字节数"""
+    need = num_samples * FEATURE_BYTES[mode]
+    if max_cache_bytes and need > max_cache_bytes:
+        raise RuntimeError(f"{mode} 特征缓存约需 {need / 1024 ** 3:.1f}GB，超过上限 {max_cache_bytes / 1024 ** 3:.1f}GB")
+    free = shutil.disk_usage(cache.cache_dir).free
+    if need > free:
+        raise RuntimeError(f"{mode} 特征缓存约需 {need / 1024 ** 3:.1f}GB，磁盘剩余 {free / 1024 ** 3:.1f}GB")
+    return need
+
+
+def fast_retrain(net, mode, original_dataset, feedback_dataset, dataset_id, cache, device,
+                 epochs=10, lr=None, log=print, on_epoch=None, max_cache_bytes=None):
+    """
+    完整的快速重训练流程：取 (或提取并缓存) 原始数据集特征 → 提取反馈特征 → 训练 head。
+    original_dataset / feedback_dataset 都应使用评估 transform (无随机增强)。
+    original_dataset 为 None (原始数据不可用) 时使用同一骨干权重下最近的特征缓存。
+    缓存未命中时先按 max_cache_bytes 与磁盘剩余空间检查缓存大小。
+    """
+    if mode not in FAST_MODES:
+        raise ValueError(f"Unknown fast retrain mode '{mode}', choose from {list(FAST_MODES)}")
+    net.to(device)
+    net_hash = backbone_hash(net, mode)
+    if original_dataset is None:
+        key = cache.find(mode, net_hash)
+        if key is None:
+            raise RuntimeError(f"原始数据集不可用，且没有 {mode} 模式下当前骨干权重的特征缓存")
+    else:
+        key = cache.make_key(mode, net_hash, dataset_id)
+    orig_feats, orig_labels = cache.load(key)
+    if orig_feats is None:
+        need = check_cache_budget(cache, mode, len(original_dataset), max_cache_bytes)
+        t0 = time.time()
+        log(f"🧊 特征缓存未命中 ({key})，提取原始数据集特征 {len(original_dataset)} 张 (约 {need / 1024 ** 3:.1f}GB)...")
+        orig_feats, orig_labels = extract_features(net, original_dataset, mode, device)
+        if orig_feats is None:
+            raise RuntimeError(f"原始数据集为空 (dataset_id={dataset_id})，无法提取特征")
+        cache.save(key, orig_feats, orig_labels)
+        cache.prune(key)
+        orig_feats, orig_labels = cache.load(key)
+        log(f"   特征提取完成，耗时 {time.time() - t0:.0f}s")
+    else:
+        log(f"🧊 命中特征缓存 ({key})，{len(orig_labels)} 条")
+
+    feature_sets = [(orig_feats, orig_labels)]
+    if feedback_dataset is not None and len(feedback_dataset):
+        fb_feats, fb_labels = extract_features(net, feedback_dataset, mode, device, num_workers=0)
+        feature_sets.append((fb_feats, fb_labels))
+
+    if lr is None:
+        lr = 1e-3 if mode == 'fc' else 1e-4
+    t0 = time.time()
+    train_head(net, mode, feature_sets, device, epochs=epochs, lr=lr, log=log, on_epoch=on_epoch)
+    log(f"   head 训练完成 ({mode})，耗时 {time.time() - t0:.1f}s")
+    return net
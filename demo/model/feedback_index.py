@@ -0,0 +1,149 @@
+# feedback_index.py
+# 反馈图片的持久化索引 (SQLite)：
+#   - 每张图片一行 (相对路径, 类别, sha256, 字节数, 时间)，另有按类别的计数表
+#   - 写文件 (tmp + os.replace) 后在同一个事务里插入记录并更新计数，计数查询 O(1)
+#   - 每条记录都带 sha256；默认每次提交都保存并计数 (重复纠错同样计入重训练阈值)，
+#     dedup=True 时同一类别下内容完全相同的图片只保存一次
+#   - 启动时 reconcile() 与目录对账：补登记未入库的文件、删除文件已不存在的记录
+#   - archive() 在持锁状态下移走整个反馈目录并清空索引，不会丢失归档期间的写入
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    path TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_feedback_label_hash ON feedback (label, sha256);
+CREATE TABLE IF NOT EXISTS label_counts (
+    label TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+);
+"""
+
+
+class FeedbackIndex:
+    def __init__(self, db_path, feedback_dir, dedup=False):
+        self.db_path = db_path
+        self.feedback_dir = feedback_dir
+        self.dedup = dedup
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        os.makedirs(feedback_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._load_counts()
+
+    def _load_counts(self):
+        self._counts = dict(self._conn.execute('SELECT label, n FROM label_counts WHERE n > 0'))
+        self._total = sum(self._counts.values())
+
+    # --- 查询 (内存计数，O(1)) ---
+    def count(self):
+        return self._total
+
+    def counts(self):
+        """各类别的反馈数量"""
+        with self._lock:
+            return dict(self._counts)
+
+    # --- 写入 ---
+    def add(self, label, data, ext='.jpg'):
+        """
+        保存一张反馈图片并登记，返回 (相对路径, 同类别下是否已有相同内容)。
+        dedup=True 时重复的图片不再落盘、不计数，直接返回已有记录的路径。
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT path FROM feedback WHERE label = ? AND sha256 = ?', (label, digest)
+            ).fetchone()
+            duplicate = row is not None
+            if duplicate and self.dedup:
+                return row[0], True
+
+            rel_path = os.path.join(label, f"{uuid.uuid4()}{ext}")
+            full_path = os.path.join(self.feedback_dir, rel_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            tmp = full_path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, full_path)
+            with self._conn:
+                self._insert(rel_path, label, digest, len(data), time.time())
+            self._counts[label] = self._counts.get(label, 0) + 1
+            self._total += 1
+            return rel_path, duplicate
+
+    def _insert(self, rel_path, label, digest, size, created_at):
+        """调用方负责事务与内存计数"""
+        self._conn.execute(
+            'INSERT INTO feedback (path, label, sha256, size, created_at) VALUES (?, ?, ?, ?, ?)',
+            (rel_path, label, digest, size, created_at)
+        )
+        self._conn.execute(
+            'INSERT INTO label_counts (label, n) VALUES (?, 1) ON CONFLICT(label) DO UPDATE SET n = n + 1',
+            (label,)
+        )
+
+    # --- 对账 / 归档 ---
+    def reconcile(self):
+        """与反馈目录对账 (启动时调用一次)，返回 {'added': n, 'removed': n}"""
+        with self._lock:
+            on_disk = {}
+            for root, _, files in os.walk(self.feedback_dir):
+                for f in files:
+                    full_path = os.path.join(root, f)
+                    rel_path = os.path.relpath(full_path, self.feedback_dir)
+                    # 只统计类别子目录中的图片 (与 ImageFolder 一致)
+                    if f.lower().endswith(IMAGE_EXTS) and os.sep in rel_path:
+                        on_disk[rel_path] = full_path
+            indexed = {path for (path,) in self._conn.execute('SELECT path FROM feedback')}
+
+            added = removed = 0
+            with self._conn:
+                for rel_path in indexed - set(on_disk):
+                    self._conn.execute('DELETE FROM feedback WHERE path = ?', (rel_path,))
+                    removed += 1
+                for rel_path in set(on_disk) - indexed:
+                    label = rel_path.split(os.sep, 1)[0]
+                    with open(on_disk[rel_path], 'rb') as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()
+                    # 目录里已有的重复文件同样登记，它们会参与训练
+                    self._conn.execute(
+                        'INSERT INTO feedback (path, label, sha256, size, created_at) VALUES (?, ?, ?, ?, ?)',
+                        (rel_path, label, digest, os.path.getsize(on_disk[rel_path]), os.path.getmtime(on_disk[rel_path]))
+                    )
+                    added += 1
+                # 计数表按记录整体重算
+                self._conn.execute('DELETE FROM label_counts')
+                self._conn.execute('INSERT INTO label_counts (label, n) SELECT label, COUNT(*) FROM feedback GROUP BY label')
+            self._load_counts()
+            return {'added': added, 'removed': removed}
+
+    def archive(self, dest):
+        """把当前反馈目录整体移到 dest 并清空索引 (持锁，期间的 add 会等待)，返回归档的图片数"""
+        with self._lock:
+            archived = self._total
+            shutil.move(self.feedback_dir, dest)
+            os.makedirs(self.feedback_dir, exist_ok=True)
+            with self._conn:
+                self._conn.execute('DELETE FROM feedback')
+                self._conn.execute('DELETE FROM label_counts')
+            self._counts, self._total = {}, 0
+            return archived
+
+    def stats(self):
+        with self._lock:
+            return {'total': self._total, 'per_class': dict(self._counts), 'db_path': self.db_path}
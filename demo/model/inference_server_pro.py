@@ -11,6 +11,7 @@ from torch.utils.data import Dataset, DataLoader
 from torchvision.models import resnet50
 from flask import Flask, request, jsonify
 from PIL import Image
+from worker_pool import InferenceWorkerPool
 
 # 尝试导入 GPU 监控库 (如果安装失败也不影响主程序运行)
 try:
@@ -25,6 +26,8 @@ except Exception as e:
 MODEL_PATH = '/home/hzcu/repo/modelStaff/ResNet50_v1.pth' 
 FEEDBACK_FOLDER = '/home/hzcu/repo/modelStaff/feedback_data'
 PORT = 5002  # 使用 5002 端口，避免冲突
+# 多进程推理：>0 时 fork 出 N 个共享权重的推理进程 (仅 CPU 模式，与 merged_server 相同)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
 
 # ================= 核心逻辑 =================
 app = Flask(__name__)
@@ -65,6 +68,21 @@ try:
 except Exception as e:
     print(f"❌ Error loading model: {e}")
 
+# worker 池必须在任何后台线程启动之前 fork；父进程的模型随后改为引用同一份共享权重
+worker_pool = None
+if INFERENCE_WORKERS > 0 and DEVICE.type == 'cpu':
+    worker_pool = InferenceWorkerPool(model.state_dict(), NUM_CLASSES, INFERENCE_WORKERS)
+    model.load_state_dict(worker_pool.shared_state, strict=True, assign=True)
+    print(f"🧵 已启动 {INFERENCE_WORKERS} 个推理进程，核分配: {worker_pool.core_slices}")
+elif INFERENCE_WORKERS > 0:
+    print("⚠️ INFERENCE_WORKERS 仅支持 CPU 推理，已忽略")
+
+def run_model(batch):
+    """有 worker 池时交给空闲 worker 前向，否则在本进程前向"""
+    if worker_pool is not None:
+        return worker_pool.forward(batch)
+    return model(batch.to(DEVICE))
+
 # --- 3. 预处理定义 ---
 transform = T.Compose([
     T.Resize(256),
@@ -139,9 +157,7 @@ def run_batch_inference(task_id, folder_path):
     # 3. 开始预测
     with torch.no_grad():
         for batch_imgs, batch_paths in dataloader:
-            batch_imgs = batch_imgs.to(DEVICE)
-            
-            outputs = model(batch_imgs)
+            outputs = run_model(batch_imgs)
             probs = torch.nn.functional.softmax(outputs, dim=1)
             confidences, preds = torch.max(probs, 1)
             
@@ -201,9 +217,9 @@ def predict():
     try:
         img_bytes = file.read()
         image = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-        img_tensor = transform(image).unsqueeze(0).to(DEVICE)
+        img_tensor = transform(image).unsqueeze(0)
         with torch.no_grad():
-            outputs = model(img_tensor)
+            outputs = run_model(img_tensor)
             conf, pred = torch.max(torch.nn.functional.softmax(outputs, dim=1), 1)
         return jsonify({
             'prediction': {'class_name': CLASS_NAMES[pred.item()], 'confidence': float(conf.item())},
@@ -1,17 +1,31 @@
+import time
+PROCESS_START_TIME = time.time()  # 用于统计冷启动 (进程启动 → 首次预测) 耗时
 import os
-import io
-import uuid
+import json
+import base64
 import threading
+from collections import namedtuple
 import torch
 import shutil
-import torchvision.transforms as T
-from torchvision import datasets
-from torch.utils.data import DataLoader, ConcatDataset, Dataset
-from torchvision.models import resnet50
-from flask import Flask, request, jsonify
-from PIL import Image
-import time
+import subprocess
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import DataLoader
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 import sys
+from micro_batcher import MicroBatcher
+from worker_pool import InferenceWorkerPool
+from prediction_cache import PredictionCache, content_hash
+from fast_preprocess import load_uint8_tensor, normalize_batch
+from inference_backends import InferenceBackend, BACKEND_NOTES, build_backend, calibration_batches
+import batch_results
+from dir_scanner import DirectoryScan, StreamingImageDataset
+from batch_tuner import BatchTuner
+from batch_jobs import BatchJobScheduler, QueueFullError, JobCancelled
+from model_registry import ModelRegistry, ChecksumMismatch
+from feedback_index import FeedbackIndex
+from fast_retrain import FAST_MODES
 
 # 尝试导入 GPU 监控库 (如果安装失败也不影响主程序运行)
 try:
@@ -24,19 +38,73 @@ except Exception as e:
 
 # ================= 1. 全局配置 =================
 BASE_DIR = '/home/hzcu/repo/modelStaff'
-# 权重路径
+# 权重路径 (仅在模型仓库为空时作为 v1 登记)
 MODEL_PATH = os.path.join(BASE_DIR, 'ResNet50_v1.pth')      
 BEST_MODEL_PATH = os.path.join(BASE_DIR, 'ResNet50_best.pth') 
+# 模型仓库：带校验和的版本化权重 + CURRENT 指针，重训练产出新版本，可随时回滚
+MODEL_REGISTRY_DIR = os.path.join(BASE_DIR, 'model_registry')
 # 数据路径
 FEEDBACK_DIR = os.path.join(BASE_DIR, 'feedback_data')        
 ARCHIVE_DIR = os.path.join(BASE_DIR, 'archived_feedback')     
+# 反馈索引 (SQLite)：写入时增量登记，计数不再遍历目录；放在反馈目录之外，归档时不会被移走
+FEEDBACK_INDEX_PATH = os.path.join(BASE_DIR, 'feedback_index.sqlite')
+# 1 = 同一类别下内容相同的反馈图片只保存、计数一次；默认 0，每次纠错都计入重训练阈值
+FEEDBACK_DEDUP = os.environ.get('FEEDBACK_DEDUP', '0') == '1'
 ORIGINAL_DATASET_DIR = '/home/hzcu/PlantDiseases_Final_Split' 
+# 原始训练集的预处理 uint8 分片 (modelStaff/shard_dataset.py 生成)，存在时重训练直接读分片，不再逐 epoch 解码 JPEG
+# 与 train_2.0.py / retrain.py 相同的布局：<数据集>_shards/train
+SHARD_DIR = os.environ.get('SHARD_DIR', os.path.join(ORIGINAL_DATASET_DIR + '_shards', 'train'))
+# 重训练模式：full (全网微调，默认，与原行为一致) | fc (冻结骨干，只训 fc) | layer4 (训 layer4 + fc)
+# fc / layer4 基于缓存的骨干特征训练，原始数据集特征只提取一次，快很多，但骨干不再随反馈更新，需显式开启
+# 磁盘占用：fc 每张图片约 4KB；layer4 缓存 fp16 的 layer3 特征图，每张约 392KB，全量数据集可达几十 GB
+RETRAIN_MODE = os.environ.get('RETRAIN_MODE', 'full')
+FAST_RETRAIN_EPOCHS = int(os.environ.get('FAST_RETRAIN_EPOCHS', 10))
+FEATURE_CACHE_DIR = os.path.join(BASE_DIR, 'feature_cache')
+FEATURE_CACHE_MAX_GB = float(os.environ.get('FEATURE_CACHE_MAX_GB', 20))  # 超过时重训练直接失败，不写满磁盘
+# 重训练在独立进程 (train_worker.py) 中进行：降低优先级、绑定到非预留核、限制线程数
+TRAIN_RUNS_DIR = os.path.join(BASE_DIR, 'train_runs')
+INFERENCE_RESERVED_CORES = int(os.environ.get('INFERENCE_RESERVED_CORES', 0))  # 0 = 自动 (一半核，至少 1 个)
+TRAIN_NICE = int(os.environ.get('TRAIN_NICE', 10))
+TRAIN_LOADER_WORKERS = int(os.environ.get('TRAIN_LOADER_WORKERS', 2))
+TRAIN_TIMEOUT = int(os.environ.get('TRAIN_TIMEOUT', 6 * 3600))  # 超时强制结束训练进程 (秒)
 
 RETRAIN_THRESHOLD = 1000
 PORT = 5003  # 保持原端口，对接后端
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# 模型格式：eager (torchvision 结构 + .pth) | torchscript (export_model.py 导出的冻结图，启动更快)
+MODEL_FORMAT = os.environ.get('MODEL_FORMAT', 'eager')
+
+TASKS_DB = {}  # 全局字典，只保存运行中批量任务的状态；完成后写入 meta 文件并从内存移除
+START_LOCK = threading.Lock()  # /batch/start 的查重与占位必须原子完成
+# 批量任务结果按任务流式写入 JSONL，不再整体放在内存里
+RESULTS_DIR = os.path.join(BASE_DIR, 'batch_results')
+INLINE_RESULTS_LIMIT = 1000  # 结果不超过此数量时 /batch/status 仍直接附带结果 (兼容旧调用方)
+# 批量任务 batch_size / loader worker 自动调优，结果按主机持久化
+BATCH_MEMORY_LIMIT_MB = int(os.environ.get('BATCH_MEMORY_LIMIT_MB', 4096))
+TUNING_STORE_PATH = os.path.join(BASE_DIR, 'batch_tuning.json')
+# 批量任务调度：固定数量的执行线程 + 有界队列 + 每用户并发上限，未完成任务持久化
+BATCH_JOB_WORKERS = int(os.environ.get('BATCH_JOB_WORKERS', 1))
+BATCH_QUEUE_MAX = int(os.environ.get('BATCH_QUEUE_MAX', 50))
+BATCH_PER_USER_LIMIT = int(os.environ.get('BATCH_PER_USER_LIMIT', 1))
+JOB_STORE_PATH = os.path.join(RESULTS_DIR, 'jobs.json')
 
-TASKS_DB = {}  # 全局字典，用于存储批量任务的状态
+# 动态微批处理：并发 /predict 请求合并成一个 batch 前向
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 16))
+MAX_BATCH_WAIT_MS = int(os.environ.get('MAX_BATCH_WAIT_MS', 10))
+# 多进程推理：>0 时 fork 出 N 个共享权重的推理进程 (仅 CPU 模式)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+# 推理后端：fp32 | channels_last | int8_dynamic_fc (仅 fc 量化，旧名 int8_dynamic) | int8_static (启动时选定)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'fp32')
+# 预测缓存：相同图片 (按内容哈希) 直接返回上次结果
+PREDICT_CACHE_MAX_MB = int(os.environ.get('PREDICT_CACHE_MAX_MB', 64))
+PREDICT_CACHE_TTL = int(os.environ.get('PREDICT_CACHE_TTL', 3600))
+# /predict/batch：单次请求最多图片数、并行解码线程数、默认 top-k (/predict 默认不返回 top-k)
+MAX_PREDICT_BATCH = int(os.environ.get('MAX_PREDICT_BATCH', 64))
+# 单张图片 / 整个请求 (zip 按解压后大小) 的上限，读取之前检查，防止 zip 炸弹
+MAX_PREDICT_IMAGE_MB = int(os.environ.get('MAX_PREDICT_IMAGE_MB', 20))
+MAX_PREDICT_BATCH_MB = int(os.environ.get('MAX_PREDICT_BATCH_MB', 256))
+DECODE_THREADS = int(os.environ.get('DECODE_THREADS', 4))
+DEFAULT_TOPK = 3
 
 # 类别定义 (必须与训练时严格一致)
 raw_classes = [
@@ -59,6 +127,14 @@ CLASS_NAMES = sorted(raw_classes)
 NUM_CLASSES = len(CLASS_NAMES)
 
 IS_TRAINING = False 
+TRAINING_PROGRESS = {}  # 训练进程最近上报的进度，/status 展示
+# 线上模型 = (版本号, fp32 模型, 推理后端, 权重文件)，作为一个整体发布：
+# 新版本在旁边构建、预热完成后只替换 ACTIVE 这一个引用，请求读到的永远是完整的某个版本
+ServingState = namedtuple('ServingState', ['version', 'model', 'backend', 'weights_path'])
+ACTIVE = None
+worker_pool = None  # INFERENCE_WORKERS > 0 时在模型加载后创建 (见下方「动态批处理调度器」)
+SWAP_LOCK = threading.Lock()  # 串行化发布 (重训练 / 回滚)
+COLD_START = {'model_load_seconds': None, 'first_prediction_seconds': None}
 
 app = Flask(__name__)
 
@@ -66,56 +142,156 @@ app = Flask(__name__)
 
 def load_network_structure():
     """构造resnet50并在最后全连接层匹配类别数"""
+    from torchvision.models import resnet50  # 延迟导入：torchscript 模式下启动时不需要 torchvision
     net = resnet50(weights=None)
     num_ftrs = net.fc.in_features
     net.fc = torch.nn.Linear(num_ftrs, NUM_CLASSES)
     return net
 
-def init_model():
-    """初始化模型加载，如果权重加载失败直接停止程序"""
+def torchscript_artifact_path(weights_path):
+    """export_model.py 为 xxx.pth 导出的冻结图路径"""
+    return os.path.splitext(weights_path)[0] + '.ts'
+
+registry = ModelRegistry(MODEL_REGISTRY_DIR)
+
+def bootstrap_registry():
+    """仓库为空时把现有权重 (优先重训练后的最优模型) 登记为第一个版本"""
+    if registry.current() is None:
+        seed = BEST_MODEL_PATH if os.path.exists(BEST_MODEL_PATH) else MODEL_PATH
+        if not os.path.exists(seed):
+            print(f"❌ 严重错误: 找不到任何权重文件于 {seed}")
+            sys.exit(1)
+        version = registry.register(seed, source=os.path.basename(seed))
+        registry.set_current(version)
+        print(f"📦 模型仓库初始化: {seed} → v{version}")
+    return registry.current()
+
+def load_model(version):
+    """从模型仓库加载某个版本；torchscript 模式下优先使用该版本目录中导出的冻结图"""
+    weights = registry.checkpoint_path(version)
+
+    # torchscript 模式：导出物存在且不比 .pth 旧时，直接加载冻结图，不构造 torchvision 模型
+    artifact = torchscript_artifact_path(weights)
+    if MODEL_FORMAT == 'torchscript':
+        if os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(weights):
+            net = torch.jit.load(artifact, map_location=DEVICE)
+            net.eval()
+            print(f"✅ TorchScript 模型加载成功: {artifact}")
+            return net
+        print(f"⚠️ 未找到最新的 TorchScript 导出物 {artifact}，回退到 eager 加载 (可运行 export_model.py 生成)")
+
     net = load_network_structure()
-    
-    # 优先加载重训练后的最优模型，否则加载初始模型
-    if os.path.exists(BEST_MODEL_PATH):
-        weights_to_load = BEST_MODEL_PATH
-        print(f"📈 发现重训练权重: {BEST_MODEL_PATH}")
-    else:
-        weights_to_load = MODEL_PATH
-        print(f"📦 加载初始权重: {MODEL_PATH}")
+    # strict=True 保证网络层必须完全匹配；load_state_dict 会先校验 sha256
+    net.load_state_dict(registry.load_state_dict(version, map_location=DEVICE), strict=True)
+    net.to(DEVICE)
+    net.eval()
+    return net
 
-    if not os.path.exists(weights_to_load):
-        print(f"❌ 严重错误: 找不到任何权重文件于 {weights_to_load}")
-        sys.exit(1)
+def is_scripted(net):
+    return isinstance(net, torch.jit.ScriptModule)
 
+def init_serving_backend(net):
+    """按 INFERENCE_BACKEND 基于 fp32 的 net 构造推理后端，失败时回退 fp32"""
+    if is_scripted(net):
+        if INFERENCE_BACKEND != 'fp32':
+            print(f"⚠️ TorchScript 模型不支持 {INFERENCE_BACKEND} 后端，使用冻结图直接推理")
+        return InferenceBackend('torchscript', net, inference_mode=True)
     try:
-        # strict=True 保证网络层必须完全匹配
-        state_dict = torch.load(weights_to_load, map_location=DEVICE)
-        net.load_state_dict(state_dict, strict=True)
-        net.to(DEVICE)
-        net.eval()
-        print(f"✅ 模型加载成功！当前设备: {DEVICE}")
-        return net
+        calib = None
+        if INFERENCE_BACKEND == 'int8_static':
+            print(f"🎯 正在从 {ORIGINAL_DATASET_DIR} 抽样校准 INT8 静态量化...")
+            calib = calibration_batches(ORIGINAL_DATASET_DIR)
+        backend = build_backend(INFERENCE_BACKEND, net, calib)
+        print(f"⚙️ 推理后端: {backend.name} ({BACKEND_NOTES.get(backend.name, backend.name)})")
+        return backend
     except Exception as e:
-        print(f"🚨 权重加载失败(可能是类别数不匹配): {e}")
-        sys.exit(1)
-
-# 全局初始化
-model = init_model()
-
-# 预处理保持与训练一致 (ImageNet标准)
-inference_transform = T.Compose([
-    T.Resize(256),
-    T.CenterCrop(224),
-    T.ToTensor(),
-    T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
-
-train_transform = T.Compose([
-    T.RandomResizedCrop(224),
-    T.RandomHorizontalFlip(),
-    T.ToTensor(),
-    T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+        print(f"⚠️ 推理后端 {INFERENCE_BACKEND} 构造失败，回退 fp32: {e}")
+        return build_backend('fp32', net)
+
+def warm_up(backend):
+    """发布前先跑几次前向 (单张 + 满 batch)，让新模型的内存分配和算子选择在切换前完成"""
+    for n in (1, MAX_BATCH_SIZE):
+        backend(normalize_batch(torch.zeros(n, 3, 224, 224, dtype=torch.uint8)).to(DEVICE))
+
+def build_serving_state(version, warm=True):
+    """在旁边完整构建某个版本的模型与推理后端 (不影响线上请求)"""
+    net = load_model(version)
+    if worker_pool is not None and not is_scripted(net):
+        # 池模式下前向全部在 worker 中进行：父进程不再构造量化/channels_last 副本，也无需预热，
+        # 只保留 fp32 模型 (publish 时改为引用共享权重)
+        return ServingState(version, net, InferenceBackend(worker_pool.backend_name, net),
+                            registry.checkpoint_path(version))
+    backend = init_serving_backend(net)
+    if warm:
+        warm_up(backend)
+    return ServingState(version, net, backend, registry.checkpoint_path(version))
+
+def publish(state):
+    """原子发布：worker 池换权重 → 替换 ACTIVE 引用 → 移动 CURRENT 指针 → 清理旧版本缓存"""
+    global ACTIVE
+    with SWAP_LOCK:
+        if worker_pool is not None:
+            worker_pool.reload(state.model.state_dict(), version=state.version)
+            state.model.load_state_dict(worker_pool.shared_state, strict=True, assign=True)
+        ACTIVE = state
+        registry.set_current(state.version)
+        prediction_cache.drop_stale_versions(state.version)
+    print(f"🔁 线上模型已切换到 v{state.version} ({state.backend.name})")
+
+# 全局初始化 (model 始终保持 fp32 eager，重训练以它为起点；backend 才是实际用于推理的后端)
+try:
+    ACTIVE = build_serving_state(bootstrap_registry(), warm=False)
+    print(f"✅ 模型 v{ACTIVE.version} 加载成功！当前设备: {DEVICE}")
+except Exception as e:
+    print(f"🚨 权重加载失败(可能是类别数不匹配或校验失败): {e}")
+    sys.exit(1)
+COLD_START['model_load_seconds'] = round(time.time() - PROCESS_START_TIME, 3)
+print(f"⏱️ 进程启动到模型就绪: {COLD_START['model_load_seconds']}s")
+
+# ================= 动态批处理调度器 =================
+# worker 池必须在任何后台线程启动之前 fork
+if INFERENCE_WORKERS > 0:
+    if DEVICE.type != 'cpu':
+        print("⚠️ INFERENCE_WORKERS 仅支持 CPU 推理，已忽略")
+    elif ACTIVE.backend.name == 'torchscript':
+        print("⚠️ TorchScript 模式不支持多进程 worker (冻结图无法共享 state_dict)，已回退到单进程推理")
+    elif ACTIVE.backend.name == 'int8_static':
+        print("⚠️ int8_static 后端不支持多进程 worker (需逐进程校准)，已回退到单进程推理")
+    else:
+        worker_pool = InferenceWorkerPool(
+            ACTIVE.model.state_dict(), NUM_CLASSES, INFERENCE_WORKERS, ACTIVE.backend.name, version=ACTIVE.version
+        )
+        # 父进程的 fp32 模型改为引用同一份共享权重，并丢弃只在单进程模式下使用的后端副本 (如 int8 的 deepcopy)
+        ACTIVE.model.load_state_dict(worker_pool.shared_state, strict=True, assign=True)
+        ACTIVE = ACTIVE._replace(backend=InferenceBackend(worker_pool.backend_name, ACTIVE.model))
+        print(f"🧵 已启动 {INFERENCE_WORKERS} 个推理进程，核分配: {worker_pool.core_slices}")
+
+def forward_versioned(batch):
+    """对一个 batch 做前向，返回 (模型版本, logits)；版本与实际参与前向的权重一致"""
+    if worker_pool is not None:
+        return worker_pool.forward_versioned(batch)
+    state = ACTIVE  # 只读取一次引用，整个 batch 由同一个版本完成
+    return state.version, state.backend(normalize_batch(batch).to(DEVICE)).float().cpu()
+
+def run_model(batch):
+    """对一个 batch 做前向，返回 logits (CPU)；uint8 batch 会先整体归一化"""
+    return forward_versioned(batch)[1]
+
+def run_model_rows(batch):
+    """微批调度器用：每一行输出都带上产生它的模型版本"""
+    version, logits = forward_versioned(batch)
+    return [(version, row) for row in logits]
+
+batch_tuner = BatchTuner(TUNING_STORE_PATH, memory_limit_mb=BATCH_MEMORY_LIMIT_MB)
+
+prediction_cache = PredictionCache(max_bytes=PREDICT_CACHE_MAX_MB * 1024 * 1024, ttl_seconds=PREDICT_CACHE_TTL)
+
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_THREADS, thread_name_prefix='decode')
+
+predict_batcher = MicroBatcher(
+    run_model_rows, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS,
+    name='predict-batcher', num_threads=INFERENCE_WORKERS if worker_pool else 1
+)
 
 # ================= 辅助工具：GPU 监控 =================
 def get_gpu_usage():
@@ -133,164 +309,277 @@ def get_gpu_usage():
         return "GPU: Err"
 
 # ================= 批量处理工具类 =================
-class ImageFolderDataset(Dataset):
-    """自定义 Dataset，用于读取文件夹中的图片"""
-    def __init__(self, file_paths, transform):
-        self.file_paths = file_paths
-        self.transform = transform
-
-    def __len__(self):
-        return len(self.file_paths)
-
-    def __getitem__(self, idx):
-        path = self.file_paths[idx]
-        try:
-            image = Image.open(path).convert('RGB')
-            return self.transform(image), path
-        except Exception as e:
-            print(f"⚠️ Reads error {path}: {e}")
-            # 返回一个全0的tensor防止报错中断，后续可以根据path过滤
-            return torch.zeros((3, 224, 224)), "ERROR_FILE"
-
-def run_batch_inference(task_id, folder_path):
-    """后台运行的批量预测逻辑"""
+def run_batch_inference(task_id, folder_path, topk=DEFAULT_TOPK, include_logits=False):
+    """后台运行的批量预测逻辑，结果逐 batch 追加到磁盘；topk>0 时每条结果附带 top-k，include_logits 附带 base64 logits"""
     print(f"[{task_id}] Thread started for: {folder_path}")
     
-    # 1. 扫描文件
-    valid_exts = ('.jpg', '.jpeg', '.png', '.bmp')
-    all_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.lower().endswith(valid_exts)]
-    total = len(all_files)
-    
-    if total == 0:
-        TASKS_DB[task_id]['status'] = 'failed'
-        TASKS_DB[task_id]['error'] = 'No images found in folder'
-        return
-
-    # 2. 策略选择 (Q3需求)
-    batch_size = 32 if total >= 50 else 1
-    num_workers = 4 if os.cpu_count() > 4 else 0
-    
-    print(f"[{task_id}] Strategy: Total={total}, BatchSize={batch_size}")
+    # 1. 扫描文件：目录只遍历一次 (DirectoryScan)，边遍历边统计总数 (进度条用) 边把路径分给 DataLoader worker，
+    # 推理不等扫描结束就开始。小文件夹可能推理先结束、任务已从 TASKS_DB 移除，所以这里用 get
+    def on_scan_progress(count):
+        task = TASKS_DB.get(task_id)
+        if task is not None and task['status'] != 'completed':
+            task['total'] = count
 
-    dataset = ImageFolderDataset(all_files, inference_transform)
-    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    def on_scan_done(total):
+        task = TASKS_DB.get(task_id)
+        if task is not None and task['status'] != 'completed':
+            task.update({'total': total, 'scan_complete': True})
 
-    TASKS_DB[task_id].update({'total': total, 'processed': 0, 'status': 'processing'})
-    
-    results = []
+    TASKS_DB[task_id].update({'scan_complete': False})
+
+    processed = 0
     start_time = time.time()
+    writer = None
+    scan = None
 
-    # 3. 开始预测
-    with torch.no_grad():
-        for batch_imgs, batch_paths in dataloader:
-            batch_imgs = batch_imgs.to(DEVICE)
-            
-            outputs = model(batch_imgs)
-            probs = torch.nn.functional.softmax(outputs, dim=1)
-            confidences, preds = torch.max(probs, 1)
-            
-            # 处理这一个 Batch 的结果
-            current_batch_results = []
-            for i in range(len(batch_paths)):
-                path = batch_paths[i]
-                if path == "ERROR_FILE": continue # 跳过损坏图片
-
-                idx = preds[i].item()
-                conf = confidences[i].item()
+    # 探测、DataLoader 构造、结果文件打开都放进 try：任何一步失败，任务都以 failed 结束并写入 meta
+    try:
+        # 2. 策略选择 (Q3需求)：本机已有调优记录直接用，否则用前几十张图实测吞吐后锁定
+        config = batch_tuner.get_config(
+            folder_path, run_model, ACTIVE.backend.name, worker_pool.num_workers if worker_pool else 0,
+            rss_pids=worker_pool.pids if worker_pool else None
+        )
+        batch_size, num_workers = config['batch_size'], config['num_workers']
+        TASKS_DB[task_id]['config'] = config
+        TASKS_DB[task_id]['model_version'] = ACTIVE.version
+
+        print(f"[{task_id}] v{ACTIVE.version} Strategy: Streaming scan, BatchSize={batch_size}, Workers={num_workers} ({config['source']})")
+
+        # 递归扫描在本进程的扫描线程里进行 (须在 DataLoader 创建 worker 之前启动)，魔数校验 + 解码在 DataLoader 里流式进行
+        scan = DirectoryScan(folder_path, num_consumers=num_workers,
+                             on_progress=on_scan_progress, on_done=on_scan_done).start()
+        dataset = StreamingImageDataset(folder_path, scan=scan)
+        dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+        writer = batch_results.BatchResultWriter(batch_results.results_path(RESULTS_DIR, task_id))
+        TASKS_DB[task_id].update({
+            'processed': 0, 'status': 'processing',
+            'result_count': 0, 'offsets': writer.offsets, 'index_every': writer.index_every
+        })
+
+        # 3. 开始预测
+        with torch.no_grad():
+            for batch_imgs, batch_paths in dataloader:
+                batch_scheduler.check_cancelled(task_id)
+                outputs = run_model(batch_imgs)
+                probs = torch.nn.functional.softmax(outputs, dim=1)
+                # 整个 batch 一次 topk，第一列即 top-1
+                values, indices = torch.topk(probs, max(topk, 1), dim=1)
+                logits16 = outputs.cpu().numpy().astype('float16') if include_logits else None
                 
-                res = {
-                    "filename": os.path.basename(path),
-                    "class_name": CLASS_NAMES[idx],
-                    "confidence": float(f"{conf:.4f}")
-                }
-                current_batch_results.append(res)
-            
-            results.extend(current_batch_results)
-            
-            # 更新全局进度
-            processed = len(results)
-            elapsed = time.time() - start_time
-            avg_per_img = elapsed / processed if processed > 0 else 0
-            eta = (total - processed) * avg_per_img
-            
-            TASKS_DB[task_id].update({
-                'processed': processed,
-                'progress_percent': int((processed / total) * 100),
-                'eta_seconds': int(eta),
-                'avg_latency_ms': int(avg_per_img * 1000)
-            })
-            
-            # 管理员日志 (Q1 & Q4)
-            gpu_log = get_gpu_usage()
-            print(f"[{task_id}] {processed}/{total} ({int(processed/total*100)}%) | ETA: {int(eta)}s | {gpu_log}")
+                # 处理这一个 Batch 的结果 (损坏图片已在扫描/解码阶段被丢弃)
+                current_batch_results = []
+                for i in range(len(batch_paths)):
+                    path = batch_paths[i]
+                    idx = indices[i, 0].item()
+                    conf = values[i, 0].item()
+                    
+                    res = {
+                        "filename": os.path.basename(path),
+                        "class_name": CLASS_NAMES[idx],
+                        "confidence": float(f"{conf:.4f}")
+                    }
+                    if topk:
+                        res["topk"] = topk_entries(values[i], indices[i])
+                    if include_logits:
+                        res["logits_b64"] = encode_logits(logits16[i])
+                    current_batch_results.append(res)
+                
+                # 这一个 batch 的结果直接落盘，内存中只保留计数
+                writer.write_many(current_batch_results)
+                
+                # 更新全局进度
+                processed += len(batch_paths)
+                total = max(TASKS_DB[task_id]['total'], processed)
+                elapsed = time.time() - start_time
+                avg_per_img = elapsed / processed if processed > 0 else 0
+                eta = (total - processed) * avg_per_img
+                
+                TASKS_DB[task_id].update({
+                    'processed': processed,
+                    'result_count': writer.count,
+                    'progress_percent': int((processed / total) * 100),
+                    'eta_seconds': int(eta),
+                    'avg_latency_ms': int(avg_per_img * 1000)
+                })
+                
+                # 管理员日志 (Q1 & Q4)
+                gpu_log = get_gpu_usage()
+                print(f"[{task_id}] {processed}/{total} ({int(processed/total*100)}%) | ETA: {int(eta)}s | {gpu_log}")
+
+        # 4. 完成
+        if processed == 0:
+            raise RuntimeError('No images found in folder')
+        TASKS_DB[task_id].update({'status': 'completed', 'total': processed, 'progress_percent': 100})
+        print(f"[{task_id}] Finished in {int(time.time() - start_time)}s, results: {writer.path}")
+    except JobCancelled:
+        TASKS_DB[task_id].update({'status': 'cancelled'})
+        print(f"[{task_id}] ⏹️ Cancelled after {processed} images")
+    except Exception as e:
+        TASKS_DB[task_id].update({'status': 'failed', 'error': str(e)})
+        print(f"[{task_id}] ❌ Failed: {e}")
+    finally:
+        # 取消 / 失败时扫描线程也随之停止，不再继续遍历目录
+        if scan is not None:
+            scan.stop()
+        if writer is not None:
+            writer.close()
+        finish_task(task_id)
+
+def run_batch_job(task_id, job):
+    """调度器执行线程的入口"""
+    TASKS_DB.setdefault(task_id, {'processed': 0, 'total': 0})['status'] = 'pending'
+    run_batch_inference(task_id, job['folder_path'], topk=job.get('topk', DEFAULT_TOPK),
+                        include_logits=job.get('logits', False))
+
+def requeue_task(task_id, job):
+    """服务重启后恢复的任务重新出现在 TASKS_DB 中"""
+    TASKS_DB[task_id] = {'status': 'queued', 'processed': 0, 'total': 0}
 
-    # 4. 完成
-    TASKS_DB[task_id]['status'] = 'completed'
-    TASKS_DB[task_id]['results'] = results # 这里存了所有结果
-    # 注意：如果 results 极大(几十万条)，建议直接写入 json 文件到硬盘，而不是存在内存里
-    print(f"[{task_id}] Finished in {int(time.time() - start_time)}s")
+batch_scheduler = BatchJobScheduler(
+    run_batch_job, JOB_STORE_PATH, num_workers=BATCH_JOB_WORKERS, max_queue=BATCH_QUEUE_MAX,
+    per_user_limit=BATCH_PER_USER_LIMIT, on_requeue=requeue_task
+)
+
+def finish_task(task_id):
+    """任务结束：状态写入 meta 文件，并把任务从内存中移除"""
+    meta = dict(TASKS_DB[task_id])
+    meta['offsets'] = list(meta.get('offsets', [0]))
+    meta['finished_at'] = time.time()
+    batch_results.save_meta(RESULTS_DIR, task_id, meta)
+    TASKS_DB.pop(task_id, None)
+
+def load_task(task_id):
+    """运行中的任务从内存取，已结束的任务从 meta 文件取"""
+    task = TASKS_DB.get(task_id)
+    if task is not None:
+        return task
+    return batch_results.load_meta(RESULTS_DIR, task_id)
 
 
 # ================= 3. 辅助功能 =================
 
+feedback_index = FeedbackIndex(FEEDBACK_INDEX_PATH, FEEDBACK_DIR, dedup=FEEDBACK_DEDUP)
+reconciled = feedback_index.reconcile()
+print(f"🗂️ 反馈索引: {feedback_index.count()} 张 (启动对账 +{reconciled['added']} / -{reconciled['removed']})")
+
 def get_feedback_count():
-    count = 0
-    for root, dirs, files in os.walk(FEEDBACK_DIR):
-        count += len([f for f in files if f.endswith(('.jpg', '.png', '.jpeg'))])
-    return count
+    return feedback_index.count()
+
+def training_core_split():
+    """把本进程可用的核分成 (推理预留, 训练可用)；只有 1 个核时两者共用，靠 nice 保证推理优先"""
+    if not hasattr(os, 'sched_getaffinity'):
+        return None, None
+    cores = sorted(os.sched_getaffinity(0))
+    reserved = INFERENCE_RESERVED_CORES or max(1, len(cores) // 2)
+    if len(cores) <= reserved:
+        return cores, cores
+    return cores[:reserved], cores[reserved:]
+
+
+def run_training_worker(run_dir, input_checkpoint):
+    """启动 train_worker.py 子进程并逐行读取进度，返回输出 checkpoint 路径；失败时抛出异常"""
+    inference_cores, training_cores = training_core_split()
+    output_checkpoint = os.path.join(run_dir, 'output.pth')
+    config = {
+        'mode': RETRAIN_MODE, 'device': str(DEVICE), 'class_names': CLASS_NAMES,
+        'input_checkpoint': input_checkpoint, 'output_checkpoint': output_checkpoint,
+        'original_dir': ORIGINAL_DATASET_DIR, 'shard_dir': SHARD_DIR, 'feedback_dir': FEEDBACK_DIR,
+        'feature_cache_dir': FEATURE_CACHE_DIR, 'epochs': 3, 'fast_epochs': FAST_RETRAIN_EPOCHS,
+        'feature_cache_max_bytes': int(FEATURE_CACHE_MAX_GB * 1024 ** 3),
+        'cores': training_cores, 'threads': len(training_cores) if training_cores else None,
+        'nice': TRAIN_NICE, 'num_workers': TRAIN_LOADER_WORKERS
+    }
+    config_path = os.path.join(run_dir, 'config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_worker.py')
+    print(f"🧵 训练进程核: {training_cores} | 推理预留核: {inference_cores} | nice={TRAIN_NICE}")
+    proc = subprocess.Popen(
+        [sys.executable, worker_script, config_path],
+        stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(worker_script)
+    )
+    watchdog = threading.Timer(TRAIN_TIMEOUT, proc.kill)
+    watchdog.start()
+    result = None
+    try:
+        for line in proc.stdout:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            event = msg.get('event')
+            if event == 'log':
+                print(msg.get('message'))
+            elif event in ('started', 'progress'):
+                TRAINING_PROGRESS.update({k: v for k, v in msg.items() if k != 'event'}, phase=event)
+            elif event in ('done', 'error'):
+                result = msg
+        proc.wait()
+    finally:
+        watchdog.cancel()
+
+    if result is None or result['event'] != 'done' or proc.returncode != 0:
+        reason = result.get('message') if result else f"exit code {proc.returncode}"
+        raise RuntimeError(f"训练进程失败: {reason}")
+    return result['checkpoint']
+
 
 def train_task_thread():
-    global IS_TRAINING, model
+    global IS_TRAINING
     print("\n🚀 后台训练任务开始...")
     IS_TRAINING = True
+    TRAINING_PROGRESS.clear()
+    TRAINING_PROGRESS.update(phase='preparing', mode=RETRAIN_MODE)
     
     try:
-        # A. 检查数据
-        if not os.path.exists(ORIGINAL_DATASET_DIR):
-            print(f"❌ 错误: 原始训练集目录不存在 {ORIGINAL_DATASET_DIR}")
-            return
-
-        original_dataset = datasets.ImageFolder(ORIGINAL_DATASET_DIR, transform=train_transform)
-        feedback_dataset = datasets.ImageFolder(FEEDBACK_DIR, transform=train_transform)
-        combined_dataset = ConcatDataset([original_dataset, feedback_dataset])
-        
-        # 建议 batch_size 不要太大
-        train_loader = DataLoader(combined_dataset, batch_size=32, shuffle=True, num_workers=4) 
-        
-        # B. 准备模型（在当前权重基础上继续练）
-        new_model = load_network_structure()
-        new_model.load_state_dict(model.state_dict())
-        new_model.to(DEVICE)
-        new_model.train()
-
-        criterion = torch.nn.CrossEntropyLoss()
-        optimizer = torch.optim.Adam(new_model.parameters(), lr=0.00001) # 用更小的学习率防止破坏权重
-
-        EPOCHS = 3
-        for epoch in range(EPOCHS):
-            running_loss = 0.0
-            for inputs, labels in train_loader:
-                inputs, labels = inputs.to(DEVICE), labels.to(DEVICE)
-                optimizer.zero_grad()
-                outputs = new_model(inputs)
-                loss = criterion(outputs, labels)
-                loss.backward()
-                optimizer.step()
-                running_loss += loss.item()
-            print(f"   Epoch {epoch+1}/{EPOCHS} - Loss: {running_loss/len(train_loader):.4f}")
-
-        # C. 保存与同步
-        torch.save(new_model.state_dict(), BEST_MODEL_PATH)
-        model.load_state_dict(new_model.state_dict())
-        model.eval()
+        # A. 检查数据：有分片时不需要原始目录；fc / layer4 还可以只用已缓存的特征 (由训练进程判断)
+        shards_available = os.path.exists(os.path.join(SHARD_DIR, 'index.json'))
+        if not shards_available and not os.path.exists(ORIGINAL_DATASET_DIR):
+            if RETRAIN_MODE not in FAST_MODES:
+                print(f"❌ 错误: 原始训练集目录不存在 {ORIGINAL_DATASET_DIR}")
+                TRAINING_PROGRESS.update(phase='failed', error=f'原始训练集目录不存在 {ORIGINAL_DATASET_DIR}')
+                return
+            print(f"⚠️ 原始训练集目录不存在 {ORIGINAL_DATASET_DIR}，尝试只使用已缓存的特征")
 
-        # D. 归档数据
+        # B. 在独立进程中训练（以当前线上版本的权重为起点），本进程只等待结果
+        base = ACTIVE
+        run_dir = os.path.join(TRAIN_RUNS_DIR, str(int(time.time())))
+        os.makedirs(run_dir, exist_ok=True)
         archive_dest = os.path.join(ARCHIVE_DIR, str(int(time.time())))
-        shutil.move(FEEDBACK_DIR, archive_dest)
-        os.makedirs(FEEDBACK_DIR, exist_ok=True)
-        print(f"📦 训练完成，模型已更新，反馈数据已归档。")
+        data_snapshot = {
+            'retrain_mode': RETRAIN_MODE,
+            'original_dataset': ORIGINAL_DATASET_DIR,
+            'shard_dir': SHARD_DIR if shards_available else None,
+            'feedback_images': get_feedback_count(),
+            'feedback_per_class': feedback_index.counts(),
+            'feedback_archive': archive_dest
+        }
+
+        started = time.time()
+        output_checkpoint = run_training_worker(run_dir, base.weights_path)
+        train_seconds = round(time.time() - started, 1)
+        print(f"⏱️ 重训练 ({RETRAIN_MODE}) 耗时 {train_seconds}s")
+
+        # C. 登记新版本 → 在旁边构建并预热 → 原子发布 (线上请求全程使用旧版本，不会看到半更新的权重)
+        TRAINING_PROGRESS['phase'] = 'publishing'
+        metrics = {k: TRAINING_PROGRESS[k] for k in ('loss', 'acc') if k in TRAINING_PROGRESS}
+        metrics['train_seconds'] = train_seconds
+        version = registry.register(
+            output_checkpoint, source=f"retrain:{RETRAIN_MODE}", parent=base.version,
+            data=data_snapshot, metrics=metrics
+        )
+        publish(build_serving_state(version))
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+        # D. 归档数据
+        feedback_index.archive(archive_dest)
+        TRAINING_PROGRESS.update(phase='done', version=version)
+        print(f"📦 训练完成，模型 v{version} 已上线，反馈数据已归档。")
 
     except Exception as e:
+        TRAINING_PROGRESS.update(phase='failed', error=str(e))
         print(f"❌ 训练任务失败: {e}")
     finally:
         IS_TRAINING = False
@@ -299,7 +588,11 @@ def train_task_thread():
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "up", "device": str(DEVICE), "mode": "Merged"})
+    return jsonify({
+        "status": "up", "device": str(DEVICE), "mode": "Merged", "backend": ACTIVE.backend.name,
+        "model_version": ACTIVE.version,
+        "cold_start": COLD_START
+    })
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -307,32 +600,257 @@ def predict():
     file = request.files['file']
     
     try:
-        image = Image.open(io.BytesIO(file.read())).convert('RGB')
-        img_tensor = inference_transform(image).unsqueeze(0).to(DEVICE)
-        
-        with torch.no_grad():
-            outputs = model(img_tensor)
+        raw_data = file.read()
+        digest = content_hash(raw_data)
+        version = ACTIVE.version
+        use_cache = request.args.get('cache', '1') != '0'  # ?cache=0 跳过缓存 (压测用)
+        cached = prediction_cache.get(version, digest) if use_cache else None
+
+        # ?topk=3 返回前 k 个类别及概率；?logits=1 返回 base64 float16 原始 logits
+        k = max(0, min(request.args.get('topk', 0, type=int), NUM_CLASSES))
+        include_logits = request.args.get('logits') == '1'
+
+        if cached is not None:
+            idx = cached['class_idx']
+            probs_row = torch.from_numpy(cached['probs'])
+            logits16 = cached['logits']
+        else:
+            img_tensor = load_uint8_tensor(raw_data)
+            
+            # 交给调度器与其他并发请求合并前向，拿回属于本图片的一行 logits 及实际使用的模型版本
+            version, row = predict_batcher.submit(img_tensor)
+            outputs = row.unsqueeze(0)
             # 调试：打印原始 Logits，观察是否某一项特别突出
-            # print(f"Logits: {outputs.cpu().numpy()}") 
+            # print(f"Logits: {outputs.numpy()}") 
             
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            confidence, predicted_idx = torch.max(probabilities, 1)
+            probs_row = torch.nn.functional.softmax(outputs, dim=1)[0]
+            idx = int(probs_row.argmax())
+            logits16 = outputs[0].numpy().astype('float16')
+            prediction_cache.put(version, digest, idx, probs_row.numpy(), logits16)
+        conf_score = float(probs_row[idx])
 
-        result_class = CLASS_NAMES[predicted_idx.item()]
-        conf_score = confidence.item()
+        result_class = CLASS_NAMES[idx]
+        if COLD_START['first_prediction_seconds'] is None:
+            COLD_START['first_prediction_seconds'] = round(time.time() - PROCESS_START_TIME, 3)
+            print(f"⏱️ 进程启动到首次预测: {COLD_START['first_prediction_seconds']}s")
 
-        print(f"🔍 预测结果: {result_class} (置信度: {conf_score:.4f})")
+        print(f"🔍 [v{version}] 预测结果: {result_class} (置信度: {conf_score:.4f}){' [cache]' if cached else ''}")
 
-        return jsonify({
+        response = {
             'prediction': {
                 'class_name': result_class,
                 'confidence': float(f"{conf_score:.4f}")
             },
+            'cached': cached is not None,
+            'model_version': version,
             'status': 'success'
-        })
+        }
+        if k:
+            values, indices = torch.topk(probs_row.unsqueeze(0), k, dim=1)
+            response['prediction']['topk'] = topk_entries(values[0], indices[0])
+        if include_logits:
+            response['prediction']['logits_b64'] = encode_logits(logits16)
+        return jsonify(response)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+class BatchTooLarge(Exception):
+    """/predict/batch 的图片数量或大小超过上限 (映射为 413)"""
+
+
+def read_batch_items():
+    """
+    收集 /predict/batch 的图片：多个 multipart 'files' (或 'file')，
+    或一个 zip (multipart 'archive' 字段，或 Content-Type: application/zip 的请求体)。
+    返回 [(文件名, bytes)]，顺序与请求中一致。
+    数量与大小在读取之前检查，超限时抛出 BatchTooLarge。
+    """
+    max_image = MAX_PREDICT_IMAGE_MB * 1024 * 1024
+    max_total = MAX_PREDICT_BATCH_MB * 1024 * 1024
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if files:
+        if len(files) > MAX_PREDICT_BATCH:
+            raise BatchTooLarge(f'Too many images (max {MAX_PREDICT_BATCH})')
+        items, total = [], 0
+        for f in files:
+            data = f.read(max_image + 1)
+            if len(data) > max_image:
+                raise BatchTooLarge(f'{f.filename} exceeds {MAX_PREDICT_IMAGE_MB}MB')
+            total += len(data)
+            if total > max_total:
+                raise BatchTooLarge(f'Request exceeds {MAX_PREDICT_BATCH_MB}MB')
+            items.append((f.filename, data))
+        return items
+
+    if 'archive' in request.files:
+        source = request.files['archive'].stream
+    elif request.mimetype in ('application/zip', 'application/x-zip-compressed'):
+        source = request.stream
+    else:
+        return []
+
+    # zip 需要随机访问，先落到 SpooledTemporaryFile (小文件留在内存，大文件自动转存磁盘)
+    with tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024) as spool:
+        # 压缩包本身也不能超过总上限
+        while chunk := source.read(1024 * 1024):
+            spool.write(chunk)
+            if spool.tell() > max_total:
+                raise BatchTooLarge(f'Archive exceeds {MAX_PREDICT_BATCH_MB}MB')
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as zf:
+            # 先按中央目录检查数量与解压后大小，再解压 (zf.read 不会超过登记的 file_size)
+            entries = [
+                info for info in zf.infolist()
+                if not info.is_dir() and os.path.basename(info.filename)
+                and not os.path.basename(info.filename).startswith('.') and '__MACOSX' not in info.filename
+            ]
+            if len(entries) > MAX_PREDICT_BATCH:
+                raise BatchTooLarge(f'Too many images (max {MAX_PREDICT_BATCH})')
+            for info in entries:
+                if info.file_size > max_image:
+                    raise BatchTooLarge(f'{info.filename} exceeds {MAX_PREDICT_IMAGE_MB}MB')
+            if sum(info.file_size for info in entries) > max_total:
+                raise BatchTooLarge(f'Archive exceeds {MAX_PREDICT_BATCH_MB}MB uncompressed')
+            return [(info.filename, zf.read(info)) for info in entries]
+
+def topk_entries(values, indices):
+    """torch.topk 结果的一行 → [{'class_name', 'probability'}]，按概率降序"""
+    return [
+        {'class_name': CLASS_NAMES[i], 'probability': float(f"{v:.4f}")}
+        for v, i in zip(values.tolist(), indices.tolist())
+    ]
+
+def encode_logits(logits16):
+    """float16 logits → base64 (小端字节序)，42 类约 112 个字符"""
+    if logits16 is None:
+        return None
+    return base64.b64encode(logits16.astype('<f2').tobytes()).decode('ascii')
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    多图预测：并行解码 → 一次 batch 前向 → 按请求顺序返回每张图片的类别、置信度与 top-k。
+    单张图片解码失败只影响该图片 (status=error)。
+    参数: ?topk=3 返回的 top-k 数量 (与 /predict 相同)；?logits=1 附带 base64 float16 logits；?cache=0 跳过预测缓存 (压测用)
+    """
+    try:
+        items = read_batch_items()
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'Invalid zip archive'}), 400
+    except BatchTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    if not items:
+        return jsonify({'error': 'No files'}), 400
+
+    k = max(1, min(request.args.get('topk', DEFAULT_TOPK, type=int), NUM_CLASSES))
+    use_cache = request.args.get('cache', '1') != '0'
+    include_logits = request.args.get('logits') == '1'
+    start = time.perf_counter()
+    version = ACTIVE.version
+    results = [None] * len(items)
+    probs_by_index, logits_by_index = {}, {}
+
+    # 1. 命中缓存的直接取概率，其余并行解码
+    digests = [content_hash(data) for _, data in items]
+    to_decode = []
+    for i, digest in enumerate(digests):
+        cached = prediction_cache.get(version, digest) if use_cache else None
+        if cached is not None:
+            probs_by_index[i] = torch.from_numpy(cached['probs'])
+            logits_by_index[i] = cached['logits']
+        else:
+            to_decode.append(i)
+    futures = {i: decode_pool.submit(load_uint8_tensor, items[i][1]) for i in to_decode}
+
+    tensors, tensor_indices = [], []
+    for i, future in futures.items():
+        try:
+            tensors.append(future.result())
+            tensor_indices.append(i)
+        except Exception as e:
+            results[i] = {'index': i, 'filename': items[i][0], 'status': 'error', 'error': f'Decode failed: {e}'}
+
+    # 2. 成功解码的图片一次前向
+    if tensors:
+        try:
+            with torch.no_grad():
+                version, logits = forward_versioned(torch.stack(tensors))
+                probs = torch.nn.functional.softmax(logits, dim=1)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        logits16 = logits.numpy().astype('float16')
+        for row, i in enumerate(tensor_indices):
+            probs_by_index[i] = probs[row]
+            logits_by_index[i] = logits16[row]
+            prediction_cache.put(version, digests[i], int(probs[row].argmax()), probs[row].numpy(), logits16[row])
+
+    # 3. 整个 batch 一次 topk，再按请求顺序组装结果
+    ok_indices = sorted(probs_by_index)
+    if ok_indices:
+        values, indices = torch.topk(torch.stack([probs_by_index[i] for i in ok_indices]), k, dim=1)
+    for row, i in enumerate(ok_indices):
+        top = topk_entries(values[row], indices[row])
+        results[i] = {
+            'index': i,
+            'filename': items[i][0],
+            'status': 'success',
+            'prediction': {'class_name': top[0]['class_name'], 'confidence': top[0]['probability']},
+            'topk': top
+        }
+        if include_logits:
+            results[i]['logits_b64'] = encode_logits(logits_by_index[i])
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"🔍 [v{version}] 批量预测 {len(items)} 张 ({len(tensors)} 张前向, {len(items) - len(to_decode)} 张缓存) 耗时 {elapsed_ms:.1f}ms")
+    return jsonify({
+        'results': results,
+        'count': len(items),
+        'elapsed_ms': round(elapsed_ms, 1),
+        'model_version': version,
+        'status': 'success'
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """推理调度指标：队列深度、batch 大小分布"""
+    return jsonify({
+        "batcher": predict_batcher.stats(),
+        "worker_pool": worker_pool.stats() if worker_pool else None,
+        "prediction_cache": prediction_cache.stats(),
+        "batch_jobs": batch_scheduler.stats(),
+        "model_version": ACTIVE.version,
+        "inference_backend": ACTIVE.backend.name
+    })
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    """模型仓库中的全部版本 (含元数据) 与当前线上版本"""
+    return jsonify({"serving_version": ACTIVE.version, "versions": registry.list()})
+
+@app.route('/models/rollback', methods=['POST'])
+def rollback_model():
+    """切换到任意已登记版本 (默认回到当前版本的上一个版本)；新版本先构建预热再发布"""
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    if version is None:
+        meta = registry.get(ACTIVE.version) or {}
+        version = meta.get('parent') or ACTIVE.version - 1
+    try:
+        version = int(version)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid version"}), 400
+    if registry.get(version) is None:
+        return jsonify({"error": f"Unknown version {version}"}), 404
+    if version == ACTIVE.version:
+        return jsonify({"message": "Already serving", "model_version": version})
+    try:
+        publish(build_serving_state(version))
+    except ChecksumMismatch as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"message": "Rolled back", "model_version": ACTIVE.version})
+
 @app.route('/feedback', methods=['POST'])
 def save_feedback():
     if 'file' not in request.files or 'correct_label' not in request.form:
@@ -345,19 +863,46 @@ def save_feedback():
         return jsonify({"error": f"Invalid label: {label}"}), 400
 
     try:
-        label_dir = os.path.join(FEEDBACK_DIR, label)
-        os.makedirs(label_dir, exist_ok=True)
-        file.save(os.path.join(label_dir, f"{uuid.uuid4()}.jpg"))
+        _, duplicate = feedback_index.add(label, file.read())
         
         count = get_feedback_count()
         return jsonify({
             "status": "success", 
+            "duplicate": duplicate,
             "current_count": count,
             "ready_to_train": count >= RETRAIN_THRESHOLD
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/feedback/batch', methods=['POST'])
+def save_feedback_batch():
+    """批量反馈：多个 'file' + 等量且同序的 'correct_label'，可选 'id' 用于对应结果"""
+    files = request.files.getlist('file')
+    labels = request.form.getlist('correct_label')
+    ids = request.form.getlist('id') or [str(i) for i in range(len(files))]
+    if not files or len(files) != len(labels) or len(ids) != len(files):
+        return jsonify({"error": "Mismatched file / correct_label / id counts"}), 400
+
+    results = []
+    for item_id, file, label in zip(ids, files, labels):
+        if label not in CLASS_NAMES:
+            results.append({"id": item_id, "status": "error", "error": f"Invalid label: {label}"})
+            continue
+        try:
+            _, duplicate = feedback_index.add(label, file.read())
+            results.append({"id": item_id, "status": "success", "duplicate": duplicate})
+        except Exception as e:
+            results.append({"id": item_id, "status": "error", "error": str(e)})
+
+    count = get_feedback_count()
+    return jsonify({
+        "status": "success",
+        "results": results,
+        "current_count": count,
+        "ready_to_train": count >= RETRAIN_THRESHOLD
+    })
+
 @app.route('/retrain', methods=['POST'])
 def manual_retrain():
     if IS_TRAINING: return jsonify({"error": "Training in progress"}), 409
@@ -368,10 +913,14 @@ def manual_retrain():
 
 @app.route('/status', methods=['GET'])
 def server_status():
+    feedback_count = get_feedback_count()
     return jsonify({
         "is_training": IS_TRAINING,
-        "feedback_count": get_feedback_count(),
-        "ready_to_train": get_feedback_count() >= RETRAIN_THRESHOLD,
+        "retrain_mode": RETRAIN_MODE,
+        "training_progress": TRAINING_PROGRESS,
+        "feedback_count": feedback_count,
+        "feedback_per_class": feedback_index.counts(),
+        "ready_to_train": feedback_count >= RETRAIN_THRESHOLD,
         "device": str(DEVICE)
     })
 
@@ -379,29 +928,71 @@ def server_status():
 @app.route('/batch/start', methods=['POST'])
 def start_batch_task():
     """Java 上传 Zip 解压后，调用此接口开始预测"""
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
     folder_path = data.get('folder_path')
     task_id = data.get('task_id')
+    if isinstance(task_id, int) and not isinstance(task_id, bool):
+        task_id = str(task_id)  # 调用方可能传数字 id，与 /batch/status/<task_id> 的字符串保持一致
     
     if not folder_path or not task_id:
         return jsonify({"error": "Missing folder_path or task_id"}), 400
+    if not isinstance(folder_path, str) or not isinstance(task_id, str):
+        return jsonify({"error": "folder_path and task_id must be strings"}), 400
     
     if not os.path.exists(folder_path):
         return jsonify({"error": "Folder does not exist"}), 404
 
-    # 初始化状态
-    TASKS_DB[task_id] = {'status': 'pending', 'processed': 0, 'total': 0}
-    
-    # 启动后台线程
-    t = threading.Thread(target=run_batch_inference, args=(task_id, folder_path))
-    t.start()
+    # priority / topk 接受整数或数字字符串；结果附带的 top-k 数量 (0 表示只要 top-1) 与是否附带 logits
+    try:
+        priority = int(data.get('priority', 0))
+        topk = max(0, min(int(data.get('topk', DEFAULT_TOPK)), NUM_CLASSES))
+    except (TypeError, ValueError):
+        return jsonify({"error": "priority and topk must be integers"}), 400
+    include_logits = bool(data.get('logits', False))
+
+    with START_LOCK:
+        if task_id in TASKS_DB:
+            return jsonify({"error": "Task already exists"}), 409
+        # 已结束的任务不在 TASKS_DB 中，但结果与 meta 仍在磁盘上；复用 task_id 会截断旧结果
+        if batch_results.load_meta(RESULTS_DIR, task_id) is not None or \
+                os.path.exists(batch_results.results_path(RESULTS_DIR, task_id)):
+            return jsonify({"error": "Task already exists"}), 409
+        # 初始化状态 (占位) 并入队，由调度器的执行线程按顺序运行
+        TASKS_DB[task_id] = {'status': 'queued', 'processed': 0, 'total': 0}
+
+    try:
+        position = batch_scheduler.submit(
+            task_id, {'folder_path': folder_path, 'topk': topk, 'logits': include_logits},
+            user=str(data.get('user_id') or 'anonymous'), priority=priority
+        )
+    except QueueFullError as e:
+        TASKS_DB.pop(task_id, None)
+        return jsonify({"error": str(e)}), 429, {'Retry-After': '30'}
+    except ValueError as e:
+        # 调度器里已有同名任务 (例如重启后恢复的任务)
+        TASKS_DB.pop(task_id, None)
+        return jsonify({"error": str(e)}), 409
     
-    return jsonify({"status": "started", "task_id": task_id})
+    # 保持原有的 "started" 响应 (Java 后端 / test_pro.py 依赖)，排队位置作为附加字段
+    return jsonify({"status": "started", "task_id": task_id, "queue_position": position})
+
+@app.route('/batch/cancel/<task_id>', methods=['POST'])
+def cancel_batch_task(task_id):
+    """取消排队中或运行中的批量任务"""
+    result = batch_scheduler.cancel(task_id)
+    if result is None:
+        return jsonify({"error": "Task not found or already finished"}), 404
+    if result == 'cancelled':
+        TASKS_DB.setdefault(task_id, {'processed': 0, 'total': 0})['status'] = 'cancelled'
+        finish_task(task_id)
+    return jsonify({"status": result, "task_id": task_id})
 
 @app.route('/batch/status/<task_id>', methods=['GET'])
 def get_batch_status(task_id):
     """前端轮询此接口获取进度条"""
-    task = TASKS_DB.get(task_id)
+    task = load_task(task_id)
     if not task:
         return jsonify({"error": "Task not found"}), 404
         
@@ -412,18 +1003,74 @@ def get_batch_status(task_id):
             "processed": task.get('processed', 0),
             "total": task.get('total', 0),
             "eta_seconds": task.get('eta_seconds', 0),
-            "avg_latency_ms": task.get('avg_latency_ms', 0)
-        }
+            "avg_latency_ms": task.get('avg_latency_ms', 0),
+            "scan_complete": task.get('scan_complete', task['status'] in ('completed', 'failed', 'cancelled')),
+            "config": task.get('config')
+        },
+        "result_count": task.get('result_count', 0),
+        "model_version": task.get('model_version'),
+        "results_url": f"/batch/results/{task_id}"
     }
+    if task.get('error'):
+        response['error'] = task['error']
+    if task['status'] == 'queued':
+        response['queue_position'] = batch_scheduler.position(task_id)
     
-    # 只有当任务完成时，才返回结果数据 (避免轮询时传输数据过大)
-    if task['status'] == 'completed':
-        response['results'] = task.get('results', [])
+    # 只有当任务完成且结果不多时，才直接附带结果；大任务请用 /batch/results 分页或下载
+    if task['status'] == 'completed' and task.get('result_count', 0) <= INLINE_RESULTS_LIMIT:
+        response['results'] = read_task_results(task_id, task, 0, INLINE_RESULTS_LIMIT)
         
     return jsonify(response)
 
+def read_task_results(task_id, task, offset, limit):
+    path = batch_results.results_path(RESULTS_DIR, task_id)
+    if not os.path.exists(path):
+        return []
+    return batch_results.read_range(
+        path, task.get('offsets', [0]), task.get('index_every', batch_results.INDEX_EVERY),
+        offset, limit, task.get('result_count', 0)
+    )
+
+@app.route('/batch/results/<task_id>', methods=['GET'])
+def get_batch_results(task_id):
+    """分页读取结果：?offset=0&limit=1000，任务运行中也可读取已完成的部分"""
+    task = load_task(task_id)
+    if not task:
+        return jsonify({"error": "Task not found"}), 404
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+    total = task.get('result_count', 0)
+    rows = read_task_results(task_id, task, offset, limit)
+    next_offset = offset + len(rows)
+    return jsonify({
+        "status": task['status'],
+        "offset": offset,
+        "limit": limit,
+        "total": total,
+        "next_offset": next_offset if next_offset < total or task['status'] == 'processing' else None,
+        "results": rows
+    })
+
+@app.route('/batch/results/<task_id>/download', methods=['GET'])
+def download_batch_results(task_id):
+    """
+    下载全部结果。默认 JSONL 原文件 (支持 HTTP Range 断点续传)，
+    ?format=json 时以 chunked 方式流式输出 JSON 数组。
+    """
+    task = load_task(task_id)
+    path = batch_results.results_path(RESULTS_DIR, task_id)
+    if not task or not os.path.exists(path):
+        return jsonify({"error": "Task not found"}), 404
+    if request.args.get('format') == 'json':
+        return Response(stream_with_context(batch_results.iter_json_array(path)), mimetype='application/json')
+    return send_file(path, mimetype='application/x-ndjson', as_attachment=True,
+                     download_name=f"{task_id}.jsonl", conditional=True)
+
 if __name__ == '__main__':
     os.makedirs(FEEDBACK_DIR, exist_ok=True)
     os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    # 执行线程在所有辅助函数 (finish_task / load_task ...) 定义之后才启动，恢复的任务立即失败也不会 NameError
+    batch_scheduler.start()
     print(f"🚀 AI Server (Merged) 运行于端口 {PORT}...")
     app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
@@ -0,0 +1,138 @@
+# micro_batcher.py
+# 动态微批处理调度器：把并发 /predict 请求的张量合并成一个 batch 做一次前向
+import threading
+import queue
+import time
+
+
+def stack_tensors(tensors):
+    """默认的合并函数：把单张图片的张量堆叠成 batch"""
+    import torch
+    return torch.stack(tensors)
+
+
+class _PendingItem:
+    """一个等待推理的请求，worker 算完后通过 event 唤醒请求线程"""
+    __slots__ = ('tensor', 'event', 'output', 'error')
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.event = threading.Event()
+        self.output = None
+        self.error = None
+
+
+class Histogram:
+    """简单的分桶计数直方图 (桶为上界，最后一个桶收集所有更大的值)"""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += 1
+        self.sum += value
+
+    def snapshot(self):
+        labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'count': self.total,
+            'mean': round(self.sum / self.total, 2) if self.total else 0
+        }
+
+
+class MicroBatcher:
+    """
+    请求合并调度器。
+    请求线程调用 submit(tensor) 后阻塞，后台线程把排队中的张量拼成 batch，
+    当 batch 达到 max_batch_size 或最早的请求等待超过 max_wait_ms 时切出 batch，
+    调用 forward_fn(batch) 得到输出后按行分发回各请求。
+    collate_fn 把一组请求的张量合并成 batch，默认 torch.stack。
+    """
+
+    def __init__(self, forward_fn, max_batch_size=16, max_wait_ms=10, name='batcher', num_threads=1,
+                 collate_fn=stack_tensors):
+        self.forward_fn = forward_fn
+        self.collate_fn = collate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batch_size_hist = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.queue_depth_hist = Histogram([0, 1, 2, 4, 8, 16, 32, 64])
+        self.batches_run = 0
+        self.items_run = 0
+        # 多个调度线程可以同时各自凑 batch (例如后端是多进程 worker 池时)
+        self._threads = []
+        for i in range(num_threads):
+            t = threading.Thread(target=self._loop, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, tensor, timeout=None):
+        """提交单张图片的张量 (不含 batch 维)，返回该图片对应的一行输出"""
+        item = _PendingItem(tensor)
+        self._queue.put(item)
+        if not item.event.wait(timeout):
+            raise TimeoutError("推理排队超时")
+        if item.error is not None:
+            raise item.error
+        return item.output
+
+    def _collect(self):
+        """阻塞等待第一条请求，然后在截止时间内尽量凑满一个 batch"""
+        first = self._queue.get()
+        items = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            with self._stats_lock:
+                self.queue_depth_hist.observe(self._queue.qsize())
+                self.batch_size_hist.observe(len(items))
+                self.batches_run += 1
+                self.items_run += len(items)
+            try:
+                batch = self.collate_fn([it.tensor for it in items])
+                outputs = self.forward_fn(batch)
+                for i, it in enumerate(items):
+                    it.output = outputs[i]
+            except Exception as e:
+                for it in items:
+                    it.error = e
+            finally:
+                for it in items:
+                    it.event.set()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': int(self.max_wait * 1000),
+                'threads': len(self._threads),
+                'queue_depth_now': self._queue.qsize(),
+                'batches_run': self.batches_run,
+                'items_run': self.items_run,
+                'batch_size_hist': self.batch_size_hist.snapshot(),
+                'queue_depth_hist': self.queue_depth_hist.snapshot()
+            }
@@ -0,0 +1,117 @@
+# model_registry.py
+# 本地模型仓库：每次训练产出一个不可变的版本目录，当前线上版本由 CURRENT 指针文件决定
+#   <root>/versions/v0001/model.pth   权重
+#   <root>/versions/v0001/meta.json   {version, sha256, size, created_at, parent, source, data, metrics}
+#   <root>/CURRENT                    当前版本号，tmp + os.replace 原子替换
+# 版本目录先在 tmp 目录写好再整体 rename，半写入的版本不会出现在列表里；
+# 回滚只是把 CURRENT 指回旧版本，不复制、不覆盖任何权重文件。
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+VERSION_DIR_FORMAT = 'v{:04d}'
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ChecksumMismatch(Exception):
+    """权重文件与登记时的 sha256 不一致 (文件被篡改或损坏)"""
+
+
+class ModelRegistry:
+    def __init__(self, root):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.current_path = os.path.join(root, 'CURRENT')
+        self._lock = threading.Lock()
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    # --- 查询 ---
+    def _version_dir(self, version):
+        return os.path.join(self.versions_dir, VERSION_DIR_FORMAT.format(version))
+
+    def versions(self):
+        """已登记的版本号 (升序)"""
+        found = []
+        for name in os.listdir(self.versions_dir):
+            if name.startswith('v') and name[1:].isdigit() and os.path.exists(os.path.join(self.versions_dir, name, 'meta.json')):
+                found.append(int(name[1:]))
+        return sorted(found)
+
+    def get(self, version):
+        """版本元数据；不存在时返回 None"""
+        meta_path = os.path.join(self._version_dir(version), 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list(self):
+        current = self.current()
+        return [dict(self.get(v), current=(v == current)) for v in self.versions()]
+
+    def current(self):
+        """CURRENT 指向的版本号；仓库为空时返回 None"""
+        try:
+            with open(self.current_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def checkpoint_path(self, version):
+        return os.path.join(self._version_dir(version), 'model.pth')
+
+    # --- 写入 ---
+    def register(self, checkpoint_path, source, parent=None, data=None, metrics=None):
+        """复制一份权重登记为新版本 (不移动 CURRENT)，返回版本号"""
+        with self._lock:
+            existing = self.versions()
+            version = existing[-1] + 1 if existing else 1
+            tmp_dir = os.path.join(self.root, f".tmp_{VERSION_DIR_FORMAT.format(version)}_{os.getpid()}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            target = os.path.join(tmp_dir, 'model.pth')
+            shutil.copyfile(checkpoint_path, target)
+            meta = {
+                'version': version,
+                'sha256': file_sha256(target),
+                'size': os.path.getsize(target),
+                'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'parent': parent,
+                'source': source,
+                'data': data or {},
+                'metrics': metrics or {}
+            }
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            os.rename(tmp_dir, self._version_dir(version))
+            return version
+
+    def set_current(self, version):
+        """原子地把 CURRENT 指向 version"""
+        if self.get(version) is None:
+            raise KeyError(f"unknown model version {version}")
+        tmp = self.current_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(str(version))
+        os.replace(tmp, self.current_path)
+
+    def load_state_dict(self, version, map_location='cpu'):
+        """读取并校验某个版本的权重"""
+        meta = self.get(version)
+        if meta is None:
+            raise KeyError(f"unknown model version {version}")
+        path = self.checkpoint_path(version)
+        if file_sha256(path) != meta['sha256']:
+            raise ChecksumMismatch(f"v{version} 权重校验失败: {path}")
+        import torch  # 只有读取权重时才需要 torch，仓库的登记 / 切换逻辑不依赖它
+        return torch.load(path, map_location=map_location)
@@ -0,0 +1,92 @@
+# prediction_cache.py
+# 基于图片内容哈希的预测缓存 (LRU + TTL)，键中带模型版本，换权重后旧条目自动失效
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# 每条缓存除 numpy 数组外的大致开销 (键、元组、OrderedDict 节点)
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+def content_hash(raw_bytes):
+    """对原始图片字节求哈希，作为缓存键"""
+    return hashlib.sha256(raw_bytes).hexdigest()
+
+
+class PredictionCache:
+    """
+    键为 (模型版本, 图片哈希)，值为 (类别下标, softmax 向量, 可选 float16 logits)。
+    超过内存预算按 LRU 淘汰，超过 ttl_seconds 的条目视为过期。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, version, digest):
+        key = (version, digest)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry['expires_at'] < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, version, digest, class_idx, probs, logits=None):
+        """probs 为 numpy float32 一维数组，logits 为 numpy float16 一维数组 (可选)"""
+        key = (version, digest)
+        nbytes = probs.nbytes + (logits.nbytes if logits is not None else 0) + _ENTRY_OVERHEAD_BYTES
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = {
+                'class_idx': class_idx,
+                'probs': probs,
+                'logits': logits,
+                'expires_at': time.monotonic() + self.ttl,
+                'nbytes': nbytes
+            }
+            self.bytes_used += nbytes
+            while self.bytes_used > self.max_bytes:
+                old_key = next(iter(self._data))
+                self._remove(old_key)
+                self.evictions += 1
+
+    def drop_stale_versions(self, current_version):
+        """模型热更新后调用：释放旧版本条目占用的内存"""
+        with self._lock:
+            for key in [k for k in self._data if k[0] != current_version]:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self.bytes_used -= entry['nbytes']
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes_used': self.bytes_used,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions
+            }
@@ -8,14 +8,14 @@ import torchvision.transforms as T
 from torchvision import datasets
 from torch.utils.data import DataLoader, ConcatDataset, Dataset
 from torchvision.models import resnet50
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from PIL import Image
 import time
 import sys
-import base64
 import numpy as np
 import cv2
 import traceback
+from cam_service import forward_with_features, quantize_cam, CamWorker, ExplanationStore
 
 # 尝试导入 GPU 监控库
 try:
@@ -38,6 +38,21 @@ RETRAIN_THRESHOLD = 1000
 PORT = 5001  
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# 解释 (Grad-CAM) 由后台线程批量计算，按 prediction_id 查询
+CAM_MAX_BATCH = int(os.environ.get('CAM_MAX_BATCH', 16))
+CAM_MAX_WAIT_MS = int(os.environ.get('CAM_MAX_WAIT_MS', 20))
+CAM_STORE_MAX = int(os.environ.get('CAM_STORE_MAX', 1000))  # 内存中最多保留的解释结果数
+# cam: fc 权重直接加权 (无反向，默认)；gradcam: 对 avgpool+fc 尾部求导
+CAM_METHOD = os.environ.get('CAM_METHOD', 'cam')
+# 热力图按需渲染：只保存 uint8 CAM 网格 + 一张小尺寸底图，请求图片时再上色叠加
+HEATMAP_BASE_SIZE = 112                  # 保存的底图边长 (112×112×3 ≈ 37KB)
+HEATMAP_DEFAULT_SIZE = 224
+HEATMAP_MIN_SIZE, HEATMAP_MAX_SIZE = 32, 512
+HEATMAP_FORMATS = {'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY),
+                   'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY)}
+HEATMAP_QUALITY = 80
+HEATMAP_WAIT_SECONDS = 2  # 图片请求到达时解释还在计算，最多等待这么久，超时返回占位图 (不缓存)
+
 TASKS_DB = {}  
 raw_classes = [
     'Apple_Black_Rot', 'Apple_Cedar_Apple_Rust', 'Apple_healthy', 'Apple_Scab', 
@@ -102,51 +117,37 @@ train_transform = T.Compose([
     T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
-# ================= Grad-CAM 修复版辅助函数 =================
-def generate_gradcam(model, input_tensor, predicted_class):
-    """生成 Grad-CAM 热力图 (修复了 Hook 警告和 CPU/GPU 设备问题)"""
-    target_layer = model.layer4[2]
-    gradients = []
-    activations = []
-
-    def backward_hook(module, grad_input, grad_output):
-        gradients.append(grad_output[0].detach())
-
-    def forward_hook(module, input, output):
-        activations.append(output.detach())
-
-    # 兼容新版 PyTorch 的 Hook 注册
-    if hasattr(target_layer, 'register_full_backward_hook'):
-        h_b = target_layer.register_full_backward_hook(backward_hook)
-    else:
-        h_b = target_layer.register_backward_hook(backward_hook)
-    h_f = target_layer.register_forward_hook(forward_hook)
-
-    # 计算梯度
-    input_tensor.requires_grad = True
-    model.zero_grad()
-    output = model(input_tensor)
-    score = output[0, predicted_class]
-    score.backward()
-
-    h_b.remove()
-    h_f.remove()
-
-    # 提取特征和梯度并转到 CPU
-    grads = gradients[0][0].cpu().data.numpy()
-    f_maps = activations[0][0].cpu().data.numpy()
-
-    # 计算权重和热力图
-    weights = np.mean(grads, axis=(1, 2))
-    cam = np.zeros(f_maps.shape[1:], dtype=np.float32)
-    for i, w in enumerate(weights):
-        cam += w * f_maps[i]
-
-    cam = np.maximum(cam, 0) # ReLU
-    if np.max(cam) != 0:
-        cam = cam / np.max(cam)
-    
-    return cv2.resize(cam, (224, 224))
+# ================= Grad-CAM (后台批量) =================
+def compact_explanation(cam, original_image):
+    """后台线程：CAM 量化为 uint8 网格，原图缩成小底图，供按需渲染"""
+    base = cv2.resize(original_image, (HEATMAP_BASE_SIZE, HEATMAP_BASE_SIZE), interpolation=cv2.INTER_AREA)
+    return {'grid': quantize_cam(cam), 'base': base}
+
+def render_heatmap(explanation, size, fmt, overlay=True):
+    """uint8 网格 → 放大、上色 (JET)、可选叠加底图 → 编码为 webp / jpeg 字节"""
+    cam = cv2.resize(explanation['grid'], (size, size), interpolation=cv2.INTER_LINEAR)
+    cam_color = cv2.applyColorMap(cam, cv2.COLORMAP_JET)  # BGR
+    if overlay:
+        base_bgr = cv2.cvtColor(cv2.resize(explanation['base'], (size, size)), cv2.COLOR_RGB2BGR)
+        cam_color = cv2.addWeighted(cam_color, 0.4, base_bgr, 0.6, 0)
+    ext, _, quality_flag = HEATMAP_FORMATS[fmt]
+    ok, buffer = cv2.imencode(ext, cam_color, [quality_flag, HEATMAP_QUALITY])
+    if not ok:
+        raise RuntimeError(f"encode {fmt} failed")
+    return buffer.tobytes()
+
+def render_placeholder(size, fmt):
+    """解释尚未算完时的灰色占位图：<img> 里不会显示成破图，前端稍后重新请求即可"""
+    ext, _, quality_flag = HEATMAP_FORMATS[fmt]
+    ok, buffer = cv2.imencode(ext, np.full((size, size, 3), 200, dtype=np.uint8), [quality_flag, HEATMAP_QUALITY])
+    if not ok:
+        raise RuntimeError(f"encode {fmt} failed")
+    return buffer.tobytes()
+
+cam_worker = CamWorker(
+    model, compact_explanation, ExplanationStore(CAM_STORE_MAX),
+    max_batch=CAM_MAX_BATCH, max_wait_ms=CAM_MAX_WAIT_MS, method=CAM_METHOD
+)
 
 # ================= 辅助工具：GPU 监控 =================
 def get_gpu_usage():
@@ -220,50 +221,40 @@ def predict():
         image = Image.open(io.BytesIO(raw_data)).convert('RGB')
         original_image = np.array(image.resize((224, 224)))
         
-        # 1. 正常推理 (不计算梯度，保证速度)
+        # 1. 正常推理 (不计算梯度，保证速度)，同时留下 layer4 特征图供解释复用
         img_tensor = inference_transform(image).unsqueeze(0).to(DEVICE)
         with torch.no_grad():
-            outputs = model(img_tensor)
+            feats, outputs = forward_with_features(model, img_tensor)
             probs = torch.nn.functional.softmax(outputs, dim=1)
             confidence, predicted_idx = torch.max(probs, 1)
         
         conf_score = confidence.item()
         result_class = CLASS_NAMES[predicted_idx.item()]
         
-        # 低置信度拦截
+        # 2. 每个预测都提供热力图：复用本次前向的特征图交给后台线程，前端通过 /explain/<prediction_id> 获取
+        prediction_id = uuid.uuid4().hex
+        queued = cam_worker.submit(prediction_id, feats[0].cpu(), predicted_idx.item(), original_image)
+        if not queued:
+            print("Heatmap skipped: CAM queue full")
+        
+        # 低置信度拦截 (热力图仍然提供，便于用户看出模型关注了哪里)
         if conf_score < 0.6:
             return jsonify({
                 'prediction': {'class_name': "无法确定", 'confidence': float(f"{conf_score:.4f}")},
+                'prediction_id': prediction_id,
                 'status': 'success',
                 'explanation': {
-                    'heatmap_image': 'fault', 
+                    'heatmap_url': f"/explain/{prediction_id}/heatmap" if queued else None,
                     'message': '置信度较低，建议重新拍摄清晰照片。'
                 }
             })
-        
-        # 2. 高置信度：生成热力图 (单独触发一次带梯度的前向传播)
-        heatmap_base64 = None
-        try:
-            # 开启梯度算热力图
-            cam = generate_gradcam(model, img_tensor, predicted_idx.item())
-            cam_color = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
-            
-            # 颜色空间整理 OpenCV (BGR) -> Display (RGB)
-            cam_rgb = cv2.cvtColor(cam_color, cv2.COLOR_BGR2RGB)
-            superimposed = cv2.addWeighted(cam_rgb, 0.4, original_image, 0.6, 0)
-            
-            # 转回 BGR 供 cv2.imencode 正常工作
-            final_bgr = cv2.cvtColor(superimposed, cv2.COLOR_RGB2BGR)
-            _, buffer = cv2.imencode('.jpg', final_bgr)
-            heatmap_base64 = base64.b64encode(buffer).decode('utf-8')
-        except Exception as cam_ex:
-            print(f"Heatmap failed: {cam_ex}")
 
         return jsonify({
             'prediction': {'class_name': result_class, 'confidence': float(f"{conf_score:.4f}")},
+            'prediction_id': prediction_id,
             'status': 'success',
             'explanation': {
-                'heatmap_image': f"data:image/jpeg;base64,{heatmap_base64}" if heatmap_base64 else 'fault',
+                'heatmap_url': f"/explain/{prediction_id}/heatmap" if queued else None,
                 'message': f'检测到：{result_class}。',
                 'suggested_actions': ['检查高亮区域', '对比典型病症']
             }
@@ -272,6 +263,63 @@ def predict():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/explain/<prediction_id>', methods=['GET'])
+def get_explanation(prediction_id):
+    """查询热力图：完成返回 200，计算中返回 202，未知/已淘汰返回 404"""
+    status = cam_worker.status(prediction_id)
+    if status is None:
+        return jsonify({'status': 'not_found'}), 404
+    if status == 'pending':
+        return jsonify({'status': 'pending'}), 202
+    result = cam_worker.store.get(prediction_id)
+    if 'error' in result:
+        return jsonify({'status': 'failed', 'error': result['error']}), 500
+    return jsonify({
+        'status': 'done',
+        'grid': result['grid'].tolist(),  # uint8 h×w，前端可自行上色
+        'heatmap_url': f"/explain/{prediction_id}/heatmap"
+    })
+
+@app.route('/explain/<prediction_id>/heatmap', methods=['GET'])
+def get_heatmap_image(prediction_id):
+    """
+    按需渲染热力图图片。参数: ?size=224 (32~512) &format=webp|jpeg &overlay=1|0 (是否叠加原图)
+    同一 prediction_id 的图片内容不会变化，因此带 ETag 和长期缓存头。
+    用作 <img> src：计算中最多等待 HEATMAP_WAIT_SECONDS，仍未完成时返回不缓存的占位图而不是 JSON。
+    """
+    size = max(HEATMAP_MIN_SIZE, min(request.args.get('size', HEATMAP_DEFAULT_SIZE, type=int), HEATMAP_MAX_SIZE))
+    fmt = request.args.get('format', 'webp').lower()
+    if fmt not in HEATMAP_FORMATS:
+        return jsonify({'error': f"Unsupported format, choose from {list(HEATMAP_FORMATS)}"}), 400
+    overlay = request.args.get('overlay', '1') != '0'
+
+    etag = f'"{prediction_id}-{size}-{fmt}-{int(overlay)}"'
+    cache_headers = {'ETag': etag, 'Cache-Control': 'public, max-age=86400, immutable'}
+    # 只有解释仍在 store 中时才能 304；未知或已淘汰的 id 照常返回 404
+    status = cam_worker.status(prediction_id)
+    if status is None:
+        return jsonify({'status': 'not_found'}), 404
+    if status == 'done' and etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=cache_headers)
+
+    if status == 'pending':
+        status = cam_worker.wait(prediction_id, HEATMAP_WAIT_SECONDS)
+    if status is None:
+        return jsonify({'status': 'not_found'}), 404
+    if status == 'pending':
+        return Response(render_placeholder(size, fmt), mimetype=HEATMAP_FORMATS[fmt][1],
+                        headers={'Cache-Control': 'no-store', 'Retry-After': '1'})
+    result = cam_worker.store.get(prediction_id)
+    if 'error' in result:
+        return jsonify({'status': 'failed', 'error': result['error']}), 500
+
+    body = render_heatmap(result, size, fmt, overlay)
+    return Response(body, mimetype=HEATMAP_FORMATS[fmt][1], headers=cache_headers)
+
+@app.route('/explain/stats', methods=['GET'])
+def explanation_stats():
+    return jsonify(cam_worker.stats())
+
 @app.route('/feedback', methods=['POST'])
 def save_feedback():
     if 'file' not in request.files or 'correct_label' not in request.form:
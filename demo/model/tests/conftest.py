@@ -0,0 +1,5 @@
+# demo/model 下的模块按脚本方式互相导入 (from batch_results import ...)，测试时把该目录加入 sys.path
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
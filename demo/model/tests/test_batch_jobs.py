@@ -0,0 +1,83 @@
+# batch_jobs 的行为测试：优先级排队、准入控制、取消、任务表持久化与重启后重新排队
+import threading
+import pytest
+from batch_jobs import BatchJobScheduler, JobStore, QueueFullError
+
+
+def make_scheduler(tmp_path, run_fn=None, **kwargs):
+    store_path = str(tmp_path / 'jobs' / 'jobs.json')
+    return BatchJobScheduler(run_fn or (lambda task_id, job: None), store_path, **kwargs), store_path
+
+
+def test_queue_position_follows_priority_then_fifo(tmp_path):
+    scheduler, _ = make_scheduler(tmp_path)
+    assert scheduler.submit('a', {}) == 0
+    assert scheduler.submit('b', {}) == 1
+    assert scheduler.submit('c', {}, priority=5) == 0
+    assert scheduler.position('a') == 1
+    assert scheduler.position('b') == 2
+
+
+def test_duplicate_and_full_queue_are_rejected(tmp_path):
+    scheduler, _ = make_scheduler(tmp_path, max_queue=1)
+    scheduler.submit('a', {})
+    with pytest.raises(ValueError):
+        scheduler.submit('a', {})
+    with pytest.raises(QueueFullError):
+        scheduler.submit('b', {})
+    assert scheduler.stats()['rejected'] == 1
+
+
+def test_cancel_queued_job_removes_it_from_store(tmp_path):
+    scheduler, store_path = make_scheduler(tmp_path)
+    scheduler.submit('a', {'folder': '/x'})
+    assert set(JobStore(store_path).load()) == {'a'}
+    assert scheduler.cancel('a') == 'cancelled'
+    assert scheduler.cancel('a') is None
+    assert JobStore(store_path).load() == {}
+
+
+def test_unfinished_jobs_are_requeued_after_restart(tmp_path):
+    first, store_path = make_scheduler(tmp_path)
+    first.submit('a', {'folder': '/x'}, user='alice')
+    first.submit('b', {'folder': '/y'}, user='bob', priority=1)
+    persisted = JobStore(store_path).load()
+    assert persisted['a']['folder'] == '/x' and persisted['a']['status'] == 'queued'
+
+    ran, requeued = [], []
+    done = threading.Event()
+
+    def run(task_id, job):
+        ran.append((task_id, job['folder']))
+        if len(ran) == 2:
+            done.set()
+
+    second, _ = make_scheduler(tmp_path, run_fn=run, on_requeue=lambda task_id, job: requeued.append(task_id))
+    second.start()
+    assert done.wait(5)
+    assert sorted(requeued) == ['a', 'b']
+    assert sorted(ran) == [('a', '/x'), ('b', '/y')]
+
+
+def test_running_job_sees_cancel_flag(tmp_path):
+    started, finished = threading.Event(), threading.Event()
+    outcome = []
+
+    def run(task_id, job):
+        started.set()
+        while True:
+            try:
+                scheduler.check_cancelled(task_id)
+            except Exception as e:
+                outcome.append(type(e).__name__)
+                finished.set()
+                raise
+            started.wait(0.01)
+
+    scheduler, store_path = make_scheduler(tmp_path, run_fn=run)
+    scheduler.start()
+    scheduler.submit('a', {})
+    assert started.wait(5)
+    assert scheduler.cancel('a') == 'cancelling'
+    assert finished.wait(5)
+    assert outcome == ['JobCancelled']
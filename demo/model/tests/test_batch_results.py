@@ -0,0 +1,54 @@
+# batch_results 的行为测试：按偏移索引分页读取、文件名映射、元数据
+import json
+import os
+import batch_results
+from batch_results import BatchResultWriter, read_range
+
+
+def write_rows(tmp_path, n, index_every=3):
+    writer = BatchResultWriter(str(tmp_path / 'out' / 'task.jsonl'), index_every=index_every)
+    writer.write_many([{'i': i} for i in range(n)])
+    writer.close()
+    return writer
+
+
+def test_read_range_across_index_blocks(tmp_path):
+    writer = write_rows(tmp_path, 10)
+    assert writer.count == 10
+    assert len(writer.offsets) == 4  # 第 0、3、6、9 行
+    rows = read_range(writer.path, writer.offsets, writer.index_every, 4, 4, writer.count)
+    assert [r['i'] for r in rows] == [4, 5, 6, 7]
+
+
+def test_read_range_stops_at_available_rows(tmp_path):
+    writer = write_rows(tmp_path, 10)
+    rows = read_range(writer.path, writer.offsets, writer.index_every, 7, 50, 8)
+    assert [r['i'] for r in rows] == [7]
+    assert read_range(writer.path, writer.offsets, writer.index_every, 8, 5, 8) == []
+
+
+def test_read_range_every_start_matches_full_scan(tmp_path):
+    writer = write_rows(tmp_path, 10)
+    for start in range(10):
+        rows = read_range(writer.path, writer.offsets, writer.index_every, start, 2, writer.count)
+        assert [r['i'] for r in rows] == list(range(start, min(start + 2, 10)))
+
+
+def test_iter_json_array_is_valid_json(tmp_path):
+    writer = write_rows(tmp_path, 5)
+    text = ''.join(batch_results.iter_json_array(writer.path, chunk_lines=2))
+    assert [r['i'] for r in json.loads(text)] == list(range(5))
+
+
+def test_file_stem_keeps_plain_ids_and_hashes_unsafe_ones(tmp_path):
+    assert batch_results.file_stem('task_1') == 'task_1'
+    unsafe = batch_results.file_stem('../etc/passwd')
+    assert unsafe.startswith('task-') and os.sep not in unsafe
+    assert batch_results.file_stem('../etc/passwd') == unsafe
+    assert os.path.dirname(batch_results.results_path(str(tmp_path), '../x')) == str(tmp_path)
+
+
+def test_meta_round_trip(tmp_path):
+    assert batch_results.load_meta(str(tmp_path), 't1') is None
+    batch_results.save_meta(str(tmp_path), 't1', {'status': 'completed', 'total': 3})
+    assert batch_results.load_meta(str(tmp_path), 't1') == {'status': 'completed', 'total': 3}
@@ -0,0 +1,65 @@
+# feedback_index 的行为测试：计数 (含重复提交)、可选去重、与目录对账、归档
+import os
+from feedback_index import FeedbackIndex
+
+
+def make_index(tmp_path, **kwargs):
+    return FeedbackIndex(str(tmp_path / 'index.db'), str(tmp_path / 'feedback'), **kwargs)
+
+
+def test_every_submission_is_saved_and_counted_by_default(tmp_path):
+    index = make_index(tmp_path)
+    first, dup1 = index.add('aphid', b'same-bytes')
+    second, dup2 = index.add('aphid', b'same-bytes')
+    index.add('mite', b'other')
+    assert (dup1, dup2) == (False, True)
+    assert first != second
+    assert os.path.exists(os.path.join(index.feedback_dir, second))
+    assert index.count() == 3
+    assert index.counts() == {'aphid': 2, 'mite': 1}
+
+
+def test_dedup_mode_keeps_one_copy_per_label(tmp_path):
+    index = make_index(tmp_path, dedup=True)
+    first, _ = index.add('aphid', b'same-bytes')
+    again, duplicate = index.add('aphid', b'same-bytes')
+    _, other_label_dup = index.add('mite', b'same-bytes')
+    assert duplicate and again == first
+    assert not other_label_dup
+    assert index.counts() == {'aphid': 1, 'mite': 1}
+
+
+def test_counts_survive_reopen(tmp_path):
+    index = make_index(tmp_path)
+    index.add('aphid', b'a')
+    index.add('aphid', b'b')
+    reopened = make_index(tmp_path)
+    assert reopened.count() == 2
+    assert reopened.counts() == {'aphid': 2}
+
+
+def test_reconcile_registers_new_files_and_drops_missing_ones(tmp_path):
+    index = make_index(tmp_path)
+    kept, _ = index.add('aphid', b'a')
+    gone, _ = index.add('aphid', b'b')
+    os.remove(os.path.join(index.feedback_dir, gone))
+    os.makedirs(os.path.join(index.feedback_dir, 'mite'))
+    with open(os.path.join(index.feedback_dir, 'mite', 'manual.png'), 'wb') as f:
+        f.write(b'c')
+    with open(os.path.join(index.feedback_dir, 'notes.txt'), 'w') as f:
+        f.write('ignored')
+
+    assert index.reconcile() == {'added': 1, 'removed': 1}
+    assert index.counts() == {'aphid': 1, 'mite': 1}
+    assert index.count() == 2
+
+
+def test_archive_moves_directory_and_resets_counts(tmp_path):
+    index = make_index(tmp_path)
+    index.add('aphid', b'a')
+    index.add('mite', b'b')
+    dest = str(tmp_path / 'archive')
+    assert index.archive(dest) == 2
+    assert sorted(os.listdir(dest)) == ['aphid', 'mite']
+    assert index.count() == 0 and index.counts() == {}
+    assert os.listdir(index.feedback_dir) == []
@@ -0,0 +1,68 @@
+# micro_batcher 的行为测试：用 list 代替张量，不依赖 torch
+import threading
+import time
+import pytest
+from micro_batcher import Histogram, MicroBatcher
+
+
+def doubled(batch):
+    return [x * 2 for x in batch]
+
+
+def test_submit_returns_own_row():
+    batcher = MicroBatcher(doubled, max_batch_size=4, max_wait_ms=5, collate_fn=list)
+    assert batcher.submit(21, timeout=5) == 42
+
+
+def test_concurrent_requests_are_merged_up_to_max_batch_size():
+    sizes = []
+    release = threading.Event()
+
+    def forward(batch):
+        sizes.append(len(batch))
+        release.wait(5)  # 第一个 batch 卡住，让其余请求在队列中堆积
+        return doubled(batch)
+
+    batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=50, collate_fn=list)
+    results = {}
+
+    def client(i):
+        results[i] = batcher.submit(i, timeout=10)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(9)]
+    for t in threads:
+        t.start()
+    # 等第一个 batch 进入前向、其余请求全部排队后再放行
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and not (sizes and batcher.stats()['queue_depth_now'] == 9 - sizes[0]):
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(10)
+
+    assert results == {i: i * 2 for i in range(9)}
+    assert sum(sizes) == 9
+    assert max(sizes) <= 4
+    queued = 9 - sizes[0]
+    assert len(sizes) == 1 + -(-queued // 4)  # 排队的请求按 max_batch_size 合并
+    stats = batcher.stats()
+    assert stats['items_run'] == 9 and stats['batches_run'] == len(sizes)
+
+
+def test_forward_error_is_raised_in_every_caller():
+    def failing(batch):
+        raise RuntimeError('boom')
+
+    batcher = MicroBatcher(failing, max_batch_size=2, max_wait_ms=5, collate_fn=list)
+    with pytest.raises(RuntimeError, match='boom'):
+        batcher.submit(1, timeout=5)
+
+
+def test_histogram_buckets_and_overflow():
+    hist = Histogram([1, 4])
+    for v in (0, 1, 3, 9):
+        hist.observe(v)
+    snap = hist.snapshot()
+    assert snap['buckets'] == {'<=1': 2, '<=4': 1, '>4': 1}
+    assert snap['count'] == 4
+    assert snap['mean'] == 3.25
@@ -0,0 +1,63 @@
+# model_registry 的行为测试：版本登记、原子发布 (CURRENT 指针)、回滚、校验
+import os
+import pytest
+from model_registry import ChecksumMismatch, ModelRegistry
+
+
+def write_checkpoint(tmp_path, name, payload):
+    path = tmp_path / name
+    path.write_bytes(payload)
+    return str(path)
+
+
+def test_register_creates_immutable_versions_without_moving_current(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    assert registry.versions() == [] and registry.current() is None
+    v1 = registry.register(write_checkpoint(tmp_path, 'a.pth', b'weights-1'), source='initial')
+    v2 = registry.register(write_checkpoint(tmp_path, 'b.pth', b'weights-2'), source='retrain', parent=v1)
+    assert (v1, v2) == (1, 2)
+    assert registry.versions() == [1, 2]
+    assert registry.current() is None
+    assert registry.get(2)['parent'] == 1
+    with open(registry.checkpoint_path(1), 'rb') as f:
+        assert f.read() == b'weights-1'
+
+
+def test_publish_and_rollback_only_move_the_pointer(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    registry.register(write_checkpoint(tmp_path, 'a.pth', b'weights-1'), source='initial')
+    registry.register(write_checkpoint(tmp_path, 'b.pth', b'weights-2'), source='retrain')
+    registry.set_current(2)
+    assert registry.current() == 2
+    registry.set_current(1)
+    assert registry.current() == 1
+    assert [m['current'] for m in registry.list()] == [True, False]
+    assert not os.path.exists(registry.current_path + '.tmp')
+    with open(registry.checkpoint_path(2), 'rb') as f:
+        assert f.read() == b'weights-2'
+
+
+def test_unknown_version_cannot_be_published(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    with pytest.raises(KeyError):
+        registry.set_current(7)
+    assert registry.current() is None
+
+
+def test_half_written_version_dirs_are_ignored(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    registry.register(write_checkpoint(tmp_path, 'a.pth', b'weights-1'), source='initial')
+    os.makedirs(os.path.join(registry.versions_dir, 'v0002'))  # 没有 meta.json
+    assert registry.versions() == [1]
+    leftover = os.path.join(registry.root, '.tmp_v0003_123')  # 中断的登记留下的临时目录
+    os.makedirs(leftover)
+    assert registry.versions() == [1]
+
+
+def test_tampered_weights_fail_checksum(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    v1 = registry.register(write_checkpoint(tmp_path, 'a.pth', b'weights-1'), source='initial')
+    with open(registry.checkpoint_path(v1), 'ab') as f:
+        f.write(b'tampered')
+    with pytest.raises(ChecksumMismatch):
+        registry.load_state_dict(v1)
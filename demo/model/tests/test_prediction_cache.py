@@ -0,0 +1,72 @@
+# prediction_cache 的行为测试：LRU 淘汰、TTL 过期、按模型版本隔离
+import prediction_cache
+from prediction_cache import PredictionCache, content_hash, _ENTRY_OVERHEAD_BYTES
+
+
+class FakeArray:
+    """只提供 nbytes，代替 numpy 数组"""
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def entry_bytes(n):
+    return n + _ENTRY_OVERHEAD_BYTES
+
+
+def test_hit_and_miss_are_counted():
+    cache = PredictionCache(max_bytes=10 * entry_bytes(100))
+    assert cache.get(1, 'a') is None
+    cache.put(1, 'a', 3, FakeArray(100))
+    assert cache.get(1, 'a')['class_idx'] == 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PredictionCache(max_bytes=2 * entry_bytes(100))
+    cache.put(1, 'a', 0, FakeArray(100))
+    cache.put(1, 'b', 1, FakeArray(100))
+    cache.get(1, 'a')  # a 变为最近使用
+    cache.put(1, 'c', 2, FakeArray(100))
+    assert cache.get(1, 'b') is None
+    assert cache.get(1, 'a') is not None
+    assert cache.get(1, 'c') is not None
+    assert cache.evictions == 1
+    assert cache.bytes_used == 2 * entry_bytes(100)
+
+
+def test_logits_count_towards_budget_and_oversized_entries_are_skipped():
+    cache = PredictionCache(max_bytes=entry_bytes(100))
+    cache.put(1, 'a', 0, FakeArray(60), logits=FakeArray(60))
+    assert cache.get(1, 'a') is None
+    assert cache.bytes_used == 0
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(prediction_cache.time, 'monotonic', lambda: now[0])
+    cache = PredictionCache(max_bytes=10 * entry_bytes(100), ttl_seconds=60)
+    cache.put(1, 'a', 0, FakeArray(100))
+    now[0] += 59
+    assert cache.get(1, 'a') is not None
+    now[0] += 2
+    assert cache.get(1, 'a') is None
+    assert cache.bytes_used == 0
+
+
+def test_entries_are_keyed_by_model_version():
+    cache = PredictionCache(max_bytes=10 * entry_bytes(100))
+    cache.put(1, 'a', 0, FakeArray(100))
+    cache.put(2, 'a', 5, FakeArray(100))
+    assert cache.get(1, 'a')['class_idx'] == 0
+    assert cache.get(2, 'a')['class_idx'] == 5
+    cache.drop_stale_versions(2)
+    assert cache.get(1, 'a') is None
+    assert cache.get(2, 'a') is not None
+    assert cache.bytes_used == entry_bytes(100)
+
+
+def test_content_hash_depends_only_on_bytes():
+    assert content_hash(b'abc') == content_hash(b'abc')
+    assert content_hash(b'abc') != content_hash(b'abd')
@@ -0,0 +1,170 @@
+# train_worker.py
+# 独立的重训练进程 (由 merged_server 启动并监督)：
+#   - 启动时按配置降低优先级 (nice)、绑定到训练专用核 (affinity)、限制 torch 线程数，
+#     DataLoader 子进程继承这些限制，推理进程预留的核不会被训练占用
+#   - 从输入 checkpoint 开始训练，结果写入输出 checkpoint，不触碰线上模型
+#   - 进度以 JSON lines 写到 stdout ({"event": "progress" | "log" | "done" | "error", ...})，
+#     其它打印一律走 stderr
+# 用法: python train_worker.py <config.json>
+import json
+import os
+import sys
+import time
+import torch
+from torch.utils.data import DataLoader, ConcatDataset
+from fast_retrain import FAST_MODES, FeatureCache, fast_retrain
+
+_progress_out = sys.stdout
+
+
+def emit(event, **fields):
+    """向父进程报告一条进度事件"""
+    _progress_out.write(json.dumps(dict(fields, event=event, ts=round(time.time(), 3)), ensure_ascii=False) + "\n")
+    _progress_out.flush()
+
+
+def apply_cpu_quota(cfg):
+    """nice / CPU 亲和性 / torch 线程数，必须在创建任何 DataLoader 之前调用"""
+    if cfg.get('nice') and hasattr(os, 'nice'):
+        os.nice(cfg['nice'])
+    cores = cfg.get('cores')
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    threads = cfg.get('threads') or (len(cores) if cores else None)
+    if threads:
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+
+
+def build_network(num_classes):
+    from torchvision.models import resnet50
+    net = resnet50(weights=None)
+    net.fc = torch.nn.Linear(net.fc.in_features, num_classes)
+    return net
+
+
+def build_transform(train):
+    """train=True: 随机增强；False: Resize 256 + CenterCrop 224 (用于提取缓存特征)"""
+    import torchvision.transforms as T
+    normalize = T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    if train:
+        return T.Compose([T.RandomResizedCrop(224), T.RandomHorizontalFlip(), T.ToTensor(), normalize])
+    return T.Compose([T.Resize(256), T.CenterCrop(224), T.ToTensor(), normalize])
+
+
+def load_original_dataset(cfg, transform, train=True):
+    """
+    原始训练集：优先使用预处理分片 (类别须与模型类别一致)，否则回退到 ImageFolder。
+    返回 (dataset, dataset_id)，dataset_id 标识数据来源，用作特征缓存键的一部分。
+    两者都不可用时：fc / layer4 模式返回 (None, None)，由 fast_retrain 使用已有的特征缓存。
+    original_dir 下是 train/val/test 划分时读 train；类别与模型不一致时直接失败，不会用错误的标签训练。
+    """
+    from torchvision import datasets
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../modelStaff'))
+    from shard_dataset import ShardDataset, shards_ready
+    shard_dir = cfg['shard_dir']
+    if shards_ready(shard_dir, check_source=True):
+        shard_dataset = ShardDataset(shard_dir, train=train)
+        if shard_dataset.classes == cfg['class_names']:
+            emit('log', message=f"📦 使用预处理分片: {shard_dir} ({len(shard_dataset)} 张)")
+            return shard_dataset, f"shards:{shard_dir}:{json.dumps(shard_dataset.index['source'], sort_keys=True)}"
+        emit('log', message=f"⚠️ 分片类别与模型类别不一致，回退到 ImageFolder: {shard_dir}")
+    train_dir = os.path.join(cfg['original_dir'], 'train')
+    folder = train_dir if os.path.isdir(train_dir) else cfg['original_dir']
+    if not os.path.exists(folder) and cfg['mode'] in FAST_MODES:
+        emit('log', message=f"⚠️ 原始训练集目录不存在 {folder}，只使用已缓存的特征")
+        return None, None
+    folder_dataset = datasets.ImageFolder(folder, transform=transform)
+    if folder_dataset.classes != cfg['class_names']:
+        raise RuntimeError(f"原始训练集类别与模型类别不一致 ({len(folder_dataset.classes)} vs {len(cfg['class_names'])}): {folder}")
+    return folder_dataset, f"folder:{folder}:{len(folder_dataset)}"
+
+
+def load_feedback_dataset(cfg, transform):
+    """反馈目录只含部分类别，ImageFolder 的下标需映射回全量类别顺序"""
+    from torchvision import datasets
+    class_names = cfg['class_names']
+    feedback_dataset = datasets.ImageFolder(cfg['feedback_dir'], transform=transform)
+    feedback_dataset.samples = [(p, class_names.index(feedback_dataset.classes[t])) for p, t in feedback_dataset.samples]
+    feedback_dataset.targets = [t for _, t in feedback_dataset.samples]
+    return feedback_dataset
+
+
+def full_finetune(cfg, new_model, device):
+    """全网微调：原始数据 + 反馈数据，带随机增强"""
+    train_transform = build_transform(train=True)
+    original_dataset, _ = load_original_dataset(cfg, train_transform)
+    combined_dataset = ConcatDataset([original_dataset, load_feedback_dataset(cfg, train_transform)])
+
+    # 建议 batch_size 不要太大
+    train_loader = DataLoader(combined_dataset, batch_size=32, shuffle=True, num_workers=cfg['num_workers'])
+    new_model.train()
+
+    criterion = torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(new_model.parameters(), lr=0.00001) # 用更小的学习率防止破坏权重
+
+    epochs = cfg['epochs']
+    for epoch in range(epochs):
+        running_loss = 0.0
+        for step, (inputs, labels) in enumerate(train_loader):
+            inputs, labels = inputs.to(device), labels.to(device)
+            optimizer.zero_grad()
+            outputs = new_model(inputs)
+            loss = criterion(outputs, labels)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+            if step % 50 == 0:
+                emit('progress', epoch=epoch + 1, epochs=epochs, step=step + 1, steps=len(train_loader))
+        emit('progress', epoch=epoch + 1, epochs=epochs, loss=round(running_loss / len(train_loader), 4))
+    return new_model
+
+
+def cached_feature_retrain(cfg, new_model, device):
+    """冻结骨干的快速重训练：原始数据集特征走缓存，只对反馈图片做前向"""
+    eval_transform = build_transform(train=False)
+    original_dataset, dataset_id = load_original_dataset(cfg, eval_transform, train=False)
+    return fast_retrain(
+        new_model, cfg['mode'], original_dataset, load_feedback_dataset(cfg, eval_transform),
+        dataset_id, FeatureCache(cfg['feature_cache_dir']), device, epochs=cfg['fast_epochs'],
+        max_cache_bytes=cfg.get('feature_cache_max_bytes'),
+        log=lambda message: emit('log', message=message),
+        on_epoch=lambda epoch, epochs, loss, acc: emit('progress', epoch=epoch, epochs=epochs,
+                                                       loss=round(loss, 4), acc=round(acc, 4))
+    )
+
+
+def main(config_path):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        cfg = json.load(f)
+    # stdout 专用于进度通道 (_progress_out)，其它库的打印重定向到 stderr
+    sys.stdout = sys.stderr
+
+    apply_cpu_quota(cfg)
+    emit('started', pid=os.getpid(), mode=cfg['mode'], cores=cfg.get('cores'), threads=torch.get_num_threads())
+    started = time.time()
+    try:
+        device = torch.device(cfg['device'])
+        new_model = build_network(len(cfg['class_names']))
+        new_model.load_state_dict(torch.load(cfg['input_checkpoint'], map_location=device))
+        new_model.to(device)
+
+        if cfg['mode'] in FAST_MODES:
+            new_model = cached_feature_retrain(cfg, new_model, device)
+        else:
+            new_model = full_finetune(cfg, new_model, device)
+
+        tmp = cfg['output_checkpoint'] + '.tmp'
+        torch.save({k: v.cpu() for k, v in new_model.state_dict().items()}, tmp)
+        os.replace(tmp, cfg['output_checkpoint'])
+        emit('done', checkpoint=cfg['output_checkpoint'], seconds=round(time.time() - started, 1))
+    except Exception as e:
+        emit('error', message=str(e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python train_worker.py <config.json>", file=sys.stderr)
+        sys.exit(2)
+    main(sys.argv[1])
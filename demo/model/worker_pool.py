@@ -0,0 +1,171 @@
+# worker_pool.py
+# 多进程推理 worker：所有进程共享同一份 ResNet50 权重 (共享内存)，每个进程绑定独立的 CPU 核
+import os
+import queue
+import threading
+import torch
+import torch.multiprocessing as mp  # 导入即为 Pipe 注册张量的共享内存序列化
+from fast_preprocess import normalize_batch
+from inference_backends import build_backend
+
+
+def build_resnet50(num_classes):
+    """构造与训练时一致的 resnet50 结构"""
+    from torchvision.models import resnet50
+    net = resnet50(weights=None)
+    net.fc = torch.nn.Linear(net.fc.in_features, num_classes)
+    return net
+
+
+def share_state_dict(state_dict, channels_last=False):
+    """
+    把 state_dict 中的张量搬到共享内存，返回可跨进程传递的字典。
+    channels_last=True 时先在父进程把卷积权重转成 channels_last，
+    worker 里的 net.to(memory_format=...) 就不会再各自复制一份。
+    """
+    shared = {}
+    for k, v in state_dict.items():
+        v = v.detach().cpu()
+        if channels_last and v.dim() == 4:
+            v = v.contiguous(memory_format=torch.channels_last)
+        shared[k] = v.share_memory_()
+    return shared
+
+
+def _build_shared_backend(shared_state, num_classes, backend_name):
+    """在 meta 设备上建结构 (不分配随机初始化权重)，assign=True 让参数直接指向共享内存"""
+    with torch.device('meta'):
+        net = build_resnet50(num_classes)
+    net.load_state_dict(shared_state, strict=True, assign=True)
+    # inplace：int8_dynamic_fc 只替换本进程的 fc，卷积权重仍是共享的那一份
+    return build_backend(backend_name, net, inplace=True)
+
+
+def split_cores(cores, num_workers):
+    """把可用核尽量均匀地切成 num_workers 份"""
+    cores = list(cores)
+    if num_workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(num_workers)]
+    size, extra = divmod(len(cores), num_workers)
+    slices, start = [], 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def _worker_main(worker_id, conn, shared_state, num_classes, cores, backend_name):
+    """子进程入口：绑核 → 直接引用共享权重建模 → 循环处理前向请求"""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(max(1, len(cores)))
+
+    backend = _build_shared_backend(shared_state, num_classes, backend_name)
+    print(f"🧵 推理 worker {worker_id} 就绪 (pid={os.getpid()}, cores={cores}, backend={backend_name})")
+
+    while True:
+        try:
+            cmd, payload = conn.recv()
+        except EOFError:
+            break
+        if cmd == 'stop':
+            break
+        try:
+            if cmd == 'forward':
+                # uint8 batch 在 worker 内归一化，进程间只传 1/4 的数据量
+                conn.send(('ok', backend(normalize_batch(payload))))
+            elif cmd == 'reload':
+                # fc 可能已被原地量化，不能再 load fp32 权重，直接按新的共享权重重建
+                backend = _build_shared_backend(payload, num_classes, backend_name)
+                conn.send(('ok', None))
+            else:
+                conn.send(('error', f"unknown command: {cmd}"))
+        except Exception as e:
+            conn.send(('error', repr(e)))
+
+
+class InferenceWorkerPool:
+    """
+    N 个 fork 出来的推理进程。权重只在父进程加载一次并放入共享内存，
+    子进程不再各自 torch.load，因此启动内存随 worker 数亚线性增长。
+    必须在启动任何后台线程之前创建 (fork 安全)。
+    """
+
+    def __init__(self, state_dict, num_classes, num_workers, backend_name='fp32', version=None):
+        ctx = mp.get_context('fork')
+        self.num_workers = num_workers
+        self.backend_name = backend_name
+        self.version = version  # 当前共享权重对应的模型版本 (由调用方定义)
+        self.shared_state = share_state_dict(state_dict, channels_last=(self.backend_name == 'channels_last'))
+        if hasattr(os, 'sched_getaffinity'):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count() or 1))
+        self.core_slices = split_cores(cores, num_workers)
+
+        self._conns = []
+        self._procs = []
+        self._idle = queue.Queue()
+        self._reload_lock = threading.Lock()
+        for i in range(num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            p = ctx.Process(
+                target=_worker_main,
+                args=(i, child_conn, self.shared_state, num_classes, self.core_slices[i], backend_name),
+                daemon=True
+            )
+            p.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(p)
+            self._idle.put(i)
+
+    def _call(self, wid, cmd, payload):
+        conn = self._conns[wid]
+        conn.send((cmd, payload))
+        status, result = conn.recv()
+        if status != 'ok':
+            raise RuntimeError(f"worker {wid} 执行 {cmd} 失败: {result}")
+        return result
+
+    def forward(self, batch):
+        """取一个空闲 worker 执行前向，返回 logits"""
+        return self.forward_versioned(batch)[1]
+
+    def forward_versioned(self, batch):
+        """同 forward，但同时返回执行前向的权重版本 (reload 期间持有全部 worker，拿到 worker 后读到的版本必然一致)"""
+        wid = self._idle.get()
+        try:
+            version = self.version
+            return version, self._call(wid, 'forward', batch)
+        finally:
+            self._idle.put(wid)
+
+    def reload(self, state_dict, version=None):
+        """热更新权重：等所有 worker 空闲后逐个替换为新的共享权重"""
+        with self._reload_lock:
+            self.shared_state = share_state_dict(state_dict, channels_last=(self.backend_name == 'channels_last'))
+            wids = [self._idle.get() for _ in range(self.num_workers)]
+            try:
+                for wid in wids:
+                    self._call(wid, 'reload', self.shared_state)
+                self.version = version
+            finally:
+                for wid in wids:
+                    self._idle.put(wid)
+
+    @property
+    def pids(self):
+        """推理进程的 pid (batch_tuner 统计峰值内存时一并计入)"""
+        return [p.pid for p in self._procs]
+
+    def stats(self):
+        return {
+            'workers': self.num_workers,
+            'backend': self.backend_name,
+            'version': self.version,
+            'idle': self._idle.qsize(),
+            'alive': sum(p.is_alive() for p in self._procs),
+            'core_slices': self.core_slices
+        }
@@ -7,7 +7,7 @@ from flask import Flask, request, jsonify
 from werkzeug.utils import secure_filename
 
 # 从我们自己的模块中导入预测函数
-from predict import predict_image, class_names
+from predict import predict_image_full, class_names
 
 # --- 1. 初始化 Flask App ---
 app = Flask(__name__)
@@ -87,15 +87,23 @@ def handle_prediction():
         # --- D. 调用模型进行预测 ---
         try:
             print("🧠 正在调用模型进行预测...")
-            predicted_class, confidence = predict_image(filepath)
+            # ?topk=3 返回前 k 个类别；?logits=1 返回 base64 float16 logits (与 top-1 同一次前向)
+            k = max(0, min(request.args.get('topk', 0, type=int), len(class_names)))
+            full = predict_image_full(filepath, k)
+            predicted_class, confidence = full['class_name'], full['confidence']
             print(f"✅ 预测完成: {predicted_class}, 置信度: {confidence:.2%}")
 
             # --- E. 准备并返回JSON结果 ---
+            prediction = {
+                'class_name': predicted_class,
+                'confidence': float(f"{confidence:.4f}") # 格式化为4位小数的浮点数
+            }
+            if k:
+                prediction['topk'] = full['topk']
+            if request.args.get('logits') == '1':
+                prediction['logits_b64'] = full['logits_b64']
             result = {
-                'prediction': {
-                    'class_name': predicted_class,
-                    'confidence': float(f"{confidence:.4f}") # 格式化为4位小数的浮点数
-                },
+                'prediction': prediction,
                 'model_info': {
                     'total_classes': len(class_names)
                 }
@@ -148,6 +156,37 @@ def receive_feedback():
             return jsonify({"error": f"处理反馈时出错: {str(e)}"}), 500
     return jsonify({"error": "未知错误"}), 500
 
+@app.route('/feedback/batch', methods=['POST'])
+def receive_feedback_batch():
+    """
+    批量接收纠错数据：多个 'file' 与同样数量、同样顺序的 'correct_label' (可选 'id' 作为调用方的记录编号)。
+    每个文件单独返回成功/失败，一个文件出错不影响其他文件。
+    """
+    files = request.files.getlist('file')
+    labels = request.form.getlist('correct_label')
+    ids = request.form.getlist('id') or [str(i) for i in range(len(files))]
+    if not files or len(files) != len(labels) or len(ids) != len(files):
+        return jsonify({"error": "请求不完整，'file'、'correct_label' (和 'id') 数量必须一致"}), 400
+
+    results = []
+    for item_id, file, correct_label in zip(ids, files, labels):
+        if file.filename == '' or not correct_label:
+            results.append({"id": item_id, "status": "error", "error": "文件或标签为空"})
+            continue
+        try:
+            label_folder = os.path.join(FEEDBACK_FOLDER, correct_label)
+            os.makedirs(label_folder, exist_ok=True)
+            file_extension = os.path.splitext(file.filename)[1]
+            save_path = os.path.join(label_folder, str(uuid.uuid4()) + file_extension)
+            file.save(save_path)
+            results.append({"id": item_id, "status": "success"})
+        except Exception as e:
+            results.append({"id": item_id, "status": "error", "error": f"处理反馈时出错: {str(e)}"})
+
+    saved = sum(1 for r in results if r['status'] == 'success')
+    print(f"收到批量反馈数据: {saved}/{len(results)} 张已保存")
+    return jsonify({"status": "success", "saved": saved, "results": results}), 200
+
 # --- 4. 启动服务 ---
 if __name__ == '__main__':
     # host='0.0.0.0' 让服务可以被外部访问
@@ -0,0 +1,54 @@
+# ==============================================================================
+#  bench_shards.py - 对比 ImageFolder (每次解码 JPEG) 与 ShardDataset (memmap 分片) 的数据加载耗时
+# ==============================================================================
+# 只测数据管线 (不做前向)，衡量每个 epoch 花在读取/解码/增强上的时间。
+# 用法: python bench_shards.py <ImageFolder根目录> <分片目录> [最多批次数=200] [num_workers=4]
+import sys
+import time
+import torch
+import torchvision.transforms as T
+from torch.utils.data import DataLoader
+from torchvision.datasets import ImageFolder
+from shard_dataset import ShardDataset
+
+BATCH_SIZE = 32
+
+train_transform = T.Compose([
+    T.RandomResizedCrop(224), T.RandomHorizontalFlip(),
+    T.ToTensor(), T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+
+def time_loader(dataset, max_batches, num_workers):
+    loader = DataLoader(dataset, batch_size=BATCH_SIZE, shuffle=True, num_workers=num_workers)
+    start = time.perf_counter()
+    images = 0
+    for i, (inputs, _) in enumerate(loader):
+        images += inputs.size(0)
+        if i + 1 >= max_batches:
+            break
+    elapsed = time.perf_counter() - start
+    return images, elapsed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("用法: python bench_shards.py <ImageFolder根目录> <分片目录> [最多批次数=200] [num_workers=4]")
+        sys.exit(1)
+    image_root, shard_dir = sys.argv[1], sys.argv[2]
+    max_batches = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    num_workers = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    torch.manual_seed(0)
+
+    folder_ds = ImageFolder(image_root, transform=train_transform)
+    shard_ds = ShardDataset(shard_dir, train=True)
+    print(f"ImageFolder: {len(folder_ds)} 张 | 分片: {len(shard_ds)} 张 | batch={BATCH_SIZE}, workers={num_workers}")
+
+    rows = []
+    for name, ds in [('ImageFolder', folder_ds), ('ShardDataset', shard_ds)]:
+        n, secs = time_loader(ds, max_batches, num_workers)
+        epoch_est = secs / n * len(ds)
+        rows.append((name, n / secs, epoch_est))
+        print(f"{name:<14} {n / secs:>8.1f} 图片/秒 | 预计每 epoch {epoch_est / 60:.1f} 分钟")
+
+    print(f"加速: {rows[1][1] / rows[0][1]:.2f}x")
@@ -7,6 +7,7 @@ import torchvision.transforms as T
 from torchvision.models import resnet50
 from PIL import Image
 import json
+import base64
 
 # --- 1. 配置参数 ---
 # 模型权重路径 (使用你训练好的那个!)
@@ -89,6 +90,34 @@ transform = T.Compose([
 ])
 
 # --- 5. 编写预测函数 ---
+def encode_logits(logits):
+    """logits 一维张量 → base64 编码的 float16 (小端字节序)"""
+    return base64.b64encode(logits.cpu().numpy().astype('<f2').tobytes()).decode('ascii')
+
+def predict_image_full(image_path, k=3):
+    """
+    一次前向同时得到 top-1、top-k 与原始 logits
+    :return: {'class_name', 'confidence', 'topk': [{'class_name', 'probability'}], 'logits_b64'}
+    """
+    image = Image.open(image_path).convert('RGB')
+    image_tensor = transform(image).unsqueeze(0).to(DEVICE)
+
+    with torch.no_grad():
+        outputs = model(image_tensor)
+        probabilities = torch.nn.functional.softmax(outputs, dim=1)
+        values, indices = torch.topk(probabilities, max(1, k), dim=1)
+
+    topk = [
+        {'class_name': class_names[i], 'probability': float(f"{v:.4f}")}
+        for v, i in zip(values[0].tolist(), indices[0].tolist())
+    ]
+    return {
+        'class_name': topk[0]['class_name'],
+        'confidence': values[0, 0].item(),
+        'topk': topk[:k],
+        'logits_b64': encode_logits(outputs[0])
+    }
+
 def predict_image(image_path):
     """
     对单张图片进行预测
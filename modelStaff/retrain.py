@@ -1,10 +1,15 @@
+import os
 import torch
 from torchvision import transforms, datasets
 from torch.utils.data import DataLoader, ConcatDataset
 from model import your_model_class # 假设你的模型定义在model.py中
+from shard_dataset import ShardDataset, shards_ready
 
 # --- 参数配置 ---
 ORIGINAL_DATA_PATH = '/home/hzcu/PlantDiseases_Final_Split' # 你最初的训练集路径
+ORIGINAL_SHARD_PATH = os.path.join(ORIGINAL_DATA_PATH + '_shards', 'train') # 原始训练集的预处理分片 (见 shard_dataset.py)，每次重训练复用
+# 数据集根目录下是 train/val/test 划分，ImageFolder 回退时读 train (与分片布局一致)，否则类别会变成划分目录名
+ORIGINAL_TRAIN_PATH = os.path.join(ORIGINAL_DATA_PATH, 'train') if os.path.isdir(os.path.join(ORIGINAL_DATA_PATH, 'train')) else ORIGINAL_DATA_PATH
 FEEDBACK_DATA_PATH = '/home/hzcu/outcomes/feedback_data'
 MODEL_LOAD_PATH = '/home/jovyan/notebook/Agri/ResNet50_v1.pth' # 当前线上的模型
 MODEL_SAVE_PATH = '/home/jovyan/notebook/Agri/ResNet50_v2.pth' # 新模型保存路径
@@ -20,8 +25,15 @@ data_transform = transforms.Compose([
 ])
 
 # 加载原始数据集和新的反馈数据集
-original_dataset = datasets.ImageFolder(ORIGINAL_DATA_PATH, transform=data_transform)
+# 原始数据集不变，优先读预处理分片；反馈数据量小且每次不同，仍按 ImageFolder 读取
+if shards_ready(ORIGINAL_SHARD_PATH, check_source=True):
+    original_dataset = ShardDataset(ORIGINAL_SHARD_PATH, train=True)
+else:
+    original_dataset = datasets.ImageFolder(ORIGINAL_TRAIN_PATH, transform=data_transform)
 feedback_dataset = datasets.ImageFolder(FEEDBACK_DATA_PATH, transform=data_transform)
+# 反馈目录只含部分类别，把它的类别下标映射到原始数据集的类别顺序
+feedback_dataset.samples = [(p, original_dataset.classes.index(feedback_dataset.classes[t])) for p, t in feedback_dataset.samples]
+feedback_dataset.targets = [t for _, t in feedback_dataset.samples]
 
 # 合并两个数据集
 combined_dataset = ConcatDataset([original_dataset, feedback_dataset])
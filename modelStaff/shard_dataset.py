@@ -0,0 +1,207 @@
+# ==============================================================================
+#  shard_dataset.py - 预处理好的 uint8 内存映射训练分片
+# ==============================================================================
+# 训练时反复解码全尺寸 JPEG 是 CPU 上的瓶颈。这里一次性把 ImageFolder 结构的数据集
+# 解码、缩放为 SIZE×SIZE 的 uint8 RGB 数组，按固定张数写成分片文件 (np.memmap 直接读取)，
+# 之后每个 epoch、每次重训练都复用同一份分片，只在张量上做随机裁剪/翻转。
+# 注意：分片只保存短边缩放后的中心正方形，非正方形原图两侧的边缘被裁掉了，
+# 因此 RandomResizedCrop 的采样范围比直接读 JPEG 时略小 (原图越狭长差别越大)。
+#
+# 转换: python shard_dataset.py <ImageFolder根目录> <输出目录> [边长=256] [每片张数=4096]
+# 约定布局: <数据集>/train → <数据集>_shards/train (val 同理)，train_2.0.py / retrain.py / merged_server 都按此查找
+# 目录结构:
+#   index.json        {size, classes, shards: [{file, count}], num_samples, source}
+#   labels.npy        int16 [num_samples]
+#   shard_00000.u8    uint8 [count, size, size, 3]
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from PIL import Image
+
+SHARD_SIZE = 256          # 分片中图片边长 (训练时再随机裁剪到 224)
+IMAGES_PER_SHARD = 4096   # 每个分片文件的图片数 (256px 时约 768MB)
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+
+
+# --- 1. 转换 ---
+def list_samples(root):
+    """按 ImageFolder 的规则列出 (路径, 类别下标)，类别为排序后的子目录名"""
+    classes = sorted(d.name for d in os.scandir(root) if d.is_dir())
+    samples = []
+    for idx, name in enumerate(classes):
+        class_dir = os.path.join(root, name)
+        for dirpath, _, files in sorted(os.walk(class_dir)):
+            for f in sorted(files):
+                if f.lower().endswith(IMAGE_EXTS):
+                    samples.append((os.path.join(dirpath, f), idx))
+    return classes, samples
+
+
+def source_fingerprint(samples):
+    """源数据指纹 (文件数 + 最新修改时间)，shards_ready(check_source=True) 用它判断分片是否过期"""
+    latest = max((os.path.getmtime(p) for p, _ in samples), default=0)
+    return {'num_files': len(samples), 'latest_mtime': latest}
+
+
+def decode_square(path, size=SHARD_SIZE):
+    """短边缩放到 size 后中心裁剪为 size×size，返回 uint8 [size, size, 3]"""
+    with Image.open(path) as img:
+        img.draft('RGB', (size, size))  # JPEG 直接按缩小比例解码
+        img = img.convert('RGB')
+        w, h = img.size
+        scale = size / min(w, h)
+        img = img.resize((max(size, round(w * scale)), max(size, round(h * scale))), Image.BILINEAR)
+        w, h = img.size
+        left, top = (w - size) // 2, (h - size) // 2
+        return np.asarray(img.crop((left, top, left + size, top + size)), dtype=np.uint8)
+
+
+def convert(image_root, out_dir, size=SHARD_SIZE, per_shard=IMAGES_PER_SHARD, num_threads=8):
+    """把 ImageFolder 目录转换为分片；损坏的图片跳过。返回 index 字典"""
+    classes, samples = list_samples(image_root)
+    os.makedirs(out_dir, exist_ok=True)
+    labels, shards = [], []
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        for shard_no, begin in enumerate(range(0, len(samples), per_shard)):
+            chunk = samples[begin:begin + per_shard]
+            decoded = list(pool.map(lambda s: _safe_decode(s[0], size), chunk))
+            ok = [(arr, label) for arr, (_, label) in zip(decoded, chunk) if arr is not None]
+            if not ok:
+                continue
+            filename = f"shard_{shard_no:05d}.u8"
+            mm = np.memmap(os.path.join(out_dir, filename), dtype=np.uint8, mode='w+',
+                           shape=(len(ok), size, size, 3))
+            for i, (arr, _) in enumerate(ok):
+                mm[i] = arr
+            mm.flush()
+            del mm
+            labels.extend(label for _, label in ok)
+            shards.append({'file': filename, 'count': len(ok)})
+            print(f"   {filename}: {len(ok)} 张 | 累计 {len(labels)}/{len(samples)} | {time.time() - start:.0f}s")
+
+    np.save(os.path.join(out_dir, 'labels.npy'), np.asarray(labels, dtype=np.int16))
+    index = {
+        'size': size,
+        'classes': classes,
+        'shards': shards,
+        'num_samples': len(labels),
+        'source': dict(source_fingerprint(samples), root=os.path.abspath(image_root))
+    }
+    tmp = os.path.join(out_dir, 'index.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, 'index.json'))  # index.json 最后写入，存在即代表分片完整
+    return index
+
+
+def _safe_decode(path, size):
+    try:
+        return decode_square(path, size)
+    except Exception as e:
+        print(f"⚠️ 跳过无法解码的图片 {path}: {e}")
+        return None
+
+
+def shards_ready(shard_dir, check_source=False):
+    """
+    分片是否可用 (index.json 存在即完整)。
+    check_source=True 时重新扫描 index 中记录的源目录并比对指纹，源数据有增删改时视为过期；
+    源目录已不存在则无法比对，照常使用分片。
+    """
+    index_path = os.path.join(shard_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return False
+    if not check_source:
+        return True
+    with open(index_path, 'r', encoding='utf-8') as f:
+        source = json.load(f).get('source', {})
+    root = source.get('root')
+    if not root or not os.path.isdir(root):
+        return True
+    current = source_fingerprint(list_samples(root)[1])
+    if current['num_files'] != source.get('num_files') or current['latest_mtime'] > source.get('latest_mtime', 0):
+        print(f"⚠️ 分片已过期 (源目录 {root} 有变化)，请重新运行 shard_dataset.py: {shard_dir}")
+        return False
+    return True
+
+
+# --- 2. Dataset ---
+class ShardDataset(Dataset):
+    """
+    读取分片的 Dataset，返回与 ImageFolder + 标准 transform 相同格式的 (归一化 float 张量, 标签)。
+    train=True:  RandomResizedCrop(crop) + 随机水平翻转 (+ 可选 jitter，作用于 uint8 张量)；
+                 只在中心正方形内采样，看不到原图两侧边缘 (见文件头说明)
+    train=False: CenterCrop(crop)
+    memmap 在各 DataLoader worker 中惰性打开，不随 Dataset 一起被 pickle。
+    """
+
+    def __init__(self, shard_dir, train=True, crop=224, scale=(0.08, 1.0), jitter=None):
+        with open(os.path.join(shard_dir, 'index.json'), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.shard_dir = shard_dir
+        self.train = train
+        self.crop = crop
+        self.scale = scale
+        self.jitter = jitter
+        self.classes = self.index['classes']
+        self.size = self.index['size']
+        self.targets = np.load(os.path.join(shard_dir, 'labels.npy')).astype(np.int64)
+        self._ends = np.cumsum([s['count'] for s in self.index['shards']])
+        self._maps = None
+
+    def __len__(self):
+        return len(self.targets)
+
+    def _open(self):
+        self._maps = [
+            np.memmap(os.path.join(self.shard_dir, s['file']), dtype=np.uint8, mode='r',
+                      shape=(s['count'], self.size, self.size, 3))
+            for s in self.index['shards']
+        ]
+
+    def __getitem__(self, idx):
+        if self._maps is None:
+            self._open()
+        shard = int(np.searchsorted(self._ends, idx, side='right'))
+        offset = idx - (self._ends[shard - 1] if shard else 0)
+        img = torch.from_numpy(np.array(self._maps[shard][offset])).permute(2, 0, 1)  # uint8 CHW
+
+        if self.train:
+            img = self._random_resized_crop(img)
+            if torch.rand(1).item() < 0.5:
+                img = img.flip(-1)
+            if self.jitter is not None:
+                img = self.jitter(img)
+        else:
+            top = left = (self.size - self.crop) // 2
+            img = img[:, top:top + self.crop, left:left + self.crop]
+
+        img = (img.float() / 255.0 - MEAN) / STD
+        return img, int(self.targets[idx])
+
+    def _random_resized_crop(self, img):
+        """与 torchvision RandomResizedCrop 相同的采样规则 (面积比例 + 宽高比)，在 uint8 张量上完成"""
+        import torchvision.transforms as T
+        import torchvision.transforms.functional as F
+        top, left, h, w = T.RandomResizedCrop.get_params(img, scale=self.scale, ratio=(3 / 4, 4 / 3))
+        return F.resized_crop(img, top, left, h, w, [self.crop, self.crop], antialias=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("用法: python shard_dataset.py <ImageFolder根目录> <输出目录> [边长=256] [每片张数=4096]")
+        sys.exit(1)
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else SHARD_SIZE
+    per_shard = int(sys.argv[4]) if len(sys.argv) > 4 else IMAGES_PER_SHARD
+    t0 = time.time()
+    idx = convert(sys.argv[1], sys.argv[2], size, per_shard)
+    print(f"✅ 转换完成: {idx['num_samples']} 张, {len(idx['shards'])} 个分片, {len(idx['classes'])} 类, 耗时 {time.time() - t0:.0f}s")
@@ -12,12 +12,15 @@ from torch.utils.data import DataLoader
 from torchvision.datasets import ImageFolder
 import torchvision.transforms as T
 from torchvision.models import resnet50, ResNet50_Weights
+from shard_dataset import ShardDataset, shards_ready
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
 # --- 1. 配置参数 (你可以在这里调整) ---
 # 数据集路径
 DATA_DIR = '/home/jovyan/notebook/Agri/PlantDiseases_Final_Split'
+# 预处理分片路径 (python shard_dataset.py <DATA_DIR>/train <SHARD_DIR>/train 生成)，不存在时回退到 ImageFolder
+SHARD_DIR = DATA_DIR + '_shards'
 # 模型名称，用于保存文件
 MODEL_NAME = 'ResNet50'
 # 训练超参数
@@ -64,8 +67,16 @@ val_test_transform = T.Compose([
     T.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
 ])
 
-train_dataset = ImageFolder(root=os.path.join(DATA_DIR, 'train'), transform=train_transform)
-val_dataset = ImageFolder(root=os.path.join(DATA_DIR, 'val'), transform=val_test_transform)
+if shards_ready(os.path.join(SHARD_DIR, 'train'), check_source=True) and \
+        shards_ready(os.path.join(SHARD_DIR, 'val'), check_source=True):
+    # 分片已是 256px uint8，随机裁剪/翻转/颜色抖动直接在张量上做，不再逐 epoch 解码 JPEG
+    jitter = T.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2)
+    train_dataset = ShardDataset(os.path.join(SHARD_DIR, 'train'), train=True, jitter=jitter)
+    val_dataset = ShardDataset(os.path.join(SHARD_DIR, 'val'), train=False)
+    logging.info(f"Using preprocessed shards from {SHARD_DIR}")
+else:
+    train_dataset = ImageFolder(root=os.path.join(DATA_DIR, 'train'), transform=train_transform)
+    val_dataset = ImageFolder(root=os.path.join(DATA_DIR, 'val'), transform=val_test_transform)
 
 train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True, num_workers=4, pin_memory=True)
 val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False, num_workers=4, pin_memory=True)